@@ -0,0 +1,171 @@
+import bisect
+import functools
+import gzip
+import json
+import os
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .fastpath import MESSAGE_FIELDS, format_datetime, message_rows
+from .models import ArchiveSegment, Message
+
+# Same fields as fastpath.message_rows(), so pagers and the fast serializer
+# handle archived and hot rows alike.
+ArchivedRow = namedtuple('ArchivedRow', MESSAGE_FIELDS)
+
+
+class MessageArchive:
+    """
+    Cold storage for old chat messages.
+
+    archive_batch() moves the oldest ``segment_size`` matching messages into
+    one gzip-compressed JSON segment file under ``directory``, records it as
+    an ArchiveSegment and deletes the rows from the messages table, all in
+    one transaction. Reads are lazy: a segment is only opened when a history
+    page reaches past the oldest hot message, and the last
+    ``cache_segments`` decoded segments are kept in memory.
+
+    Archived messages keep the username they had when archived. They are
+    not searchable and not part of since_id delta sync.
+    """
+
+    def __init__(self, directory, retention_days=None, segment_size=5000,
+                 cache_segments=8, compress_level=6):
+        self.directory = Path(directory)
+        self.retention_days = retention_days
+        self.segment_size = segment_size
+        self.compress_level = compress_level
+        self._load = functools.lru_cache(maxsize=cache_segments)(self._read)
+
+    def archive_batch(self, queryset, size=None):
+        """
+        Archive the oldest ``size`` (default segment_size) messages of
+        queryset. Returns the new ArchiveSegment, or None when there was
+        nothing left to archive.
+        """
+        size = size or self.segment_size
+        path = None
+        try:
+            # Rows are selected inside the write transaction, so none can be
+            # deleted between being copied and being removed.
+            with transaction.atomic():
+                rows = list(
+                    message_rows(queryset.order_by('created_at', 'id'))[:size]
+                )
+                if not rows:
+                    return None
+                path, size = self._write(rows)
+                segment = ArchiveSegment.objects.create(
+                    path=path.name,
+                    first_id=rows[0].id,
+                    first_created_at=rows[0].created_at,
+                    last_id=rows[-1].id,
+                    last_created_at=rows[-1].created_at,
+                    count=len(rows),
+                    size_bytes=size,
+                )
+                Message.objects.filter(id__in=[row.id for row in rows]).delete()
+        except Exception:
+            if path is not None:
+                path.unlink(missing_ok=True)
+            raise
+        return segment
+
+    def rows_before(self, key, count):
+        """
+        Up to count archived rows older than key, a (created_at, id) pair,
+        newest first. A key of None starts from the newest archived row.
+        """
+        segments = ArchiveSegment.objects.order_by('-last_created_at', '-last_id')
+        if key is not None:
+            created_at, pk = key
+            segments = segments.filter(
+                Q(first_created_at__lt=created_at)
+                | Q(first_created_at=created_at, first_id__lt=pk)
+            )
+        result = []
+        for segment in segments.iterator(chunk_size=8):
+            keys, rows = self._load(segment.path)
+            end = len(rows) if key is None else bisect.bisect_left(keys, key)
+            start = max(0, end - (count - len(result)))
+            result.extend(reversed(rows[start:end]))
+            if len(result) >= count:
+                break
+        return result
+
+    def rows_after(self, key, count):
+        """
+        Up to count archived rows newer than key, a (created_at, id) pair,
+        oldest first.
+        """
+        created_at, pk = key
+        segments = ArchiveSegment.objects.filter(
+            Q(last_created_at__gt=created_at) | Q(last_created_at=created_at, last_id__gt=pk)
+        ).order_by('first_created_at', 'first_id')
+        result = []
+        for segment in segments.iterator(chunk_size=8):
+            keys, rows = self._load(segment.path)
+            start = bisect.bisect_right(keys, key)
+            result.extend(rows[start:start + count - len(result)])
+            if len(result) >= count:
+                break
+        return result
+
+    def iter_rows(self, since_id=0):
+        """
+        Every archived row with an id above since_id, oldest first, reading
+        one segment at a time and bypassing the segment cache.
+        """
+        for segment in ArchiveSegment.objects.order_by('first_created_at', 'first_id'):
+            for row in self._read(segment.path)[1]:
+                if row.id > since_id:
+                    yield row
+
+    def clear_cache(self):
+        self._load.cache_clear()
+
+    def _write(self, rows):
+        payload = json.dumps(
+            [
+                [
+                    row.id,
+                    row.member__username,
+                    row.text,
+                    format_datetime(row.created_at, dt_timezone.utc),
+                ]
+                for row in rows
+            ],
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode()
+        data = gzip.compress(payload, compresslevel=self.compress_level, mtime=0)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f'{rows[0].created_at:%Y%m%dT%H%M%S%f}-{rows[0].id}.json.gz'
+        path = self.directory / name
+        partial = path.with_suffix('.partial')
+        with open(partial, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+        return path, len(data)
+
+    def _read(self, name):
+        with gzip.open(self.directory / name, 'rb') as f:
+            items = json.load(f)
+        rows = [
+            ArchivedRow(pk, username, text, datetime.fromisoformat(created_at))
+            for pk, username, text, created_at in items
+        ]
+        return [(row.created_at, row.id) for row in rows], rows
+
+
+message_archive = MessageArchive(**{
+    key.lower(): value for key, value in getattr(settings, 'MESSAGE_ARCHIVE', {}).items()
+})
@@ -0,0 +1,169 @@
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authentication import BaseAuthentication
+
+from .models import Token
+from .profiling import phase
+
+
+class TokenCache:
+    """
+    Bounded in-process LRU cache of token key -> Token (with member loaded).
+
+    Entries live at most ``ttl`` seconds, which bounds how long a change that
+    bypasses model signals (e.g. queryset.update()) can go unnoticed.
+    Deleting a token or changing a member bumps a generation counter kept in
+    shared memory; every worker clears its cache when it sees a new
+    generation, so revocation takes effect immediately across workers.
+    """
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._shared_generation = multiprocessing.Value('q', 0)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def generation(self):
+        return self._shared_generation.value
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._sync_generation()
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, token, generation):
+        """
+        Cache a token loaded while ``generation`` was current. The entry is
+        dropped if an invalidation happened in the meantime.
+        """
+        with self._lock:
+            self._sync_generation()
+            if generation != self._generation:
+                return
+            self._entries[key] = (token, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        """
+        Drop every cached token in all workers.
+        """
+        with self._shared_generation.get_lock():
+            self._shared_generation.value += 1
+        with self._lock:
+            self._sync_generation()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _sync_generation(self):
+        generation = self._shared_generation.value
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+
+token_cache = TokenCache(**{
+    key.lower(): value for key, value in getattr(settings, 'TOKEN_CACHE', {}).items()
+})
+
+
+def parse_token_key(auth_header):
+    """
+    Extract the key from "Bearer <key>" or a bare "<key>" header value.
+    """
+    if not auth_header:
+        return None
+    if ' ' in auth_header:
+        parts = auth_header.split(' ')
+        return parts[1] if len(parts) > 1 and parts[1] else None
+    return auth_header
+
+
+def get_token(key):
+    """
+    Return the live Token (with member) for a key, or None if it does not
+    exist or has expired. Served from token_cache when possible.
+    """
+    token = token_cache.get(key)
+    if token is None:
+        generation = token_cache.generation
+        try:
+            token = Token.objects.select_related('member').get(key=key)
+        except Token.DoesNotExist:
+            return None
+        token_cache.set(key, token, generation)
+    return None if token.is_expired else token
+
+
+async def aget_token(key):
+    """
+    Async variant of get_token().
+    """
+    token = token_cache.get(key)
+    if token is None:
+        generation = token_cache.generation
+        try:
+            token = await Token.objects.select_related('member').aget(key=key)
+        except Token.DoesNotExist:
+            return None
+        token_cache.set(key, token, generation)
+    return None if token.is_expired else token
+
+
+class TokenAuthentication(BaseAuthentication):
+    """
+    DRF authentication class for Member tokens.
+    Accepts both "Authorization: Bearer <key>" and a bare "<key>" header.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        key = parse_token_key(request.headers.get('Authorization'))
+        if not key:
+            return None
+
+        with phase('auth'):
+            token = get_token(key)
+        if token is None:
+            return None
+        return token.member, token
+
+    def authenticate_header(self, request):
+        return self.keyword
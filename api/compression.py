@@ -0,0 +1,134 @@
+"""
+gzip compression of API responses.
+
+Message history is very repetitive JSON: every row repeats the same keys,
+a handful of usernames and timestamps sharing most of their digits, so it
+shrinks severalfold. nginx proxies /api/ unbuffered and does not compress
+it, so this is done here, for the content types and sizes configured in
+settings.COMPRESSION.
+
+gzip only: it is in the standard library, and every client speaks it.
+brotli and zstd would need new dependencies.
+"""
+
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS  # deflate in a gzip container
+CONTENT_TYPES = ('application/json', 'application/x-ndjson')
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Whether an Accept-Encoding header allows gzip: listed, or covered by
+    "*", with a q-value above 0.
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def gzip_compress(data, level):
+    return zlib.compress(data, level, wbits=GZIP_WBITS)
+
+
+def gzip_stream(chunks, level):
+    """
+    gzip a sequence of byte strings as one stream. Each chunk is flushed
+    through as soon as it is compressed, so the client gets it as early as
+    it would have uncompressed.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        if chunk:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def agzip_stream(chunks, level):
+    """
+    gzip_stream() for async iterators.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    async for chunk in chunks:
+        if chunk:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    gzips responses of the configured CONTENT_TYPES for clients that accept
+    it: MIN_SIZE bytes or more at LEVEL, and streamed responses, whose size
+    is not known up front, always, at STREAMING_LEVEL. A response that does
+    not get smaller is sent as it is.
+
+    Goes right after api.metrics in MIDDLEWARE, so the response sizes it
+    records are the bytes actually sent.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        config = getattr(settings, 'COMPRESSION', {})
+        if not config.get('ENABLED', True):
+            raise MiddlewareNotUsed
+        self.min_size = config.get('MIN_SIZE', 1024)
+        self.level = config.get('LEVEL', 6)
+        self.streaming_level = config.get('STREAMING_LEVEL', self.level)
+        self.content_types = frozenset(config.get('CONTENT_TYPES', CONTENT_TYPES))
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').partition(';')[0].strip()
+        if content_type not in self.content_types:
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if not accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = agzip_stream(
+                    response.streaming_content, self.streaming_level
+                )
+            else:
+                response.streaming_content = gzip_stream(
+                    response.streaming_content, self.streaming_level
+                )
+            del response['Content-Length']
+        else:
+            compressed = gzip_compress(response.content, self.level)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # The representation changed: a strong ETag must not match it
+        # (RFC 9110 8.8.1). If-None-Match compares weakly, so revalidation
+        # still gets its 304.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = 'gzip'
+        return response
@@ -0,0 +1,149 @@
+"""
+Fast read path for chat history, including the streamed full export.
+
+ChatMessageSerializer builds a field object graph per row and walks
+member.username through a related Member instance; for pages of history
+that costs more than the query. Here rows come straight from
+values_list() (one JOIN, no model instances) and are turned into the same
+dicts with plain attribute access. Rendered by DRF's JSONRenderer, which
+uses the C JSON encoder, the bytes are identical to the serializer's.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .models import Member
+
+MESSAGE_FIELDS = ('id', 'member__username', 'text', 'created_at')
+ROOM_MESSAGE_FIELDS = ('id', 'member_id', 'text', 'created_at')
+
+
+def message_rows(queryset):
+    """
+    Turn a Message queryset into named rows with the fields the API returns.
+    Rows have ``id`` and ``created_at`` like Message instances, so they can
+    go through the cursor paginators unchanged.
+    """
+    return queryset.values_list(*MESSAGE_FIELDS, named=True)
+
+
+def format_datetime(value, tz=None):
+    """
+    Same string as DRF's DateTimeField: ISO 8601 in the current time zone,
+    with UTC written as 'Z'. Pass ``tz`` when formatting many values; looking
+    up the current time zone costs more than the formatting.
+    """
+    value = value.astimezone(tz or timezone.get_current_timezone()).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def serialize_message_rows(rows):
+    """
+    ChatMessageSerializer(..., many=True).data for rows from message_rows().
+    """
+    tz = timezone.get_current_timezone()
+    return [_row_to_dict(row, tz) for row in rows]
+
+
+def _row_to_dict(row, tz):
+    return {
+        'id': row.id,
+        'username': row.member__username,
+        'text': row.text,
+        'created_at': format_datetime(row.created_at, tz),
+    }
+
+
+def room_message_rows(queryset):
+    """
+    message_rows() for a RoomMessage queryset. A shard database has no
+    members table to join, so rows carry member_id instead of the username.
+    """
+    return queryset.values_list(*ROOM_MESSAGE_FIELDS, named=True)
+
+
+def serialize_room_message_rows(rows):
+    """
+    serialize_message_rows() for room_message_rows(): the same dicts, with
+    the usernames read from the members table in one query.
+    """
+    rows = list(rows)
+    usernames = dict(
+        Member.objects.filter(id__in={row.member_id for row in rows})
+        .values_list('id', 'username')
+    )
+    tz = timezone.get_current_timezone()
+    return [
+        {
+            'id': row.id,
+            'username': usernames.get(row.member_id),
+            'text': row.text,
+            'created_at': format_datetime(row.created_at, tz),
+        }
+        for row in rows
+    ]
+
+
+# Same output as DRF's JSONRenderer with its default settings.
+_encode = json.JSONEncoder(
+    ensure_ascii=False, allow_nan=False, separators=(',', ':')
+).encode
+
+
+def _escape_separators(text):
+    # JSONRenderer escapes these so the output is also valid JavaScript.
+    return text.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def stream_message_rows(rows, ndjson=False, chunk_size=2000):
+    """
+    Encode a message_rows() queryset (or any iterable of such rows) as it
+    is read, yielding bytes: one JSON array (the same bytes JSONRenderer
+    would produce for the whole list) or one JSON object per line. At most
+    ``chunk_size`` rows are held in memory at a time.
+    """
+    if isinstance(rows, QuerySet):
+        rows = rows.iterator(chunk_size=chunk_size)
+    tz = timezone.get_current_timezone()
+    batch = []
+    first = True
+    if not ndjson:
+        yield b'['
+    for row in rows:
+        batch.append(_row_to_dict(row, tz))
+        if len(batch) >= chunk_size:
+            yield _encode_batch(batch, ndjson, first)
+            batch = []
+            first = False
+    if batch:
+        yield _encode_batch(batch, ndjson, first)
+    if not ndjson:
+        yield b']'
+
+
+def _encode_batch(batch, ndjson, first):
+    if ndjson:
+        text = ''.join(_encode(item) + '\n' for item in batch)
+    else:
+        # One encoder call per batch; drop the brackets and join the batches
+        # with commas.
+        text = _encode(batch)[1:-1]
+        if not first:
+            text = ',' + text
+    return _escape_separators(text).encode()
+
+
+async def aiter_chunks(chunks):
+    """
+    Async wrapper for stream_message_rows(). Under ASGI, Django buffers a
+    synchronous streaming iterator completely before sending it; this
+    pulls one chunk at a time on the request's sync thread instead.
+    """
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
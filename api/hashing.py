@@ -0,0 +1,113 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import django
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .profiling import phase
+
+
+class HashingUnavailable(APIException):
+    """
+    Too many password hashes are already running or queued.
+    DRF's exception handler turns ``wait`` into a Retry-After header.
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Server is busy, please retry shortly."
+    default_code = 'hashing_unavailable'
+
+    def __init__(self, wait):
+        super().__init__()
+        self.wait = wait
+
+
+def _init_worker(settings_module, nice):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+    if nice:
+        os.nice(nice)
+
+
+class PasswordHasherPool:
+    """
+    Runs PBKDF2 password hashing off the request threads.
+
+    At most ``workers`` hashes run at once (in a process pool started
+    lazily in each gunicorn worker) and at most ``max_queue`` more wait for
+    a slot. Requests beyond that are rejected at once with 503 and
+    Retry-After instead of piling up behind a login storm. A slot is held
+    until its hash has finished, even if the request gave up waiting after
+    ``timeout`` seconds: a running hash cannot be cancelled, and the work
+    still occupies the pool. Pool processes can run at lower priority
+    (``nice``), at the cost of slower logins whenever chat traffic keeps the
+    CPU busy. With ``workers=0`` hashing runs inline, still under admission
+    control.
+    """
+
+    def __init__(self, workers=2, max_queue=4, timeout=10, retry_after=1, nice=0):
+        self.workers = workers
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.nice = nice
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_queue)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    # Hashing time shows up as auth in profiled requests.
+    def make_password(self, password):
+        with phase('auth'):
+            return self._run(hashers.make_password, password)
+
+    def check_password(self, password, encoded):
+        with phase('auth'):
+            return self._run(hashers.check_password, password, encoded)
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingUnavailable(self.retry_after)
+        if not self.workers:
+            try:
+                return func(*args)
+            finally:
+                self._slots.release()
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Only a hash still waiting for a process is cancelled (and its
+            # slot released); a running one keeps its slot until done.
+            future.cancel()
+            raise HashingUnavailable(self.retry_after)
+
+    def _get_executor(self):
+        # Pools don't survive fork; every gunicorn worker starts its own.
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            with self._lock:
+                if self._executor_pid != pid:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_worker,
+                        initargs=(os.environ['DJANGO_SETTINGS_MODULE'], self.nice),
+                    )
+                    self._executor_pid = pid
+        return self._executor
+
+
+password_hasher = PasswordHasherPool(**{
+    key.lower(): value for key, value in getattr(settings, 'PASSWORD_HASHING', {}).items()
+})
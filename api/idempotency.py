@@ -0,0 +1,141 @@
+"""
+Idempotent message posts.
+
+A client that retries POST /api/messages/ after a lost response sends the
+same Idempotency-Key header with every attempt. The key is stored with the
+message (Message.client_id, unique per member), so a retry never inserts
+a second row: it gets the original message back instead, with an
+Idempotent-Replayed: true header.
+
+Retries usually come in bursts, within seconds of the original post. The
+payloads of recently posted keys are kept in memory, so a retry that
+reaches the same worker is answered without touching the database; one
+that reaches another worker is caught by the unique index and answered
+with one lookup.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+
+from .models import Message
+from .serializers import ChatMessageSerializer
+from .writer import message_writer
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+KEY_PATTERN = re.compile(r'[\x21-\x7e]{1,64}')
+
+
+class IdempotencyCache:
+    """
+    Bounded in-process cache of (member id, key) -> ChatMessageSerializer
+    payload of the message posted with that key. Entries expire ``window``
+    seconds after they were added; past that, the unique index still
+    catches a retry.
+    """
+
+    def __init__(self, max_size=10000, window=300):
+        self.max_size = max_size
+        self.window = window
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, member_id, key):
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get((member_id, key))
+            return None if entry is None else entry[0]
+
+    def set(self, member_id, key, payload):
+        with self._lock:
+            self._entries[(member_id, key)] = (payload, time.monotonic() + self.window)
+            self._entries.move_to_end((member_id, key))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _expire(self, now):
+        # Every entry lives for the same window, so the oldest come first.
+        while self._entries:
+            key, (_, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[key]
+
+
+idempotency_cache = IdempotencyCache(**{
+    key.lower(): value for key, value in getattr(settings, 'IDEMPOTENCY', {}).items()
+})
+
+
+def is_valid_key(key):
+    """
+    Keys are 1 to 64 printable ASCII characters without spaces, e.g. a UUID.
+    """
+    return KEY_PATTERN.fullmatch(key) is not None
+
+
+def create_message(member, text, key=None):
+    """
+    Post a message, or find the one already posted with ``key``. Returns
+    (ChatMessageSerializer payload, whether it is a replay).
+    """
+    if key is not None:
+        payload = idempotency_cache.get(member.pk, key)
+        if payload is not None:
+            return payload, True
+    try:
+        message = message_writer.create(member, text, client_id=key)
+    except IntegrityError:
+        payload = _find_original(member, key) if key is not None else None
+        if payload is None:
+            raise
+        return payload, True
+    payload = ChatMessageSerializer(message).data
+    if key is not None:
+        idempotency_cache.set(member.pk, key, payload)
+    return payload, False
+
+
+async def acreate_message(member, text, key=None):
+    """
+    create_message() for async views.
+    """
+    if key is not None:
+        payload = idempotency_cache.get(member.pk, key)
+        if payload is not None:
+            return payload, True
+    try:
+        message = await message_writer.acreate(member, text, client_id=key)
+    except IntegrityError:
+        payload = await sync_to_async(_find_original)(member, key) if key is not None else None
+        if payload is None:
+            raise
+        return payload, True
+    payload = ChatMessageSerializer(message).data
+    if key is not None:
+        idempotency_cache.set(member.pk, key, payload)
+    return payload, False
+
+
+def _find_original(member, key):
+    try:
+        message = Message.objects.get(member=member, client_id=key)
+    except Message.DoesNotExist:
+        return None
+    message.member = member
+    payload = ChatMessageSerializer(message).data
+    idempotency_cache.set(member.pk, key, payload)
+    return payload
@@ -0,0 +1,96 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from api.archive import message_archive
+from api.models import ArchiveSegment, Message
+from api.sqlite import file_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than the retention period into compressed "
+        "archive segments and delete them from the messages table. Each "
+        "segment is written and its messages deleted in one short "
+        "transaction; archived history stays readable through the API. "
+        "Meant to be run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=message_archive.retention_days,
+            help="Archive messages older than this many days "
+            "(default: MESSAGE_ARCHIVE['RETENTION_DAYS'])",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=message_archive.segment_size,
+            help="Messages per segment and transaction "
+            f"(default: {message_archive.segment_size})",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.05,
+            help="Seconds to sleep between batches (default: 0.05)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be archived",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] is None:
+            raise CommandError(
+                "No retention period: pass --days or set "
+                "MESSAGE_ARCHIVE['RETENTION_DAYS']."
+            )
+        if options["days"] < 0 or options["batch_size"] <= 0:
+            raise CommandError("--days must be >= 0 and --batch-size > 0.")
+
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        old = Message.objects.filter(created_at__lt=cutoff)
+        self.report("before", self.table_stats(), expired=old.count())
+        if options["dry_run"]:
+            return
+
+        started = time.monotonic()
+        archived = segments = 0
+        while segment := message_archive.archive_batch(old, options["batch_size"]):
+            archived += segment.count
+            segments += 1
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        self.report(
+            "after",
+            self.table_stats(),
+            archived=archived,
+            segments=segments,
+            seconds=round(time.monotonic() - started, 3),
+        )
+
+    def table_stats(self):
+        totals = ArchiveSegment.objects.aggregate(
+            archived_rows=Sum("count"), archive_bytes=Sum("size_bytes")
+        )
+        return {
+            "rows": Message.objects.count(),
+            "archived_rows": totals["archived_rows"] or 0,
+            "archive_bytes": totals["archive_bytes"] or 0,
+            **file_stats(connection),
+        }
+
+    def report(self, label, stats, **extra):
+        values = {**stats, **extra}
+        self.stdout.write(
+            f"{label}: " + " ".join(f"{key}={value}" for key, value in values.items())
+        )
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from api.models import Room, RoomMessage
+
+
+class Command(BaseCommand):
+    help = (
+        "Move a room's messages to another database: one of ROOM_SHARDS, or "
+        "back to 'default'. The messages are copied and deleted, and the "
+        "room switched over, while the source database's write lock is held, "
+        "so posts to rooms there wait (up to busy_timeout) until it is done; "
+        "run it when the room is quiet. The copies get new ids in the target "
+        "database, so clients' pagination cursors are only exact up to "
+        "messages sharing a timestamp."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("room", help="Room name")
+        parser.add_argument("shard", help="Target database alias")
+
+    def handle(self, *args, **options):
+        target = options["shard"]
+        if target != DEFAULT_DB_ALIAS and target not in settings.ROOM_SHARDS:
+            raise CommandError(
+                f"Unknown shard {target!r}; expected 'default' or one of "
+                f"{', '.join(settings.ROOM_SHARDS) or 'no ROOM_SHARDS'}."
+            )
+        try:
+            room = Room.objects.get(name=options["room"])
+        except Room.DoesNotExist:
+            raise CommandError(f"No room named {options['room']!r}.")
+        source = room.shard
+        if source == target:
+            self.stdout.write(f"{room.name} is already in {target}.")
+            return
+
+        messages = RoomMessage.objects.using(source).filter(room=room)
+        rows = messages.order_by("created_at", "id").values_list(
+            "member_id", "text", "created_at"
+        )
+        ops = connections[target].ops
+        with transaction.atomic(using=source), transaction.atomic(using=DEFAULT_DB_ALIAS):
+            with transaction.atomic(using=target), connections[target].cursor() as cursor:
+                # Plain INSERTs: bulk_create() would overwrite created_at
+                # (auto_now_add).
+                cursor.executemany(
+                    "INSERT INTO room_messages (room_id, member_id, text, created_at) "
+                    "VALUES (%s, %s, %s, %s)",
+                    (
+                        (room.id, member_id, text, ops.adapt_datetimefield_value(created_at))
+                        for member_id, text, created_at in rows.iterator()
+                    ),
+                )
+                moved = cursor.rowcount
+            Room.objects.filter(pk=room.pk).update(shard=target)
+            messages.delete()
+        self.stdout.write(f"moved {room.name}: {moved} messages, {source} -> {target}")
@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import Token
+from api.sqlite import file_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired tokens in small batches. Each batch is its own short "
+        "transaction, so the SQLite write lock is never held for long and "
+        "request traffic keeps flowing between batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Tokens deleted per transaction (default: 500)",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.05,
+            help="Seconds to sleep between batches (default: 0.05)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be deleted",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = Token.objects.filter(expires_at__lte=now)
+        before = self.table_stats()
+        expired_count = expired.count()
+        self.report("before", before, expired=expired_count)
+        if options["dry_run"]:
+            return
+
+        started = time.monotonic()
+        deleted = batches = 0
+        while True:
+            ids = list(expired.values_list("id", flat=True)[: options["batch_size"]])
+            if not ids:
+                break
+            with transaction.atomic():
+                deleted += Token.objects.filter(id__in=ids).delete()[1].get(
+                    Token._meta.label, 0
+                )
+            batches += 1
+            if options["pause"]:
+                time.sleep(options["pause"])
+
+        self.report(
+            "after",
+            self.table_stats(),
+            deleted=deleted,
+            batches=batches,
+            seconds=round(time.monotonic() - started, 3),
+        )
+
+    def table_stats(self):
+        return {"rows": Token.objects.count(), **file_stats(connection)}
+
+    def report(self, label, stats, **extra):
+        values = {**stats, **extra}
+        self.stdout.write(
+            f"{label}: " + " ".join(f"{key}={value}" for key, value in values.items())
+        )
@@ -0,0 +1,102 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.models import Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-index messages for full-text search in batches. The index is "
+        "updated in place, one short transaction per batch, so search keeps "
+        "working and writes keep flowing while it runs. Index entries for "
+        "messages that no longer exist are removed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Messages re-indexed per transaction (default: 5000)",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.05,
+            help="Seconds to sleep between batches (default: 0.05)",
+        )
+        parser.add_argument(
+            "--optimize",
+            action="store_true",
+            help="Merge the index b-trees afterwards (one longer transaction)",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("Full-text search needs SQLite FTS5.")
+        batch_size = options["batch_size"]
+        started = time.monotonic()
+
+        # Messages created from now on are indexed by the insert trigger.
+        high = Message.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        indexed = batches = last = 0
+        while last < high:
+            ids = list(
+                Message.objects.filter(id__gt=last, id__lte=high)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO messages_fts (rowid, text) "
+                    "SELECT id, text FROM messages WHERE id >= %s AND id <= %s",
+                    [ids[0], ids[-1]],
+                )
+            indexed += len(ids)
+            batches += 1
+            last = ids[-1]
+            self.pause(options["pause"])
+
+        removed = self.remove_orphans(batch_size, options["pause"])
+
+        if options["optimize"]:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO messages_fts (messages_fts) VALUES ('optimize')"
+                )
+
+        self.stdout.write(
+            f"indexed={indexed} removed={removed} batches={batches} "
+            f"seconds={round(time.monotonic() - started, 3)}"
+        )
+
+    def remove_orphans(self, batch_size, pause):
+        removed = last = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT rowid FROM messages_fts WHERE rowid > %s "
+                    "ORDER BY rowid LIMIT %s",
+                    [last, batch_size],
+                )
+                rowids = [row[0] for row in cursor.fetchall()]
+                if not rowids:
+                    return removed
+                existing = set(
+                    Message.objects.filter(id__in=rowids).values_list("id", flat=True)
+                )
+                orphans = [rowid for rowid in rowids if rowid not in existing]
+                for rowid in orphans:
+                    cursor.execute("DELETE FROM messages_fts WHERE rowid = %s", [rowid])
+            removed += len(orphans)
+            last = rowids[-1]
+            self.pause(pause)
+
+    @staticmethod
+    def pause(seconds):
+        if seconds:
+            time.sleep(seconds)
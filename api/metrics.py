@@ -0,0 +1,402 @@
+import bisect
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.urls import URLPattern, URLResolver, get_resolver
+
+from .authentication import parse_token_key, token_cache
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS', 'other')
+STATUSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+# Layout of one series (route x method) in a worker's slot. Histogram
+# buckets are stored non-cumulative and accumulated when collected.
+_STATUS = 0
+_LATENCY = _STATUS + len(STATUSES)
+_LATENCY_SUM = _LATENCY + len(LATENCY_BUCKETS) + 1
+_DB_QUERIES = _LATENCY_SUM + 1
+_DB_SECONDS = _DB_QUERIES + 1
+_SIZE = _DB_SECONDS + 1
+_SIZE_SUM = _SIZE + len(SIZE_BUCKETS) + 1
+SERIES_FIELDS = _SIZE_SUM + 1
+
+# Token cache counters at the start of every slot, followed by the series.
+TOKEN_CACHE_FIELDS = ('hits', 'misses', 'evictions', 'size')
+_SERIES_START = len(TOKEN_CACHE_FIELDS)
+
+_queries = ContextVar('metrics_queries', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding each query's count and duration to the
+    request being measured by MetricsMiddleware, if any.
+    """
+    stats = _queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+def install_query_counter(sender, connection, **kwargs):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+connection_created.connect(install_query_counter)
+
+
+def url_routes(patterns=None, prefix=''):
+    """
+    Every route of the URLconf, as reported by ResolverMatch.route.
+    """
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    routes = []
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            routes.extend(url_routes(pattern.url_patterns, route))
+        elif isinstance(pattern, URLPattern):
+            routes.append(route)
+    return routes
+
+
+class MetricsRegistry:
+    """
+    Request metrics shared by all workers of a deployment.
+
+    The counters live in one shared-memory array (see api.notify), so every
+    worker sees it. Each worker claims a slot of its own and is the only
+    writer to it, so recording a request takes no cross-process lock;
+    collect() sums the slots. A worker that replaces a dead one takes over its slot and keeps
+    adding to its counters, which therefore never go backwards.
+
+    A series is a (route, method) pair. Series are numbered in a table
+    shared by the workers the first time any of them sees the pair; when
+    the table is full, further pairs are counted under series 0, which is
+    reported as route "other".
+
+    Claiming a slot and numbering a series do take a cross-process lock,
+    once per worker and pair. A killed worker may never release it, so
+    after ``lock_timeout`` seconds the request goes unmeasured, or counted
+    under series 0, and the next one tries again.
+    """
+    lock_timeout = 0.05
+
+    def __init__(self, max_workers=16, max_series=256):
+        self.max_workers = max_workers
+        self.max_series = max_series
+        self.slot_size = _SERIES_START + max_series * SERIES_FIELDS
+        self._shared_lock = multiprocessing.Lock()
+        self._values = multiprocessing.RawArray('d', max_workers * self.slot_size)
+        self._pids = multiprocessing.RawArray('q', max_workers)
+        # (route index + 1, method index) per series; 0 is the overflow series.
+        self._series_keys = multiprocessing.RawArray('i', max_series * 2)
+        self._series_count = multiprocessing.RawValue('i', 1)
+        self._view = memoryview(self._values).cast('B').cast('d')
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._slot = None
+        self._series = {}
+        self._routes = None
+        self._token_cache_base = None
+
+    def observe(self, request, response, elapsed, queries):
+        """
+        Record one finished request: ``elapsed`` seconds, ``queries`` as
+        [count, seconds] spent in the database.
+        """
+        slot = self._slot
+        if slot is None:
+            slot = self._claim()
+        if slot is False:
+            return
+        match = request.resolver_match
+        key = (match.route if match is not None else None, request.method)
+        series = self._series.get(key)
+        if series is None:
+            series = self._register(key)
+        base = _SERIES_START + series * SERIES_FIELDS
+        # HttpResponse only accepts status codes 100-599.
+        status = response.status_code // 100 - 1
+        latency = bisect.bisect_left(LATENCY_BUCKETS, elapsed)
+        if response.streaming:
+            size = response.get('Content-Length')
+        else:
+            size = len(response.content)
+        cache = token_cache
+        base_hits, base_misses, base_evictions = self._token_cache_base
+        with self._lock:
+            slot[base + status] += 1
+            slot[base + _LATENCY + latency] += 1
+            slot[base + _LATENCY_SUM] += elapsed
+            slot[base + _DB_QUERIES] += queries[0]
+            slot[base + _DB_SECONDS] += queries[1]
+            if size is not None:
+                size = int(size)
+                slot[base + _SIZE + bisect.bisect_left(SIZE_BUCKETS, size)] += 1
+                slot[base + _SIZE_SUM] += size
+            slot[0] = base_hits + cache.hits
+            slot[1] = base_misses + cache.misses
+            slot[2] = base_evictions + cache.evictions
+            slot[3] = len(cache)
+
+    def _claim(self):
+        with self._lock:
+            if self._slot is not None:
+                return self._slot
+            pid = os.getpid()
+            if not self._shared_lock.acquire(timeout=self.lock_timeout):
+                return False
+            try:
+                for index, owner in enumerate(self._pids):
+                    if owner == 0 or not _alive(owner):
+                        self._pids[index] = pid
+                        break
+                else:
+                    # More live workers than max_workers: this one is not
+                    # measured.
+                    self._slot = False
+                    return False
+            finally:
+                self._shared_lock.release()
+            slot = self._view[index * self.slot_size:(index + 1) * self.slot_size]
+            # Counters carried over from a dead worker continue from where
+            # it stopped.
+            self._token_cache_base = tuple(
+                slot[field] - getattr(token_cache, name)
+                for field, name in enumerate(TOKEN_CACHE_FIELDS[:3])
+            )
+            slot[3] = len(token_cache)
+            self._slot = slot
+            return slot
+
+    def _register(self, key):
+        route, method = key
+        routes = self.routes()
+        route_index = routes.index(route) + 1 if route in routes else 0
+        method_index = METHODS.index(method) if method in METHODS else len(METHODS) - 1
+        shared_key = (route_index, method_index)
+        if not self._shared_lock.acquire(timeout=self.lock_timeout):
+            return 0
+        try:
+            keys = self._series_keys
+            count = self._series_count.value
+            for series in range(1, count):
+                if (keys[series * 2], keys[series * 2 + 1]) == shared_key:
+                    break
+            else:
+                if count < self.max_series:
+                    series = count
+                    keys[series * 2], keys[series * 2 + 1] = shared_key
+                    self._series_count.value = count + 1
+                else:
+                    series = 0
+        finally:
+            self._shared_lock.release()
+        self._series[key] = series
+        return series
+
+    def routes(self):
+        # The same URLconf in every worker, so the same indexes.
+        if self._routes is None:
+            self._routes = url_routes()
+        return self._routes
+
+    def collect(self):
+        """
+        Sum the slots of all workers, past and present. Returns
+        (series, token_cache): a list of (route, method, values) for the
+        series that saw requests, and a dict of the token cache counters.
+        The cache size is summed over live workers only.
+        """
+        slots = []
+        cache = dict.fromkeys(TOKEN_CACHE_FIELDS, 0)
+        for index, pid in enumerate(self._pids):
+            if pid == 0:
+                continue
+            slot = self._view[index * self.slot_size:(index + 1) * self.slot_size]
+            slots.append(slot)
+            cache['hits'] += int(slot[0])
+            cache['misses'] += int(slot[1])
+            cache['evictions'] += int(slot[2])
+            if pid == os.getpid() or _alive(pid):
+                cache['size'] += int(slot[3])
+
+        routes = self.routes()
+        series = []
+        for index in range(self._series_count.value):
+            start = _SERIES_START + index * SERIES_FIELDS
+            values = [0.0] * SERIES_FIELDS
+            for slot in slots:
+                values = list(map(sum, zip(values, slot[start:start + SERIES_FIELDS])))
+            if not any(values[_STATUS:_LATENCY]):
+                continue
+            if index == 0:
+                route, method = 'other', 'other'
+            else:
+                route_index = self._series_keys[index * 2]
+                route = routes[route_index - 1] if route_index else 'unmatched'
+                method = METHODS[self._series_keys[index * 2 + 1]]
+            series.append((route, method, values))
+        return sorted(series, key=lambda item: item[:2]), cache
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        series, cache = self.collect()
+        lines = []
+
+        def family(name, kind, description):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, buckets, counts, total, labels):
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {int(cumulative)}')
+            lines.append(f'{name}_sum{{{labels}}} {total!r}')
+            lines.append(f'{name}_count{{{labels}}} {int(cumulative)}')
+
+        family('http_requests_total', 'counter', 'Requests by route, method and status class.')
+        for route, method, values in series:
+            for status, count in zip(STATUSES, values[_STATUS:_LATENCY]):
+                if count:
+                    lines.append(
+                        f'http_requests_total{{{_labels(route, method)},status="{status}"}}'
+                        f' {int(count)}'
+                    )
+
+        family('http_request_duration_seconds', 'histogram', 'Time spent in Django per request.')
+        for route, method, values in series:
+            histogram(
+                'http_request_duration_seconds', LATENCY_BUCKETS,
+                values[_LATENCY:_LATENCY_SUM], values[_LATENCY_SUM], _labels(route, method),
+            )
+
+        family('http_request_db_queries_total', 'counter', 'Database queries run by requests.')
+        for route, method, values in series:
+            lines.append(
+                f'http_request_db_queries_total{{{_labels(route, method)}}} {int(values[_DB_QUERIES])}'
+            )
+
+        family('http_request_db_seconds_total', 'counter', 'Time requests spent in database queries.')
+        for route, method, values in series:
+            lines.append(
+                f'http_request_db_seconds_total{{{_labels(route, method)}}} {values[_DB_SECONDS]!r}'
+            )
+
+        family('http_response_size_bytes', 'histogram', 'Response body sizes (streamed responses excluded).')
+        for route, method, values in series:
+            histogram(
+                'http_response_size_bytes', SIZE_BUCKETS,
+                values[_SIZE:_SIZE_SUM], values[_SIZE_SUM], _labels(route, method),
+            )
+
+        for name in ('hits', 'misses', 'evictions'):
+            family(f'token_cache_{name}_total', 'counter', f'Token cache {name}.')
+            lines.append(f'token_cache_{name}_total {cache[name]}')
+        lookups = cache['hits'] + cache['misses']
+        family('token_cache_hit_ratio', 'gauge', 'Share of token lookups served by the cache.')
+        lines.append(f'token_cache_hit_ratio {cache["hits"] / lookups if lookups else 0.0!r}')
+        family('token_cache_size', 'gauge', 'Tokens cached across live workers.')
+        lines.append(f'token_cache_size {cache["size"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(route, method):
+    route = route.replace('\\', '\\\\').replace('"', '\\"')
+    return f'route="{route}",method="{method}"'
+
+
+class MetricsMiddleware:
+    """
+    Records every request handled by Django in ``metrics``. Goes right
+    after api.profiling in MIDDLEWARE so the latency covers the other
+    middleware too. Streamed bodies are sent after the middleware returns:
+    their time and queries are not included, and their size only when
+    Content-Length is set.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        queries = [0, 0.0]
+        token = _queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            _queries.reset(token)
+        metrics.observe(request, response, elapsed, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = [0, 0.0]
+        token = _queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - started
+            _queries.reset(token)
+        metrics.observe(request, response, elapsed, queries)
+        return response
+
+
+metrics = MetricsRegistry(**{
+    key.lower(): value for key, value in getattr(settings, 'METRICS', {}).items()
+})
+
+
+def is_scraper(request):
+    """
+    Whether the request carries ``Authorization: Bearer <METRICS_TOKEN>``.
+    Without a METRICS_TOKEN setting nobody is.
+    """
+    expected = getattr(settings, 'METRICS_TOKEN', None)
+    key = parse_token_key(request.META.get('HTTP_AUTHORIZATION'))
+    if not expected or key is None:
+        return False
+    return hmac.compare_digest(key.encode(), expected.encode())
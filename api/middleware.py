@@ -0,0 +1,60 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+
+API_PREFIX = '/api/'
+
+# The rest of the chain below ApiBypassEndMiddleware, handed over to
+# ApiBypassMiddleware. Django builds a handler's middleware innermost
+# first, so the end marker is always built right before its start.
+_bypass_target = None
+
+
+class ApiBypassMiddleware:
+    """
+    Sends requests for /api/ past the middleware between this one and
+    ApiBypassEndMiddleware in MIDDLEWARE. Those are the session, CSRF,
+    auth, messages and clickjacking middleware that the admin needs and the
+    token-authenticated JSON API does not.
+
+    A skipped CsrfViewMiddleware still has its process_view called, as all
+    process_view hooks are; the request is marked as CSRF-processed so it
+    returns right away.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        global _bypass_target
+        if _bypass_target is None:
+            raise ImproperlyConfigured(
+                "ApiBypassMiddleware must be followed by ApiBypassEndMiddleware in MIDDLEWARE."
+            )
+        self.api_response, _bypass_target = _bypass_target, None
+        self.get_response = get_response
+        if iscoroutinefunction(get_response) != iscoroutinefunction(self.api_response):
+            raise ImproperlyConfigured(
+                "The middleware between ApiBypassMiddleware and ApiBypassEndMiddleware "
+                "must support both sync and async requests."
+            )
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if request.path_info.startswith(API_PREFIX):
+            request.csrf_processing_done = True
+            return self.api_response(request)
+        return self.get_response(request)
+
+
+class ApiBypassEndMiddleware:
+    """
+    Marks where ApiBypassMiddleware's bypass ends. Takes no part in the
+    chain itself.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        global _bypass_target
+        _bypass_target = get_response
+        raise MiddlewareNotUsed
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_expires_at(apps, schema_editor):
+    Token = apps.get_model('api', 'Token')
+    for token in Token.objects.filter(expires_at__isnull=True).iterator():
+        token.expires_at = token.created_at + settings.TOKEN_LIFETIME
+        token.save(update_fields=['expires_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(set_expires_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='token',
+            name='expires_at',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['expires_at'], name='tokens_expires_at_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.7
+
+from django.db import migrations, models
+
+TRIGGERS = {
+    'sqlite': (
+        [
+            """
+            CREATE TRIGGER messages_count_deleted AFTER DELETE ON messages
+            BEGIN
+                INSERT INTO message_stats (id, deleted) VALUES (1, 1)
+                ON CONFLICT (id) DO UPDATE SET deleted = deleted + 1;
+            END
+            """,
+        ],
+        ['DROP TRIGGER IF EXISTS messages_count_deleted'],
+    ),
+    'postgresql': (
+        [
+            """
+            CREATE FUNCTION messages_count_deleted() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO message_stats (id, deleted)
+                SELECT 1, count(*) FROM old_rows
+                ON CONFLICT (id) DO UPDATE
+                SET deleted = message_stats.deleted + EXCLUDED.deleted;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE TRIGGER messages_count_deleted AFTER DELETE ON messages
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION messages_count_deleted()
+            """,
+        ],
+        [
+            'DROP TRIGGER IF EXISTS messages_count_deleted ON messages',
+            'DROP FUNCTION IF EXISTS messages_count_deleted()',
+        ],
+    ),
+}
+
+
+def create_triggers(apps, schema_editor):
+    for sql in TRIGGERS[schema_editor.connection.vendor][0]:
+        schema_editor.execute(sql)
+
+
+def drop_triggers(apps, schema_editor):
+    for sql in TRIGGERS[schema_editor.connection.vendor][1]:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_token_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'message_stats',
+            },
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7
+
+from django.db import migrations
+
+# Full-text index over messages.text. It keeps its own copy of the text
+# (not an external-content table), so deleting or re-indexing a row is
+# always safe, even for rows the index has not seen.
+FORWARD = [
+    """
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        text, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages
+    BEGIN
+        INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages
+    BEGIN
+        DELETE FROM messages_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER messages_fts_update AFTER UPDATE OF text ON messages
+    BEGIN
+        UPDATE messages_fts SET text = new.text WHERE rowid = new.id;
+    END
+    """,
+    "INSERT INTO messages_fts (rowid, text) SELECT id, text FROM messages",
+]
+
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS messages_fts_update",
+    "DROP TRIGGER IF EXISTS messages_fts_delete",
+    "DROP TRIGGER IF EXISTS messages_fts_insert",
+    "DROP TABLE IF EXISTS messages_fts",
+]
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in FORWARD:
+            schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in BACKWARD:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_message_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('first_id', models.BigIntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_id', models.BigIntegerField()),
+                ('last_created_at', models.DateTimeField()),
+                ('count', models.IntegerField()),
+                ('size_bytes', models.BigIntegerField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'archive_segments',
+                'ordering': ['first_created_at', 'first_id'],
+                'indexes': [models.Index(fields=['first_created_at', 'first_id'], name='archive_first_idx'), models.Index(fields=['last_created_at', 'last_id'], name='archive_last_idx')],
+            },
+        ),
+    ]
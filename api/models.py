@@ -1,4 +1,8 @@
-from django.db import models
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models
+from django.db.models import Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import binascii
 import os
 
@@ -15,6 +19,9 @@ class Member(models.Model):
     class Meta:
         db_table = 'members'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['username'], name='members_username_idx'),
+        ]
 
     def __str__(self):
         return self.username
@@ -53,7 +60,12 @@ class Member(models.Model):
 class Token(models.Model):
     """
     Authorization token for Member authentication.
+    Valid until expires_at (settings.TOKEN_LIFETIME after issue).
     """
+    POLICY_REUSE = 'reuse'
+    POLICY_ROTATE = 'rotate'
+    POLICY_NEW = 'new'
+
     key = models.CharField(max_length=40, unique=True)
     member = models.ForeignKey(
         Member,
@@ -61,19 +73,56 @@ class Token(models.Model):
         related_name='tokens'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
 
     class Meta:
         db_table = 'tokens'
+        indexes = [
+            models.Index(fields=['key'], name='tokens_key_idx'),
+            models.Index(fields=['expires_at'], name='tokens_expires_at_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.key:
             self.key = self.generate_key()
+        if not self.expires_at:
+            self.expires_at = timezone.now() + settings.TOKEN_LIFETIME
         return super().save(*args, **kwargs)
 
     @classmethod
     def generate_key(cls):
         return binascii.hexlify(os.urandom(20)).decode()
 
+    @classmethod
+    def issue(cls, member, policy=None):
+        """
+        Return a token for a member who just logged in, per
+        settings.TOKEN_LOGIN_POLICY:
+          - reuse: hand back the member's newest token if at least half of
+            TOKEN_LIFETIME is left on it, so a login never ends in a token
+            about to expire; otherwise issue a new one. Every device then
+            shares the key, so a plain logout signs them all out.
+          - rotate: revoke the member's other tokens and issue a new one
+          - new: always issue a new token
+        """
+        policy = policy or settings.TOKEN_LOGIN_POLICY
+        if policy == cls.POLICY_REUSE:
+            token = cls.objects.filter(
+                member=member,
+                expires_at__gte=timezone.now() + settings.TOKEN_LIFETIME / 2,
+            ).order_by('-expires_at').first()
+            if token is not None:
+                return token
+        elif policy == cls.POLICY_ROTATE:
+            cls.objects.filter(member=member).delete()
+        elif policy != cls.POLICY_NEW:
+            raise ValueError(f'Unknown token login policy: {policy!r}')
+        return cls.objects.create(member=member)
+
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
     def __str__(self):
         return self.key
 
@@ -89,10 +138,232 @@ class Message(models.Model):
     )
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # The Idempotency-Key the message was posted with, if any (api.idempotency).
+    client_id = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
         db_table = 'messages'
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['created_at'], name='messages_created_at_idx'),
+            models.Index(fields=['member'], name='messages_member_idx'),
+        ]
+        constraints = [
+            # Partial: messages posted without a key stay out of the index.
+            models.UniqueConstraint(
+                fields=['member', 'client_id'],
+                condition=models.Q(client_id__isnull=False),
+                name='messages_member_client_id_uniq',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.member.username}: {self.text[:50]}'
+
+
+class ReadCursor(models.Model):
+    """
+    How far a member has read the message stream: every message with an id
+    up to ``last_read_id`` counts as read.
+
+    Message ids only grow, so the unread count is the newest id minus
+    last_read_id: two index lookups, never a scan of the messages. It is
+    approximate: ids missing after a cursor (deleted messages, and on
+    PostgreSQL ids of rolled-back inserts) still count as unread until it
+    passes them. api.writer moves a poster's cursor to each message they
+    post, so their own messages never count; whatever they had not read
+    before it counts as read too, as replying implies having caught up.
+    """
+    member = models.OneToOneField(
+        Member,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='read_cursor'
+    )
+    last_read_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'read_cursors'
+
+    def __str__(self):
+        return f'{self.member_id} read up to {self.last_read_id}'
+
+    @classmethod
+    def mark_read(cls, member, message_id):
+        """
+        Move the member's cursor forward to ``message_id``; a cursor never
+        moves back, so stale or reordered requests are harmless.
+        """
+        moved = cls.objects.filter(member=member, last_read_id__lt=message_id).update(
+            last_read_id=message_id, updated_at=timezone.now()
+        )
+        if not moved:
+            cls.objects.get_or_create(member=member, defaults={'last_read_id': message_id})
+
+    @classmethod
+    def state(cls, member):
+        """
+        The member's read state: last_read_id, the newest message id
+        (high_water_mark) and the number of unread messages. One query.
+        """
+        return cls._state(cls._state_query(member).first())
+
+    @classmethod
+    async def astate(cls, member):
+        return cls._state(await cls._state_query(member).afirst())
+
+    @staticmethod
+    def _state_query(member):
+        # Rooted at the newest message rather than the member, so that it
+        # also works on a replica that has not caught up with the member.
+        cursor = ReadCursor.objects.filter(member=member.pk).values('last_read_id')
+        return Message.objects.order_by('-id').values_list(
+            'id', Coalesce(Subquery(cursor), Value(0))
+        )
+
+    @staticmethod
+    def _state(row):
+        high_water_mark, last_read_id = row or (0, 0)
+        return {
+            'last_read_id': last_read_id,
+            'high_water_mark': high_water_mark,
+            'unread': max(high_water_mark - last_read_id, 0),
+        }
+
+
+class Room(models.Model):
+    """
+    A chat room that members join to read and post its messages.
+
+    The room's messages (RoomMessage) are stored in the database named by
+    ``shard``: the default one, or for a busy room one of
+    settings.ROOM_SHARDS, a separate SQLite file with a write lock of its
+    own (see api.routers.RoomShardRouter).
+    """
+    name = models.CharField(max_length=100, unique=True)
+    members = models.ManyToManyField(
+        Member,
+        through='RoomMembership',
+        related_name='rooms'
+    )
+    shard = models.CharField(max_length=64, default=DEFAULT_DB_ALIAS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'rooms'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class RoomMembership(models.Model):
+    """
+    A member's membership of a room.
+    """
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.CASCADE,
+        related_name='memberships'
+    )
+    member = models.ForeignKey(
+        Member,
+        on_delete=models.CASCADE,
+        related_name='room_memberships'
+    )
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'room_members'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['member', 'room'], name='room_members_member_room_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.member_id} in {self.room_id}'
+
+
+class RoomMessage(models.Model):
+    """
+    A message posted to a room, stored in the room's shard database.
+
+    Rooms and members stay in the default database, which a shard cannot
+    reference: the foreign keys have no database constraint and deletes do
+    not cascade across, and usernames are looked up separately
+    (api.fastpath.serialize_room_message_rows). History and sends of a
+    room are range scans and appends on (room, created_at, id).
+    """
+    room = models.ForeignKey(
+        Room,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name='messages'
+    )
+    member = models.ForeignKey(
+        Member,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name='+'
+    )
+    text = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'room_messages'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(
+                fields=['room', 'created_at', 'id'], name='room_messages_room_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.room_id}: {self.text[:50]}'
+
+
+class MessageStats(models.Model):
+    """
+    Single-row bookkeeping for the messages table, kept by database
+    triggers (migration 0003) so that no code path can miss an update:
+    ``deleted`` counts every message ever deleted.
+    """
+    deleted = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'message_stats'
+
+
+class ArchiveSegment(models.Model):
+    """
+    A batch of old messages moved out of the messages table into a
+    compressed segment file (see api.archive). Segments never overlap in
+    (created_at, id) order.
+    """
+    path = models.CharField(max_length=255, unique=True)
+    first_id = models.BigIntegerField()
+    first_created_at = models.DateTimeField()
+    last_id = models.BigIntegerField()
+    last_created_at = models.DateTimeField()
+    count = models.IntegerField()
+    size_bytes = models.BigIntegerField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'archive_segments'
+        ordering = ['first_created_at', 'first_id']
+        indexes = [
+            models.Index(
+                fields=['first_created_at', 'first_id'], name='archive_first_idx'
+            ),
+            models.Index(
+                fields=['last_created_at', 'last_id'], name='archive_last_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.path} ({self.count} messages)'
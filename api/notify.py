@@ -0,0 +1,146 @@
+"""
+Wakes requests waiting for new messages, in every worker.
+
+State shared between gunicorn workers, here and in api.metrics,
+api.ratelimit and api.routers, follows the same rules:
+
+- It is allocated when the app loads, i.e. in the gunicorn master with
+  preload_app, so every forked worker maps the same memory.
+- Stamps in it come from time.monotonic(), which is system-wide on Linux,
+  so they compare across workers.
+- A worker killed while holding a lock on it (OOM, SIGKILL on a gunicorn
+  timeout) never releases it, so no process may wait on one without a
+  timeout, and nothing that serves requests may depend on getting it.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+
+
+class MessageNotifier:
+    """
+    Broadcasts the id of the newest committed message to waiting requests.
+
+    The id lives in shared memory (see the module docstring), so every
+    worker sees the same counter. Each worker runs a single dispatcher thread that polls it every
+    ``poll_interval`` seconds and relays changes to its local waiters, so a
+    publish costs one store, not O(waiting requests), and nothing polls the
+    database. Coroutines wait through await_for(), without holding a
+    thread.
+
+    Nothing is shared but the counter and the short lock around its
+    compare-and-store: a worker that exits, even in the middle of a wait,
+    cannot leave other processes blocked. (A process-shared Condition can:
+    a waiter that dies inside wait() stays counted as sleeping, and the next
+    notify_all() waits for it forever.)
+    """
+    poll_interval = 0.05
+
+    def __init__(self):
+        self._latest = multiprocessing.Value('q', 0)
+        self._local = threading.Condition()
+        self._futures = set()
+        self._dispatcher_pid = None
+        self._dispatcher_lock = threading.Lock()
+
+    @property
+    def latest_id(self):
+        return self._latest.value
+
+    def publish(self, message_id):
+        """
+        Record a newly committed message id and wake waiters in all workers.
+        Waiters in this worker wake at once, those in other workers within
+        poll_interval.
+        """
+        with self._latest.get_lock():
+            if message_id > self._latest.value:
+                self._latest.value = message_id
+        self._wake()
+
+    def wait_for(self, since_id, timeout):
+        """
+        Block until a message newer than since_id is published or timeout
+        seconds pass. Returns the latest published id.
+        """
+        self._ensure_dispatcher()
+        deadline = time.monotonic() + timeout
+        with self._local:
+            while self._latest.value <= since_id:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._local.wait(remaining)
+        return self._latest.value
+
+    async def await_for(self, since_id, timeout):
+        """
+        wait_for() for coroutines.
+        """
+        self._ensure_dispatcher()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._latest.value <= since_id:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            future = loop.create_future()
+            entry = (loop, future)
+            with self._local:
+                self._futures.add(entry)
+            try:
+                # Registered before checking again, so a publish in between
+                # is not missed.
+                if self._latest.value > since_id:
+                    break
+                await asyncio.wait({future}, timeout=remaining)
+            finally:
+                with self._local:
+                    self._futures.discard(entry)
+        return self._latest.value
+
+    def _wake(self):
+        with self._local:
+            self._local.notify_all()
+            futures, self._futures = self._futures, set()
+        for loop, future in futures:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # The waiter's event loop is closed.
+                pass
+
+    def _ensure_dispatcher(self):
+        # Threads do not survive fork, so each worker starts its own.
+        pid = os.getpid()
+        if self._dispatcher_pid == pid:
+            return
+        with self._dispatcher_lock:
+            if self._dispatcher_pid == pid:
+                return
+            thread = threading.Thread(
+                target=self._dispatch, name='message-notifier', daemon=True
+            )
+            thread.start()
+            self._dispatcher_pid = pid
+
+    def _dispatch(self):
+        seen = self._latest.value
+        while True:
+            time.sleep(self.poll_interval)
+            latest = self._latest.value
+            if latest == seen:
+                continue
+            seen = latest
+            self._wake()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+notifier = MessageNotifier()
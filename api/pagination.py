@@ -0,0 +1,234 @@
+import base64
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+from .archive import message_archive
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over messages ordered by (created_at, id).
+
+    Query parameters:
+      - limit: page size (default 50, capped at 200)
+      - before: opaque cursor, returns the page of older messages
+      - after: opaque cursor, returns the page of newer messages
+
+    Without a cursor the newest page is returned. Items within a page are
+    always in chronological order. Every page is a range scan over
+    messages_created_at_idx, so its cost does not depend on history size.
+
+    Pages that run past the oldest message in the table continue into the
+    message archive; archive segments are only read when that happens.
+    """
+    archive = message_archive
+    default_limit = 50
+    max_limit = 200
+    limit_query_param = 'limit'
+    before_query_param = 'before'
+    after_query_param = 'after'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        after, before = self.parse_request(request)
+        if after:
+            # Archived messages are all older than the table's, so they
+            # come first.
+            rows = self.archive.rows_after(after, self.limit + 1)
+            if len(rows) <= self.limit:
+                rows += self.newer(queryset, after)[:self.limit + 1 - len(rows)]
+        else:
+            rows = list(self.older(queryset, before)[:self.limit + 1])
+            if len(rows) <= self.limit:
+                rows += self.archive.rows_before(before, self.limit + 1 - len(rows))
+        return self.set_page(rows, after, before)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() for async views, reading through the async ORM.
+        """
+        after, before = self.parse_request(request)
+        if after:
+            rows = await sync_to_async(self.archive.rows_after)(after, self.limit + 1)
+            if len(rows) <= self.limit:
+                newer = self.newer(queryset, after)[:self.limit + 1 - len(rows)]
+                rows += [row async for row in newer]
+        else:
+            rows = [row async for row in self.older(queryset, before)[:self.limit + 1]]
+            if len(rows) <= self.limit:
+                rows += await sync_to_async(self.archive.rows_before)(
+                    before, self.limit + 1 - len(rows)
+                )
+        return self.set_page(rows, after, before)
+
+    def parse_request(self, request):
+        """
+        Set the page size and return the decoded (after, before) cursors.
+        """
+        self.limit = self.get_limit(request)
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+        if before and after:
+            raise ParseError("Use either 'before' or 'after', not both.")
+        return (
+            self.decode_cursor(after) if after else None,
+            self.decode_cursor(before) if before else None,
+        )
+
+    @staticmethod
+    def newer(queryset, key):
+        created_at, pk = key
+        return queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk),
+            created_at__gte=created_at,
+        ).order_by('created_at', 'id')
+
+    @staticmethod
+    def older(queryset, key):
+        if key is not None:
+            created_at, pk = key
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk),
+                created_at__lte=created_at,
+            )
+        return queryset.order_by('-created_at', '-id')
+
+    def set_page(self, rows, after, before):
+        if after:
+            self.has_newer = len(rows) > self.limit
+            self.has_older = True
+            self.page = rows[:self.limit]
+        else:
+            self.has_older = len(rows) > self.limit
+            self.has_newer = before is not None
+            self.page = rows[:self.limit][::-1]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        previous_cursor = next_cursor = None
+        if self.page:
+            if self.has_older:
+                previous_cursor = self.encode_cursor(self.page[0])
+            if self.has_newer:
+                next_cursor = self.encode_cursor(self.page[-1])
+        return {
+            'results': data,
+            'next': next_cursor,
+            'previous': previous_cursor,
+        }
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        if limit <= 0:
+            return self.default_limit
+        return min(limit, self.max_limit)
+
+    @staticmethod
+    def encode_cursor(message):
+        raw = f'{message.created_at.isoformat()}|{message.id}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(padded.encode()).decode()
+            created_at, pk = raw.rsplit('|', 1)
+            return datetime.fromisoformat(created_at), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise ParseError("Invalid cursor.")
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.limit_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of messages per page.',
+                'schema': {'type': 'integer'},
+            },
+            {
+                'name': self.before_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor: return messages older than this position.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.after_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor: return messages newer than this position.',
+                'schema': {'type': 'string'},
+            },
+        ]
+
+
+class MessageDeltaPagination(MessageCursorPagination):
+    """
+    Delta sync: messages with id greater than since_id, oldest first.
+
+    Message ids are assigned monotonically on insert, so unlike a timestamp
+    they never tie and a client that passes back the returned
+    high_water_mark cannot miss rows inserted in the same instant. The range
+    scan runs on the primary key, so a sync costs O(new messages).
+
+    Gap-free only on SQLite, where one writer at a time means messages
+    commit in id order. PostgreSQL hands out sequence ids before commit: a
+    message whose transaction commits after a higher id has been served is
+    never returned by a later sync. The stream and the long-poll endpoint
+    share this caveat.
+    """
+    since_query_param = 'since_id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_delta_page(list(self.newer_ids(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_delta_page([row async for row in self.newer_ids(queryset, request)])
+
+    def newer_ids(self, queryset, request):
+        self.limit = self.get_limit(request)
+        try:
+            self.since_id = int(request.query_params[self.since_query_param])
+        except (KeyError, ValueError):
+            raise ParseError("'since_id' must be an integer.")
+        return queryset.filter(id__gt=self.since_id).order_by('id')[:self.limit + 1]
+
+    def set_delta_page(self, rows):
+        self.has_more = len(rows) > self.limit
+        self.page = rows[:self.limit]
+        return self.page
+
+    def get_paginated_data(self, data):
+        return {
+            'results': data,
+            'high_water_mark': self.page[-1].id if self.page else self.since_id,
+            'has_more': self.has_more,
+        }
+
+
+class RoomMessagePagination(MessageCursorPagination):
+    """
+    MessageCursorPagination over one room's messages: a range scan over
+    room_messages_room_idx, i.e. (room, created_at, id). Rooms have no
+    archive.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        after, before = self.parse_request(request)
+        if after:
+            rows = list(self.newer(queryset, after)[:self.limit + 1])
+        else:
+            rows = list(self.older(queryset, before)[:self.limit + 1])
+        return self.set_page(rows, after, before)
@@ -0,0 +1,322 @@
+import hmac
+import logging
+import random
+import time
+import traceback
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_X_PROFILE'  # X-Profile
+PHASES = ('auth', 'query', 'serialize', 'render', 'other')
+
+_profile = ContextVar('query_profile', default=None)
+
+
+class NPlusOneQueries(Exception):
+    """
+    A request ran the same SELECT over and over, typically a serializer
+    following a relation that the queryset did not select_related.
+    """
+
+
+class Statement:
+    """
+    One distinct SQL statement of a request: how often it ran, for how long
+    in total, and its query plan once explained.
+    """
+
+    def __init__(self, sql, params, alias, many):
+        self.sql = sql
+        self.params = params
+        self.alias = alias
+        self.many = many
+        self.count = 0
+        self.seconds = 0.0
+        self.callsite = None
+        self.plan = None
+
+    @property
+    def is_select(self):
+        return not self.many and self.sql.lstrip()[:6].upper() == 'SELECT'
+
+
+class QueryProfile:
+    """
+    SQL statements and time breakdown of one request.
+
+    Wall time is charged to one phase at a time: switch() closes the
+    current phase and opens another, so the phases add up to the total and
+    time spent in queries is never counted again under the phase that ran
+    them.
+    """
+
+    def __init__(self, n_plus_one_threshold=5):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.statements = {}
+        self.n_plus_one = []
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.phase = 'other'
+        self.started = self.mark = time.perf_counter()
+        self.total = None
+
+    def switch(self, phase):
+        """
+        Charge the time since the last switch to the current phase and
+        enter ``phase``. Returns the phase that was left.
+        """
+        now = time.perf_counter()
+        self.times[self.phase] += now - self.mark
+        self.mark = now
+        previous, self.phase = self.phase, phase
+        return previous
+
+    def finish(self):
+        self.switch('other')
+        self.total = self.mark - self.started
+
+    def record(self, sql, params, alias, many, seconds):
+        statement = self.statements.get(sql)
+        if statement is None:
+            statement = self.statements[sql] = Statement(sql, params, alias, many)
+        statement.count += 1
+        statement.seconds += seconds
+        if statement.count == self.n_plus_one_threshold and statement.is_select:
+            statement.callsite = callsite()
+            self.n_plus_one.append(statement)
+
+    @property
+    def query_count(self):
+        return sum(statement.count for statement in self.statements.values())
+
+    def explain(self):
+        """
+        Attach the query plan of every distinct SELECT. Must run after the
+        request, outside the profile, so the EXPLAINs are not recorded.
+        """
+        for statement in self.statements.values():
+            if not statement.is_select:
+                continue
+            connection = connections[statement.alias]
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'{connection.ops.explain_query_prefix()} {statement.sql}',
+                        statement.params,
+                    )
+                    statement.plan = [str(row[-1]) for row in cursor.fetchall()]
+            except DatabaseError as exc:
+                statement.plan = [f'EXPLAIN failed: {exc}']
+
+    def server_timing(self):
+        """
+        The breakdown as a Server-Timing header value, in milliseconds.
+        """
+        entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.times.items()]
+        entries.append(f'total;dur={self.total * 1000:.2f}')
+        return ', '.join(entries)
+
+    def summary(self):
+        breakdown = ', '.join(
+            f'{name} {seconds * 1000:.1f}' for name, seconds in self.times.items()
+        )
+        return f'{self.total * 1000:.1f} ms ({breakdown} ms), {self.query_count} queries'
+
+    def report(self):
+        """
+        The statements, slowest first, with their plans.
+        """
+        lines = []
+        statements = sorted(self.statements.values(), key=lambda s: s.seconds, reverse=True)
+        for statement in statements:
+            lines.append(
+                f'  {statement.seconds * 1000:8.2f} ms  x{statement.count:<4} {statement.sql}'
+            )
+            for step in statement.plan or ():
+                lines.append(f'      plan: {step}')
+        for statement in self.n_plus_one:
+            lines.append(n_plus_one_message(statement))
+        return '\n'.join(lines)
+
+
+class phase:
+    """
+    Context manager charging the time spent inside it to ``name`` in the
+    current request's profile; does nothing when the request is not
+    profiled.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profile = _profile.get()
+        if self.profile is not None:
+            self.previous = self.profile.switch(self.name)
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.switch(self.previous)
+
+
+def record_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper recording statements of profiled requests.
+    """
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    previous = profile.switch('query')
+    started = profile.mark
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - started
+        profile.switch(previous)
+        profile.record(sql, params, context['connection'].alias, many, seconds)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def callsite():
+    """
+    The innermost frame of project code (not Django, DRF or this module)
+    on the current stack.
+    """
+    base = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if (
+            frame.filename.startswith(base)
+            and 'site-packages' not in frame.filename
+            and not frame.filename.endswith(('profiling.py', 'metrics.py'))
+        ):
+            return f'{frame.filename[len(base) + 1:]}:{frame.lineno} in {frame.name}'
+    return 'unknown'
+
+
+def n_plus_one_message(statement):
+    return (
+        f'N+1 queries: ran {statement.count} times, from {statement.callsite}'
+        f' (missing select_related/prefetch_related?): {statement.sql}'
+    )
+
+
+class QueryProfilerMiddleware:
+    """
+    Opt-in per-request SQL profiling, configured by
+    settings.QUERY_PROFILING.
+
+    A request is profiled when it carries ``X-Profile: <KEY>`` (any value
+    with DEBUG on) or is picked by SAMPLE_RATE. A profiled request records
+    every statement with its duration and, with EXPLAIN on, its query plan,
+    and splits its wall time into auth, query, serialize (the view's own
+    code), render and other (the middleware). It is logged when it took
+    SLOW_REQUEST_MS or more, or when asked for by header, which also gets
+    the breakdown back in a Server-Timing header.
+
+    A SELECT repeated N_PLUS_ONE_THRESHOLD times in one request is reported
+    as N+1 queries; N_PLUS_ONE = "raise" turns that into an NPlusOneQueries
+    error, which the test run uses to fail on them.
+
+    Goes first in MIDDLEWARE, so the EXPLAINs it runs after the request are
+    not counted by api.metrics.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, 'QUERY_PROFILING', {})
+        self.key = config.get('KEY')
+        self.sample_rate = config.get('SAMPLE_RATE', 0)
+        self.slow_seconds = config.get('SLOW_REQUEST_MS', 500) / 1000
+        self.explain = config.get('EXPLAIN', True)
+        self.n_plus_one_threshold = config.get('N_PLUS_ONE_THRESHOLD', 5)
+        self.n_plus_one = config.get('N_PLUS_ONE', 'log')
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def requested(self, request):
+        value = request.META.get(HEADER)
+        if value is None:
+            return False
+        if self.key:
+            return hmac.compare_digest(value, self.key)
+        return settings.DEBUG
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        requested = self.requested(request)
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            return self.get_response(request)
+        profile = QueryProfile(self.n_plus_one_threshold)
+        token = _profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _profile.reset(token)
+            profile.finish()
+        if self.explain and (requested or profile.total >= self.slow_seconds):
+            profile.explain()
+        return self.report(request, response, profile, requested)
+
+    async def __acall__(self, request):
+        requested = self.requested(request)
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            return await self.get_response(request)
+        profile = QueryProfile(self.n_plus_one_threshold)
+        token = _profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _profile.reset(token)
+            profile.finish()
+        if self.explain and (requested or profile.total >= self.slow_seconds):
+            await sync_to_async(profile.explain)()
+        return self.report(request, response, profile, requested)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = _profile.get()
+        if profile is not None:
+            profile.switch('serialize')
+
+    def process_template_response(self, request, response):
+        profile = _profile.get()
+        if profile is not None:
+            profile.switch('render')
+
+            def rendered(response):
+                profile.switch('other')
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def report(self, request, response, profile, requested):
+        if profile.n_plus_one and self.n_plus_one == 'raise':
+            raise NPlusOneQueries(
+                '\n'.join(n_plus_one_message(statement) for statement in profile.n_plus_one)
+            )
+        if requested:
+            response['Server-Timing'] = profile.server_timing()
+        slow = profile.total >= self.slow_seconds
+        if requested or slow or profile.n_plus_one:
+            logger.log(
+                logging.WARNING if slow or profile.n_plus_one else logging.INFO,
+                '%s %s %s took %s\n%s',
+                request.method, request.get_full_path(), response.status_code,
+                profile.summary(), profile.report(),
+            )
+        return response
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import math
+import multiprocessing
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework import status
+
+from .authentication import parse_token_key
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+KINDS = ('ip', 'token')
+
+
+def parse_rate(rate):
+    """
+    "<requests>/<period>" as in DRF throttles, e.g. "10/min" -> (10, 60).
+    """
+    requests, period = rate.split('/')
+    return int(requests), PERIODS[period[0]]
+
+
+class RateLimiter:
+    """
+    Token buckets in shared memory (see api.notify), so all workers draw
+    from the same buckets.
+
+    Buckets live in a fixed-size open-addressing table indexed by a hash
+    of the key. When the ``probes`` slots a key may use are all taken, the
+    bucket refilled longest ago is reused; an evicted key starts over
+    with a full bucket, which only ever errs on the lenient side.
+
+    The table is guarded by a cross-process lock, which a killed worker may
+    never release. acquire() gives up on it after ``lock_timeout`` seconds
+    and lets the request through: without the limiter the API still works,
+    blocked on a dead lock it would not.
+    """
+
+    # Compares across workers (see api.notify).
+    clock = staticmethod(time.monotonic)
+    lock_timeout = 0.05
+
+    def __init__(self, slots=16384, probes=8):
+        self.slots = slots
+        self.probes = probes
+        self._lock = multiprocessing.Lock()
+        self._keys = multiprocessing.RawArray('Q', slots)
+        self._tokens = multiprocessing.RawArray('d', slots)
+        self._stamps = multiprocessing.RawArray('d', slots)
+
+    def acquire(self, *limits):
+        """
+        Take one token from each bucket in ``limits``, a sequence of
+        (key, capacity, per_seconds): the bucket holds up to ``capacity``
+        tokens and refills ``capacity`` per ``per_seconds``. Tokens are
+        taken only if every bucket has one. Returns 0 on success, else the
+        seconds until all of them will.
+        """
+        hashes = [_hash(key) for key, _, _ in limits]
+        tokens, stamps = self._tokens, self._stamps
+        if not self._lock.acquire(timeout=self.lock_timeout):
+            logger.warning("Rate limit table lock not acquired; request not limited.")
+            return 0
+        try:
+            now = self.clock()
+            wait = 0
+            buckets = []
+            for hashed, (_, capacity, per_seconds) in zip(hashes, limits):
+                index = self._find(hashed, capacity, now)
+                rate = capacity / per_seconds
+                available = min(capacity, tokens[index] + (now - stamps[index]) * rate)
+                tokens[index] = available
+                stamps[index] = now
+                buckets.append(index)
+                if available < 1:
+                    wait = max(wait, (1 - available) / rate)
+            if not wait:
+                for index in buckets:
+                    tokens[index] -= 1
+            return wait
+        finally:
+            self._lock.release()
+
+    def _find(self, hashed, capacity, now):
+        keys, stamps = self._keys, self._stamps
+        start = hashed % self.slots
+        victim = None
+        for probe in range(self.probes):
+            index = (start + probe) % self.slots
+            if keys[index] == hashed:
+                return index
+            if keys[index] == 0:
+                victim = index
+                break
+            if victim is None or stamps[index] < stamps[victim]:
+                victim = index
+        keys[victim] = hashed
+        self._tokens[victim] = capacity
+        stamps[victim] = now
+        return victim
+
+    def clear(self):
+        with self._lock:
+            for index in range(self.slots):
+                self._keys[index] = 0
+
+
+def _hash(key):
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') | 1  # 0 marks a free slot
+
+
+_config = getattr(settings, 'RATE_LIMITING', {})
+rate_limiter = RateLimiter(_config.get('SLOTS', 16384), _config.get('PROBES', 8))
+
+
+def client_ip(request):
+    # nginx sets X-Real-IP; gunicorn only listens on localhost behind it.
+    return request.META.get('HTTP_X_REAL_IP') or request.META.get('REMOTE_ADDR', '')
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """
+    Applies settings.RATE_LIMITING['ROUTES'] to the matching views: for
+    each URL name and method, a rate per client IP and/or per token.
+    Runs as process_view, after URL resolution but before the view, so a
+    rejected request costs no authentication, database work or password
+    hash. Rejections get DRF's 429 response shape with Retry-After.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        config = getattr(settings, 'RATE_LIMITING', {})
+        if not config.get('ENABLED', True) or not config.get('ROUTES'):
+            raise MiddlewareNotUsed
+        for methods in config['ROUTES'].values():
+            for limits in methods.values():
+                for kind in limits:
+                    if kind not in KINDS:
+                        raise ImproperlyConfigured(f"Unknown rate limit key {kind!r}")
+        self.routes = {
+            url_name: {
+                method: [(kind, *parse_rate(rate)) for kind, rate in limits.items()]
+                for method, limits in methods.items()
+            }
+            for url_name, methods in config['ROUTES'].items()
+        }
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        methods = self.routes.get(request.resolver_match.url_name)
+        limits = methods and methods.get(request.method)
+        if not limits:
+            return None
+        buckets = []
+        for kind, capacity, per_seconds in limits:
+            if kind == 'token':
+                ident = parse_token_key(request.META.get('HTTP_AUTHORIZATION'))
+                if not ident:
+                    continue
+            else:
+                ident = client_ip(request)
+            key = f'{request.resolver_match.url_name}:{request.method}:{kind}:{ident}'
+            buckets.append((key, capacity, per_seconds))
+        wait = rate_limiter.acquire(*buckets)
+        if not wait:
+            return None
+        seconds = math.ceil(wait)
+        response = JsonResponse(
+            {"detail": f"Request was throttled. Expected available in {seconds} seconds."},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+        )
+        response['Retry-After'] = str(seconds)
+        return response
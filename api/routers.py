@@ -0,0 +1,175 @@
+import functools
+import multiprocessing
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replica_alias():
+    return getattr(settings, 'READ_REPLICA', {}).get('ALIAS')
+
+
+class PrimaryPins:
+    """
+    Per-member "reads stay on the primary until" stamps, in shared memory
+    (see api.notify), so a write through one worker pins the member's reads
+    in all of them.
+
+    Members share the ``slots`` stamps by id; a collision only keeps
+    another member's reads on the primary too, which errs on the safe side.
+    """
+
+    # Compares across workers (see api.notify).
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, slots=16384):
+        self.slots = slots
+        self._until = multiprocessing.RawArray('d', slots)
+
+    def pin(self, member_id, seconds):
+        self._until[member_id % self.slots] = self.clock() + seconds
+
+    def is_pinned(self, member_id):
+        return self._until[member_id % self.slots] > self.clock()
+
+    def clear(self):
+        for index in range(self.slots):
+            self._until[index] = 0
+
+
+primary_pins = PrimaryPins(getattr(settings, 'READ_REPLICA', {}).get('PIN_SLOTS', 16384))
+
+
+def request_member_id(request):
+    """
+    The id of the member a request is authenticated as, or None. DRF sets
+    ``user`` and the async views ``member``.
+    """
+    member = getattr(request, 'member', None) or getattr(request, 'user', None)
+    if member is None or not member.is_authenticated:
+        return None
+    return member.pk
+
+
+def pinned(request):
+    """
+    True if the member wrote recently and their reads must stay on the primary.
+    """
+    member_id = request_member_id(request)
+    return member_id is not None and primary_pins.is_pinned(member_id)
+
+
+def replica_reads(handler):
+    """
+    Decorator for view handlers whose reads may be served by the read
+    replica. Requests from a client pinned to the primary, and any query
+    run inside a transaction, still go to the primary. Works on sync and
+    async handlers; sync_to_async carries the flag to the ORM's thread.
+    """
+    if iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def async_wrapper(view, request, *args, **kwargs):
+            if not replica_alias() or pinned(request):
+                return await handler(view, request, *args, **kwargs)
+            token = _replica_reads.set(True)
+            try:
+                return await handler(view, request, *args, **kwargs)
+            finally:
+                _replica_reads.reset(token)
+
+        return async_wrapper
+
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        if not replica_alias() or pinned(request):
+            return handler(view, request, *args, **kwargs)
+        token = _replica_reads.set(True)
+        try:
+            return handler(view, request, *args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Sends reads made under replica_reads to settings.READ_REPLICA['ALIAS'];
+    everything else uses the default database. Both hold the same data, so
+    relations between them are allowed.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class RoomShardRouter:
+    """
+    Keeps each room's messages in the database named by its Room.shard.
+    Everything else lives in the default database; a shard database holds
+    only the room_messages table (`manage.py migrate --database <shard>`).
+
+    Room message queries find their room through the ``instance`` hint
+    that the room's related manager passes: room.messages.filter(...),
+    room.messages.create(...). Other queries must use .using(room.shard).
+    A loaded room message is saved back to the database it came from, and
+    relations followed from it, such as its member, are read from the
+    default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if model._meta.label == 'api.RoomMessage':
+            return instance.shard if instance._meta.label == 'api.Room' else None
+        if instance._meta.label == 'api.RoomMessage':
+            return DEFAULT_DB_ALIAS
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if 'api.RoomMessage' in (obj1._meta.label, obj2._meta.label):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in getattr(settings, 'ROOM_SHARDS', ()):
+            return app_label == 'api' and model_name == 'roommessage'
+        return None
+
+
+class PrimaryPinMiddleware(MiddlewareMixin):
+    """
+    Read-your-writes: after a successful unsafe request, pin the member's
+    replica_reads to the primary until the replica has had time to catch
+    up. The pin is keyed on the member, not the client, so it holds for
+    token clients that keep no cookies and for the member's other devices.
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def process_response(self, request, response):
+        if (
+            replica_alias()
+            and request.method not in self.safe_methods
+            and response.status_code < 400
+        ):
+            member_id = request_member_id(request)
+            if member_id is not None:
+                primary_pins.pin(member_id, settings.READ_REPLICA['PIN_SECONDS'])
+        return response
@@ -0,0 +1,34 @@
+"""
+Lazy OpenAPI annotations.
+
+drf_spectacular's extend_schema builds a schema class as soon as it
+decorates a view method, which imports drf_spectacular.openapi and with it
+rest_framework.test and django.test. The views would pay for that on every
+worker start although only `manage.py spectacular` generates a schema.
+The extend_schema here just records its arguments; the
+apply_schema_annotations preprocessing hook (SPECTACULAR_SETTINGS) hands
+them to the real decorator when a schema is being generated.
+"""
+
+
+def extend_schema(**kwargs):
+    """
+    Same arguments as drf_spectacular.utils.extend_schema, applied lazily.
+    """
+    def decorator(func):
+        func.schema_annotation = kwargs
+        return func
+
+    return decorator
+
+
+def apply_schema_annotations(endpoints, **kwargs):
+    from drf_spectacular.utils import extend_schema as spectacular_extend_schema
+
+    for _, _, method, callback in endpoints:
+        handler = getattr(getattr(callback, 'cls', None), method.lower(), None)
+        annotation = getattr(handler, 'schema_annotation', None)
+        # Inherited handlers are shared between views; annotate them once.
+        if annotation is not None and 'schema' not in getattr(handler, 'kwargs', {}):
+            spectacular_extend_schema(**annotation)(handler)
+    return endpoints
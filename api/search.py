@@ -0,0 +1,145 @@
+import base64
+import html
+import math
+import re
+
+from django.db import connection
+from rest_framework.exceptions import ParseError
+
+from .fastpath import message_rows, serialize_message_rows
+from .models import Message
+
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+MIN_ROWID = -2 ** 63
+MAX_ROWID = 2 ** 63 - 1
+
+
+class MessageSearch:
+    """
+    Ranked full-text search over messages via the messages_fts FTS5 table
+    (migration 0004), which database triggers keep in sync with messages.
+
+    Query parameters:
+      - q: words to search for; every word must match
+      - limit: page size (default 20, capped at 100)
+      - after: opaque cursor from "next"
+
+    Results are ordered by bm25 rank, then id, and paged by keyset on that
+    pair. Ranks depend on corpus statistics, so pages fetched while
+    messages are being added may overlap slightly or skip a marginal hit.
+
+    Ranking scores every candidate, so a word found in half of all
+    messages would cost a scan of half the index. Only the newest
+    ``max_ranked`` matches are ranked; the cursor pins that window so all
+    pages of one search rank the same set.
+    """
+    default_limit = 20
+    max_limit = 100
+    max_ranked = 10000
+    snippet_tokens = 12
+
+    def search(self, request):
+        terms = re.findall(r'\w+', request.query_params.get('q', ''))
+        if not terms:
+            raise ParseError("'q' must contain at least one word.")
+        # Quote every word so user input can never be FTS5 query syntax.
+        match = ' '.join(f'"{term}"' for term in terms)
+        limit = self.get_limit(request)
+
+        after = request.query_params.get('after')
+        if after:
+            floor, rank, pk = self.decode_cursor(after)
+        else:
+            floor = self.get_floor(match)
+
+        sql = (
+            "SELECT rowid, bm25(messages_fts), "
+            "snippet(messages_fts, 0, %s, %s, '…', %s) "
+            "FROM messages_fts WHERE messages_fts MATCH %s AND rowid >= %s"
+        )
+        params = [SNIPPET_START, SNIPPET_END, self.snippet_tokens, match, floor]
+        if after:
+            sql += (
+                " AND (bm25(messages_fts) > %s"
+                " OR (bm25(messages_fts) = %s AND rowid > %s))"
+            )
+            params += [rank, rank, pk]
+        sql += " ORDER BY bm25(messages_fts), rowid LIMIT %s"
+        params.append(limit + 1)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            hits = cursor.fetchall()
+        has_more = len(hits) > limit
+        hits = hits[:limit]
+
+        rows = {
+            row.id: row
+            for row in message_rows(Message.objects.filter(id__in=[h[0] for h in hits]))
+        }
+        hits = [hit for hit in hits if hit[0] in rows]
+        results = serialize_message_rows(rows[hit[0]] for hit in hits)
+        for item, (_, _, snippet) in zip(results, hits):
+            item['snippet'] = self.format_snippet(snippet)
+
+        next_cursor = None
+        if has_more and hits:
+            pk, rank, _ = hits[-1]
+            next_cursor = self.encode_cursor(floor, rank, pk)
+        return {'results': results, 'next': next_cursor}
+
+    def get_floor(self, match):
+        """
+        Lowest message id inside the ranking window: the id of the
+        ``max_ranked``-th newest match, or 0 if there are fewer matches.
+        Walking the match list backwards by id needs no scoring.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid FROM messages_fts WHERE messages_fts MATCH %s "
+                "ORDER BY rowid DESC LIMIT 1 OFFSET %s",
+                [match, self.max_ranked - 1],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            return self.default_limit
+        if limit <= 0:
+            return self.default_limit
+        return min(limit, self.max_limit)
+
+    @staticmethod
+    def format_snippet(snippet):
+        """
+        HTML-escape the snippet and mark the matched words with <mark>.
+        """
+        return (
+            html.escape(snippet)
+            .replace(SNIPPET_START, '<mark>')
+            .replace(SNIPPET_END, '</mark>')
+        )
+
+    @staticmethod
+    def encode_cursor(floor, rank, pk):
+        raw = f'{floor}|{rank!r}|{pk}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(padded.encode()).decode()
+            floor, rank, pk = raw.split('|')
+            floor, rank, pk = int(floor), float(rank), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise ParseError("Invalid cursor.")
+        # Out-of-range values would make SQLite raise OverflowError.
+        in_range = all(MIN_ROWID <= value <= MAX_ROWID for value in (floor, pk))
+        if not in_range or not math.isfinite(rank):
+            raise ParseError("Invalid cursor.")
+        return floor, rank, pk
@@ -1,6 +1,6 @@
 from rest_framework import serializers
-from django.contrib.auth.hashers import make_password, check_password
-from .models import Member, Token, Message
+from .hashing import password_hasher
+from .models import Member, Token, Message, Room
 
 
 class MessageSerializer(serializers.Serializer):
@@ -18,6 +18,32 @@ class MemberSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
+class ReadStateSerializer(serializers.Serializer):
+    """
+    Serializer describing how far a member has read the message stream.
+    """
+    last_read_id = serializers.IntegerField()
+    high_water_mark = serializers.IntegerField()
+    unread = serializers.IntegerField()
+
+
+class MeSerializer(MemberSerializer):
+    """
+    Serializer describing the current member, with their read state.
+    """
+    read_cursor = ReadStateSerializer(read_only=True)
+
+    class Meta(MemberSerializer.Meta):
+        fields = MemberSerializer.Meta.fields + ['read_cursor']
+
+
+class MarkReadSerializer(serializers.Serializer):
+    """
+    Serializer for marking messages as read.
+    """
+    last_read_id = serializers.IntegerField(min_value=0)
+
+
 class RegisterSerializer(serializers.Serializer):
     """
     Serializer for user registration.
@@ -33,7 +59,7 @@ class RegisterSerializer(serializers.Serializer):
     def create(self, validated_data):
         member = Member.objects.create(
             username=validated_data['username'],
-            password=make_password(validated_data['password'])
+            password=password_hasher.make_password(validated_data['password'])
         )
         return member
 
@@ -54,13 +80,20 @@ class LoginSerializer(serializers.Serializer):
         except Member.DoesNotExist:
             raise serializers.ValidationError("Invalid credentials.")
 
-        if not check_password(password, member.password):
+        if not password_hasher.check_password(password, member.password):
             raise serializers.ValidationError("Invalid credentials.")
 
         attrs['member'] = member
         return attrs
 
 
+class LogoutSerializer(serializers.Serializer):
+    """
+    Serializer for logout - optionally revoke all of the member's tokens.
+    """
+    all = serializers.BooleanField(required=False, default=False)
+
+
 class ChatMessageSerializer(serializers.ModelSerializer):
     """
     Serializer for Message model - returns message data with username.
@@ -73,6 +106,43 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'username', 'created_at']
 
 
+class MessagePageSerializer(serializers.Serializer):
+    """
+    Serializer describing one page of chat history.
+    """
+    results = ChatMessageSerializer(many=True)
+    next = serializers.CharField(allow_null=True)
+    previous = serializers.CharField(allow_null=True)
+
+
+class MessageDeltaSerializer(serializers.Serializer):
+    """
+    Serializer describing messages newer than a client's high-water mark.
+    """
+    results = ChatMessageSerializer(many=True)
+    high_water_mark = serializers.IntegerField()
+    has_more = serializers.BooleanField()
+
+
+class MessageSearchResultSerializer(ChatMessageSerializer):
+    """
+    Serializer describing a search hit: the message plus a highlighted,
+    HTML-escaped excerpt.
+    """
+    snippet = serializers.CharField(read_only=True)
+
+    class Meta(ChatMessageSerializer.Meta):
+        fields = ChatMessageSerializer.Meta.fields + ['snippet']
+
+
+class MessageSearchPageSerializer(serializers.Serializer):
+    """
+    Serializer describing one page of search results.
+    """
+    results = MessageSearchResultSerializer(many=True)
+    next = serializers.CharField(allow_null=True)
+
+
 class CreateMessageSerializer(serializers.ModelSerializer):
     """
     Serializer for creating a new message.
@@ -88,3 +158,34 @@ class CreateMessageSerializer(serializers.ModelSerializer):
             text=validated_data['text']
         )
         return message
+
+
+class CreateMessageBatchSerializer(serializers.Serializer):
+    """
+    Serializer for posting several messages in one request.
+    """
+    messages = CreateMessageSerializer(many=True, allow_empty=False, max_length=100)
+
+
+class MessageBatchSerializer(serializers.Serializer):
+    """
+    Serializer describing the messages created by a batch request.
+    """
+    results = ChatMessageSerializer(many=True)
+
+
+class RoomSerializer(serializers.ModelSerializer):
+    """
+    Serializer for Room model - returns room data.
+    """
+    class Meta:
+        model = Room
+        fields = ['id', 'name', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+
+class RoomListSerializer(serializers.Serializer):
+    """
+    Serializer describing the rooms a member belongs to.
+    """
+    results = RoomSerializer(many=True)
@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import token_cache
+from .models import Member, Message, Token
+from .notify import notifier
+
+
+@receiver(post_save, sender=Message)
+def publish_new_message(sender, instance, created, **kwargs):
+    """
+    Wake long-polling and streaming clients once the message is committed.
+    """
+    if created:
+        transaction.on_commit(lambda: publish_messages([instance]))
+
+
+def publish_messages(messages):
+    """
+    Announce committed messages to long-polling and streaming clients.
+    """
+    notifier.publish(max(message.pk for message in messages))
+
+
+@receiver(post_delete, sender=Token)
+@receiver(post_delete, sender=Member)
+def invalidate_token_cache_on_delete(sender, instance, **kwargs):
+    """
+    Revoked tokens and deleted members must stop authenticating at once.
+    Purging an already expired token changes nothing for authentication.
+    """
+    if isinstance(instance, Token) and instance.is_expired:
+        return
+    token_cache.invalidate()
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_save, sender=Member)
+def invalidate_token_cache_on_change(sender, instance, created, **kwargs):
+    """
+    Cached tokens carry a copy of the member; drop them when either changes.
+    """
+    if not created:
+        token_cache.invalidate()
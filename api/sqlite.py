@@ -0,0 +1,112 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class WalCheckpointer:
+    """
+    Checkpoints an SQLite database's write-ahead log on a timer.
+
+    SQLite checkpoints on its own once the WAL passes ~1000 pages, but only
+    from whichever connection happens to commit, and never past a page an
+    open reader still needs. With persistent connections and steady reads
+    the WAL can keep growing. A passive checkpoint every ``interval`` seconds
+    keeps it draining without blocking anyone; once the file is larger than
+    ``truncate_bytes`` a TRUNCATE checkpoint shrinks it back to zero, waiting
+    at most ``busy_timeout`` seconds for readers to move on.
+    """
+
+    def __init__(self, path, interval=30, truncate_bytes=64 * 1024 * 1024, busy_timeout=1):
+        self.path = str(path)
+        self.interval = interval
+        self.truncate_bytes = truncate_bytes
+        self.busy_timeout = busy_timeout
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def wal_size(self):
+        try:
+            return os.path.getsize(f'{self.path}-wal')
+        except OSError:
+            return 0
+
+    def checkpoint(self):
+        """
+        Run one checkpoint. Returns SQLite's (busy, wal_pages, checkpointed)
+        row; busy is 1 if the checkpoint could not finish.
+        """
+        mode = 'TRUNCATE' if self.wal_size > self.truncate_bytes else 'PASSIVE'
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+        try:
+            return conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+        finally:
+            conn.close()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='sqlite-wal-checkpoint', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                busy, wal_pages, checkpointed = self.checkpoint()
+            except sqlite3.Error:
+                logger.exception("WAL checkpoint of %s failed", self.path)
+                continue
+            if busy:
+                logger.info(
+                    "WAL checkpoint of %s incomplete: %s of %s pages",
+                    self.path, checkpointed, wal_pages,
+                )
+
+
+def file_stats(connection):
+    """
+    Size of an SQLite database file and of its free pages, in bytes, as a
+    dict for management command reports. Empty for other databases.
+    """
+    if connection.vendor != 'sqlite':
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA page_size')
+        page_size = cursor.fetchone()[0]
+        cursor.execute('PRAGMA page_count')
+        page_count = cursor.fetchone()[0]
+        cursor.execute('PRAGMA freelist_count')
+        freelist = cursor.fetchone()[0]
+    return {'db_bytes': page_size * page_count, 'free_bytes': page_size * freelist}
+
+
+def start_wal_checkpointer(alias='default'):
+    """
+    Start a WalCheckpointer for an SQLite database configured with WAL
+    journaling, using settings.SQLITE_WAL_CHECKPOINT. Returns None if
+    there is nothing to checkpoint.
+    """
+    database = settings.DATABASES[alias]
+    init_command = database.get('OPTIONS', {}).get('init_command', '')
+    if (
+        database['ENGINE'] != 'django.db.backends.sqlite3'
+        or 'journal_mode=wal' not in init_command.lower().replace(' ', '')
+    ):
+        return None
+    checkpointer = WalCheckpointer(database['NAME'], **{
+        key.lower(): value
+        for key, value in getattr(settings, 'SQLITE_WAL_CHECKPOINT', {}).items()
+    })
+    checkpointer.start()
+    return checkpointer
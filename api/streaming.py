@@ -0,0 +1,199 @@
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import Max
+
+from .authentication import aget_token, get_token, parse_token_key
+from .models import Message
+from .notify import notifier
+from .serializers import ChatMessageSerializer
+
+KEEPALIVE_INTERVAL = 15
+BATCH_SIZE = 200
+# A stream served by a WSGI worker holds one of its threads, so it ends
+# after this many seconds; EventSource reconnects by itself and resumes
+# from Last-Event-ID.
+WSGI_STREAM_SECONDS = 300
+
+
+async def authenticate(auth_header, token_key):
+    """
+    Resolve a member from an Authorization header or a bare token key.
+    EventSource cannot set headers, so streams also accept ?token=.
+    """
+    if auth_header:
+        token_key = parse_token_key(auth_header)
+    if not token_key:
+        return None
+    token = await aget_token(token_key)
+    return token.member if token is not None else None
+
+
+def authenticate_sync(auth_header, token_key):
+    """
+    authenticate() for WSGI requests.
+    """
+    if auth_header:
+        token_key = parse_token_key(auth_header)
+    if not token_key:
+        return None
+    token = get_token(token_key)
+    return token.member if token is not None else None
+
+
+def parse_since_id(value):
+    """
+    Parse Last-Event-ID / since_id. Raises ValueError on garbage.
+    """
+    return int(value) if value else None
+
+
+def format_event(data):
+    return f"id: {data['id']}\nevent: message\ndata: {json.dumps(data)}\n\n"
+
+
+def read_events(last_id, release_connection=False):
+    """
+    The events for up to BATCH_SIZE messages after last_id, and the id to
+    continue from. Every worker's stream reads the messages table, so it
+    sees posts made through any worker. Like every id-based delta, it only
+    misses no message on SQLite (see MessageDeltaPagination).
+    """
+    # Read before the query: every message up to it is committed, so the
+    # stream can skip ids that turn out to be gone (deleted, or rolled back).
+    # On PostgreSQL a lower id may still commit later; it is skipped too.
+    published = notifier.latest_id
+    if last_id is None:
+        last_id = Message.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    messages = list(
+        Message.objects.select_related('member').filter(id__gt=last_id).order_by('id')[:BATCH_SIZE]
+    )
+    events = [format_event(ChatMessageSerializer(message).data) for message in messages]
+    if messages:
+        last_id = messages[-1].pk
+    if len(messages) < BATCH_SIZE:
+        last_id = max(last_id, published)
+    if release_connection and not connection.in_atomic_block:
+        # The stream may stay idle for hours; don't pin a database
+        # connection to it.
+        connection.close()
+    return events, last_id, len(messages) == BATCH_SIZE
+
+
+def event_stream_sync(since_id, release_connection=False):
+    """
+    Yield Server-Sent Events: the messages after since_id (or, without it,
+    after the newest one), then each new message as api.notify announces
+    it, until WSGI_STREAM_SECONDS have passed.
+    """
+    deadline = time.monotonic() + WSGI_STREAM_SECONDS
+    yield 'retry: 3000\n\n'
+    last_id = since_id
+    while True:
+        events, last_id, more = read_events(last_id, release_connection)
+        yield from events
+        if more:
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if notifier.wait_for(last_id, min(KEEPALIVE_INTERVAL, remaining)) <= last_id:
+            yield ': keepalive\n\n'
+
+
+async def event_stream(since_id, release_connection=False):
+    """
+    event_stream_sync() for ASGI, without an end: an idle stream waits in
+    notifier.await_for() and holds no thread.
+    """
+    yield 'retry: 3000\n\n'
+    last_id = since_id
+    while True:
+        events, last_id, more = await sync_to_async(read_events)(last_id, release_connection)
+        for event in events:
+            yield event
+        if more:
+            continue
+        if await notifier.await_for(last_id, KEEPALIVE_INTERVAL) <= last_id:
+            yield ': keepalive\n\n'
+
+
+async def _send_json(send, status, data):
+    body = json.dumps(data).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def stream_application(scope, receive, send):
+    """
+    Bare ASGI app for /api/messages/stream/, mounted by config.asgi.
+
+    Django's ASGI handler keeps a dedicated executor thread alive for every
+    in-flight request, which dominates the cost of a stream that idles for
+    hours. Here an idle stream is just two small tasks waiting on the
+    notifier, and database work runs on asgiref's shared executor.
+    """
+    headers = {
+        name.decode('latin1').lower(): value.decode('latin1')
+        for name, value in scope['headers']
+    }
+    query = parse_qs(scope['query_string'].decode('latin1'))
+
+    member = await authenticate(
+        headers.get('authorization'), query.get('token', [None])[0]
+    )
+    if not member:
+        await _send_json(send, 401, {"detail": "Unauthorized - invalid or missing token"})
+        return
+    try:
+        since_id = parse_since_id(
+            headers.get('last-event-id') or query.get('since_id', [None])[0]
+        )
+    except ValueError:
+        await _send_json(send, 400, {"detail": "'since_id' must be an integer."})
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+
+    async def pump():
+        async for chunk in event_stream(since_id):
+            await send({
+                'type': 'http.response.body',
+                'body': chunk.encode(),
+                'more_body': True,
+            })
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    pump_task = asyncio.ensure_future(pump())
+    disconnect_task = asyncio.ensure_future(wait_for_disconnect())
+    await asyncio.wait(
+        {pump_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED
+    )
+    for task in (pump_task, disconnect_task):
+        task.cancel()
+    await asyncio.gather(pump_task, disconnect_task, return_exceptions=True)
+    if not disconnect_task.cancelled() and disconnect_task.exception() is None:
+        return
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
@@ -1,3 +1,1868 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import resource
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient,
+    AsyncRequestFactory,
+    Client,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from . import streaming
+from .archive import message_archive
+from .authentication import TokenCache, token_cache
+from .compression import accepts_gzip
+from .fastpath import message_rows, serialize_message_rows, stream_message_rows
+from .hashing import HashingUnavailable, PasswordHasherPool, password_hasher
+from .idempotency import IdempotencyCache, idempotency_cache
+from .metrics import (
+    _DB_QUERIES,
+    _SIZE_SUM,
+    SERIES_FIELDS,
+    STATUSES,
+    MetricsRegistry,
+    metrics,
+)
+from .models import (
+    ArchiveSegment,
+    Member,
+    Token,
+    Message,
+    MessageStats,
+    ReadCursor,
+    Room,
+    RoomMembership,
+    RoomMessage,
+)
+from .serializers import ChatMessageSerializer
+from .notify import MessageNotifier, notifier
+from .pagination import MessageCursorPagination
+from .profiling import NPlusOneQueries, QueryProfilerMiddleware
+from .ratelimit import RateLimiter, rate_limiter
+from .routers import ReplicaRouter, primary_pins, replica_reads
+from .search import MessageSearch
+from .sqlite import WalCheckpointer
+from .streaming import stream_application
+from .views import AsyncMeView, AsyncMessagesView, MeView
+from .writer import MessageWriter
+
+
+class ApiTestCase(TestCase):
+    """
+    Base test case with an authenticated member and client.
+    """
+
+    def setUp(self):
+        # Member ids are reused once each test's transaction is rolled back.
+        idempotency_cache.clear()
+        self.member = Member.objects.create(username='alice', password='x')
+        self.token = Token.objects.create(member=self.member)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.key}')
+
+    def create_messages(self, count, created_at=None):
+        messages = [
+            Message.objects.create(member=self.member, text=f'message {i}')
+            for i in range(count)
+        ]
+        if created_at is not None:
+            ids = [m.id for m in messages]
+            Message.objects.filter(id__in=ids).update(created_at=created_at)
+            messages = list(Message.objects.filter(id__in=ids).order_by('id'))
+        return messages
+
+
+class MessagePaginationTests(ApiTestCase):
+
+    def test_requires_token(self):
+        response = APIClient().get('/api/messages/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_default_page_is_newest(self):
+        messages = self.create_messages(3)
+        response = self.client.get('/api/messages/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [m['id'] for m in response.data['results']], [m.id for m in messages]
+        )
+        self.assertIsNone(response.data['next'])
+        self.assertIsNone(response.data['previous'])
+
+    def test_walks_history_with_shared_timestamps(self):
+        now = timezone.now()
+        older = self.create_messages(4, created_at=now - timedelta(minutes=1))
+        newer = self.create_messages(3, created_at=now)
+        expected = [m.id for m in older + newer]
+
+        seen = []
+        response = self.client.get('/api/messages/', {'limit': 2})
+        while True:
+            seen = [m['id'] for m in response.data['results']] + seen
+            if not response.data['previous']:
+                break
+            response = self.client.get(
+                '/api/messages/', {'limit': 2, 'before': response.data['previous']}
+            )
+        self.assertEqual(seen, expected)
+
+        cursor = MessageCursorPagination.encode_cursor(older[0])
+        seen = [older[0].id]
+        while cursor:
+            response = self.client.get('/api/messages/', {'limit': 2, 'after': cursor})
+            seen += [m['id'] for m in response.data['results']]
+            cursor = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/messages/', {'before': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_page_uses_created_at_index(self):
+        queryset = Message.objects.order_by('-created_at', '-id')[:51]
+        with connection.cursor() as cursor:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('messages_created_at_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class MessageConditionalGetTests(ApiTestCase):
+
+    def test_unchanged_list_is_not_modified(self):
+        self.create_messages(3)
+        etag = self.client.get('/api/messages/').headers['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        message_queries = [q['sql'] for q in queries if '"messages"' in q['sql']]
+        self.assertEqual(len(message_queries), 1)
+        self.assertIn('MAX', message_queries[0])
+        self.assertNotIn('COUNT', message_queries[0])
+
+    def test_etag_changes_when_messages_are_added_or_removed(self):
+        messages = self.create_messages(2)
+        etag = self.client.get('/api/messages/').headers['ETag']
+
+        self.create_messages(1)
+        response = self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        # Deletions are counted by a trigger, even for bulk deletes.
+        etag = response.headers['ETag']
+        Message.objects.filter(pk=messages[0].pk).delete()
+        response = self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(MessageStats.objects.get().deleted, 1)
+
+    def test_delta_mode_is_validated_too(self):
+        self.create_messages(2)
+        response = self.client.get('/api/messages/?since_id=0')
+        response = self.client.get(
+            '/api/messages/?since_id=0', HTTP_IF_NONE_MATCH=response.headers['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_requires_token_before_validating(self):
+        etag = self.client.get('/api/messages/').headers['ETag']
+        response = APIClient().get('/api/messages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 401)
+
+
+class FastSerializationTests(ApiTestCase):
+
+    def test_output_matches_serializer_bytes(self):
+        texts = ['plain', 'ünïcode ✓ 😀', 'line\u2028sep "quotes" \\ \n', '']
+        for text in texts:
+            Message.objects.create(member=self.member, text=text)
+        Message.objects.filter(text='plain').update(
+            created_at=timezone.now().replace(microsecond=0)
+        )
+        instances = Message.objects.select_related('member').order_by('id')
+        rows = message_rows(Message.objects.order_by('id'))
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(serialize_message_rows(rows)),
+            renderer.render(ChatMessageSerializer(instances, many=True).data),
+        )
+
+    def test_list_builds_no_model_instances(self):
+        self.create_messages(3)
+        with mock.patch.object(Message, '__init__') as init:
+            response = self.client.get('/api/messages/')
+        self.assertEqual(len(response.json()['results']), 3)
+        init.assert_not_called()
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MessageExportTests(ApiTestCase):
+
+    def test_json_chunks_match_renderer_bytes(self):
+        for text in ['one', 'two ✓', 'three\u2028', 'four', 'five']:
+            Message.objects.create(member=self.member, text=text)
+        rows = message_rows(Message.objects.order_by('id'))
+        expected = JSONRenderer().render(serialize_message_rows(rows))
+        for chunk_size in (1, 2, 5, 100):
+            streamed = b''.join(stream_message_rows(rows, chunk_size=chunk_size))
+            self.assertEqual(streamed, expected)
+        self.assertEqual(b''.join(stream_message_rows(rows.none())), b'[]')
+
+    def test_exports_ndjson_after_since_id(self):
+        messages = self.create_messages(3)
+        response = self.client.get(
+            f'/api/messages/export/?output=ndjson&since_id={messages[0].id}'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)['id'] for line in lines], [m.id for m in messages[1:]]
+        )
+
+    def test_rejects_bad_parameters(self):
+        for query in ('output=xml', 'since_id=abc'):
+            response = self.client.get(f'/api/messages/export/?{query}')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(APIClient().get('/api/messages/export/').status_code, 401)
+
+    def test_million_rows_stream_in_flat_memory(self):
+        count = 1_000_000
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO messages (member_id, text, created_at)
+                WITH RECURSIVE seq(n) AS (
+                    SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < %s
+                )
+                SELECT %s, 'message number ' || n, '2026-01-01 00:00:00.000000'
+                FROM seq
+                """,
+                [count, self.member.id],
+            )
+        rss_before, peak_before = rss_bytes(), peak_rss_bytes()
+
+        response = self.client.get('/api/messages/export/?output=ndjson')
+        lines = size = 0
+        for chunk in response.streaming_content:
+            lines += chunk.count(b'\n')
+            size += len(chunk)
+
+        self.assertEqual(lines, count)
+        # The export is ~90 MB; materialising it would take several times
+        # that. Streaming must not raise the peak by more than a few chunks.
+        self.assertGreater(size, 80 * 1024 * 1024)
+        self.assertLess(
+            peak_rss_bytes(), max(peak_before, rss_before + 64 * 1024 * 1024)
+        )
+
+
+class MessageSearchTests(ApiTestCase):
+
+    def search(self, **params):
+        return self.client.get('/api/messages/search/', params)
+
+    def test_ranks_and_highlights_matches(self):
+        weak = Message.objects.create(
+            member=self.member, text='apple and a long list of other fruit names'
+        )
+        strong = Message.objects.create(member=self.member, text='apple apple')
+        Message.objects.create(member=self.member, text='banana')
+
+        response = self.search(q='Apple')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['id'] for r in results], [strong.id, weak.id])
+        self.assertEqual(results[0]['username'], 'alice')
+        self.assertEqual(results[0]['snippet'], '<mark>apple</mark> <mark>apple</mark>')
+        self.assertIsNone(response.json()['next'])
+
+    def test_snippet_is_html_escaped_and_input_is_not_query_syntax(self):
+        Message.objects.create(member=self.member, text='<b>café</b> "NEAR" OR')
+        results = self.search(q='cafe" OR NEAR(').json()['results']
+        self.assertEqual(len(results), 1)
+        self.assertIn('&lt;b&gt;<mark>café</mark>&lt;/b&gt;', results[0]['snippet'])
+
+    def test_pages_through_ranked_results(self):
+        expected = {
+            Message.objects.create(member=self.member, text=f'hello {"x " * i}').id
+            for i in range(5)
+        }
+        seen, cursor = [], None
+        while True:
+            params = {'q': 'hello', 'limit': 2}
+            if cursor:
+                params['after'] = cursor
+            page = self.search(**params).json()
+            seen += [r['id'] for r in page['results']]
+            cursor = page['next']
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), expected)
+
+    def test_ranks_only_the_newest_matches(self):
+        messages = [
+            Message.objects.create(member=self.member, text=f'hello {"x " * i}')
+            for i in range(5)
+        ]
+        with mock.patch.object(MessageSearch, 'max_ranked', 3):
+            page = self.search(q='hello', limit=2).json()
+            page2 = self.search(q='hello', limit=2, after=page['next']).json()
+        self.assertIsNone(page2['next'])
+        self.assertEqual(
+            {r['id'] for r in page['results'] + page2['results']},
+            {m.id for m in messages[2:]},
+        )
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        Message.objects.bulk_create([Message(member=self.member, text='bulk words')])
+        self.assertEqual(len(self.search(q='bulk').json()['results']), 1)
+        Message.objects.filter(text='bulk words').update(text='edited')
+        self.assertEqual(self.search(q='bulk').json()['results'], [])
+        self.assertEqual(len(self.search(q='edited').json()['results']), 1)
+        Message.objects.all().delete()
+        self.assertEqual(self.search(q='edited').json()['results'], [])
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.search().status_code, 400)
+        self.assertEqual(self.search(q='!!!').status_code, 400)
+        self.assertEqual(self.search(q='a', after='garbage').status_code, 400)
+        for cursor in ((0, 1.0, 10 ** 30), (10 ** 30, 1.0, 1), (-2 ** 64, 1.0, 1), (0, float('nan'), 1)):
+            after = MessageSearch.encode_cursor(*cursor)
+            self.assertEqual(self.search(q='a', after=after).status_code, 400)
+        response = APIClient().get('/api/messages/search/', {'q': 'a'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_rebuild_repairs_index(self):
+        messages = self.create_messages(5)
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM messages_fts WHERE rowid <= %s', [messages[2].id])
+            cursor.execute(
+                "INSERT INTO messages_fts (rowid, text) VALUES (999999, 'message ghost')"
+            )
+        out = StringIO()
+        call_command('rebuild_search_index', batch_size=2, pause=0, stdout=out)
+        self.assertIn('indexed=5 removed=1 batches=3', out.getvalue())
+        results = self.search(q='message', limit=100).json()['results']
+        self.assertEqual(sorted(r['id'] for r in results), [m.id for m in messages])
+
+
+class MessageArchiveTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(message_archive, 'directory', Path(directory.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        message_archive.clear_cache()
+        self.addCleanup(message_archive.clear_cache)
+
+        old = timezone.now() - timedelta(days=40)
+        self.old = self.create_messages(2, created_at=old - timedelta(minutes=1))
+        self.old += self.create_messages(3, created_at=old)
+        self.new = self.create_messages(2)
+        self.expected = [m.id for m in self.old + self.new]
+
+    def archive(self, **options):
+        out = StringIO()
+        call_command('archive_messages', days=30, batch_size=2, pause=0, stdout=out, **options)
+        return out.getvalue()
+
+    def test_moves_old_messages_into_segments(self):
+        output = self.archive()
+        self.assertIn('archived=5 segments=3', output)
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('id', flat=True)),
+            [m.id for m in self.new],
+        )
+        segments = list(ArchiveSegment.objects.all())
+        self.assertEqual([s.count for s in segments], [2, 2, 1])
+        for segment in segments:
+            self.assertTrue((message_archive.directory / segment.path).exists())
+        self.assertIn('archived=0 segments=0', self.archive())
+
+    def test_dry_run_and_missing_retention(self):
+        self.assertIn('expired=5', self.archive(dry_run=True))
+        self.assertEqual(Message.objects.count(), 7)
+        with self.assertRaises(CommandError):
+            call_command('archive_messages', stdout=StringIO())
+
+    def test_history_pages_continue_into_archive(self):
+        self.archive()
+        seen = []
+        response = self.client.get('/api/messages/', {'limit': 2})
+        while True:
+            seen = [m['id'] for m in response.data['results']] + seen
+            if not response.data['previous']:
+                break
+            response = self.client.get(
+                '/api/messages/', {'limit': 2, 'before': response.data['previous']}
+            )
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(response.data['results'][0]['username'], 'alice')
+
+        cursor = MessageCursorPagination.encode_cursor(self.old[0])
+        seen = [self.old[0].id]
+        while cursor:
+            response = self.client.get('/api/messages/', {'limit': 2, 'after': cursor})
+            seen += [m['id'] for m in response.data['results']]
+            cursor = response.data['next']
+        self.assertEqual(seen, self.expected)
+
+    def test_segments_load_only_when_reached(self):
+        self.archive()
+        response = self.client.get('/api/messages/', {'limit': 1})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(message_archive._load.cache_info().currsize, 0)
+        response = self.client.get('/api/messages/', {'limit': 3})
+        self.assertEqual(
+            [m['id'] for m in response.data['results']], self.expected[-3:]
+        )
+        self.assertEqual(message_archive._load.cache_info().currsize, 2)
+
+    def test_export_includes_archived_messages(self):
+        self.archive()
+        response = self.client.get('/api/messages/export/')
+        items = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([m['id'] for m in items], self.expected)
+        response = self.client.get(
+            f'/api/messages/export/?output=ndjson&since_id={self.old[2].id}'
+        )
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], self.expected[3:])
+
+
+@override_settings(READ_REPLICA={'ALIAS': 'replica', 'PIN_SECONDS': 5})
+class ReadReplicaTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        primary_pins.clear()
+        member = Member.objects.create(username='alice', password='x')
+        self.token = Token.objects.create(member=member)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.key}')
+
+    def client_for(self, token):
+        # A new client, without cookies from earlier requests.
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.key}')
+        return client
+
+    def get_messages(self, client):
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = client.get('/api/messages/')
+        self.assertEqual(response.status_code, 200)
+        return response, len(replica)
+
+    def test_list_reads_from_replica(self):
+        response, replica_queries = self.get_messages(self.client)
+        self.assertGreater(replica_queries, 0)
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+
+    def test_posting_member_reads_own_writes(self):
+        response = self.client.post('/api/messages/', {'text': 'hello'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies, {})
+
+        # Any client of the member, cookies or not, reads from the primary.
+        other_device = self.client_for(Token.objects.create(member=self.token.member))
+        for client in (self.client, other_device):
+            response, replica_queries = self.get_messages(client)
+            self.assertEqual(replica_queries, 0)
+            self.assertEqual([m['text'] for m in response.data['results']], ['hello'])
+
+        bob = Member.objects.create(username='bob', password='x')
+        _, replica_queries = self.get_messages(self.client_for(Token.objects.create(member=bob)))
+        self.assertGreater(replica_queries, 0)
+
+    def test_pin_expires(self):
+        self.client.post('/api/messages/', {'text': 'hello'}, format='json')
+        later = time.monotonic() + 6
+        with mock.patch.object(primary_pins, 'clock', return_value=later):
+            _, replica_queries = self.get_messages(self.client)
+        self.assertGreater(replica_queries, 0)
+
+    def test_failed_writes_do_not_pin(self):
+        response = self.client.post('/api/messages/', {'text': ''}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(primary_pins.is_pinned(self.token.member_id))
+
+    def test_reads_in_transactions_use_primary(self):
+        router = ReplicaRouter()
+
+        @replica_reads
+        def handler(view, request):
+            outside = router.db_for_read(Message)
+            with transaction.atomic():
+                inside = router.db_for_read(Message)
+            return outside, inside
+
+        self.assertEqual(handler(None, RequestFactory().get('/')), ('replica', None))
+
+        @replica_reads
+        async def async_handler(view, request):
+            return await sync_to_async(router.db_for_read)(Message)
+
+        request = RequestFactory().get('/')
+        self.assertEqual(async_to_sync(async_handler)(None, request), 'replica')
+        self.assertIsNone(router.db_for_read(Message))
+        self.assertEqual(router.db_for_write(Message), 'default')
+
+
+class AsyncViewTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+        self.auth = {'Authorization': f'Bearer {self.token.key}'}
+
+    async def call(self, view, request):
+        return await view.as_view()(request)
+
+    async def test_list_matches_sync_view(self):
+        messages = await sync_to_async(self.create_messages)(5)
+        queries = [
+            {},
+            {'limit': 2},
+            {'limit': 2, 'before': MessageCursorPagination.encode_cursor(messages[2])},
+            {'limit': 2, 'after': MessageCursorPagination.encode_cursor(messages[0])},
+            {'before': 'not-a-cursor'},
+            {'since_id': messages[1].id},
+        ]
+        for query in queries:
+            expected = await sync_to_async(self.client.get)('/api/messages/', query)
+            response = await self.call(
+                AsyncMessagesView,
+                self.factory.get('/api/messages/', query, headers=self.auth),
+            )
+            self.assertEqual(response.status_code, expected.status_code, query)
+            self.assertEqual(response.content, expected.content, query)
+            self.assertEqual(response.get('ETag'), expected.get('ETag'), query)
+
+        request = self.factory.get(
+            '/api/messages/', headers={**self.auth, 'If-None-Match': expected['ETag']}
+        )
+        self.assertEqual((await self.call(AsyncMessagesView, request)).status_code, 304)
+
+    async def test_me(self):
+        expected = await sync_to_async(self.client.get)('/api/auth/me/')
+        request = self.factory.get('/api/auth/me/', headers=self.auth)
+        response = await self.call(AsyncMeView, request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+
+    async def test_create(self):
+        request = self.factory.post(
+            '/api/messages/', {'text': 'hello'}, content_type='application/json',
+            headers=self.auth,
+        )
+        response = await self.call(AsyncMessagesView, request)
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.content)
+        self.assertEqual((data['username'], data['text']), ('alice', 'hello'))
+        self.assertTrue(await Message.objects.filter(id=data['id'], text='hello').aexists())
+
+        headers = {**self.auth, 'Idempotency-Key': 'key-1'}
+        responses = [
+            await self.call(AsyncMessagesView, self.factory.post(
+                '/api/messages/', {'text': 'again'}, content_type='application/json',
+                headers=headers,
+            ))
+            for _ in range(2)
+        ]
+        self.assertEqual([r.status_code for r in responses], [201, 201])
+        self.assertEqual(responses[0].content, responses[1].content)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        self.assertEqual(await Message.objects.filter(text='again').acount(), 1)
+
+        for body in ('{"text": ""}', '{not json'):
+            request = self.factory.post(
+                '/api/messages/', body, content_type='application/json',
+                headers=self.auth,
+            )
+            response = await self.call(AsyncMessagesView, request)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('detail', json.loads(response.content))
+
+    async def test_requires_token(self):
+        for view, path in ((AsyncMessagesView, '/api/messages/'), (AsyncMeView, '/api/auth/me/')):
+            response = await self.call(view, self.factory.get(path))
+            self.assertEqual(response.status_code, 401)
+
+
+class MessageCreateTests(ApiTestCase):
+
+    def test_post_creates_message(self):
+        response = self.client.post('/api/messages/', {'text': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['username'], 'alice')
+        self.assertEqual(Message.objects.get().text, 'hi')
+
+
+class IdempotentMessageTests(ApiTestCase):
+
+    def post(self, text, key, client=None):
+        return (client or self.client).post(
+            '/api/messages/', {'text': text}, format='json',
+            headers={'Idempotency-Key': key},
+        )
+
+    def test_retry_returns_the_original_message(self):
+        first = self.post('hi', 'key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+        with self.assertNumQueries(0):
+            retry = self.post('hi', 'key-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Message.objects.get().client_id, 'key-1')
+
+    def test_retry_reaching_another_worker(self):
+        first = self.post('hi', 'key-1')
+        idempotency_cache.clear()
+        retry = self.post('hi', 'key-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Message.objects.count(), 1)
+        # The lookup is cached in turn.
+        with self.assertNumQueries(0):
+            self.post('hi', 'key-1')
+
+    def test_keys_are_per_member(self):
+        bob = Member.objects.create(username='bob', password='x')
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION=f'Bearer {Token.objects.create(member=bob).key}')
+        self.post('hi', 'key-1')
+        response = self.post('hi', 'key-1', client=other)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(response.json()['username'], 'bob')
+        self.assertEqual(Message.objects.count(), 2)
+        # Posts without a key are never deduplicated.
+        for _ in range(2):
+            self.client.post('/api/messages/', {'text': 'hi'}, format='json')
+        self.assertEqual(Message.objects.count(), 4)
+
+    def test_rejects_bad_and_reused_keys(self):
+        for key in ('', 'x' * 65, 'has space', 'ключ'):
+            self.assertEqual(self.post('hi', key).status_code, 400, key)
+        self.assertFalse(Message.objects.exists())
+        self.post('hi', 'key-1')
+        response = self.post('something else', 'key-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_cache_expires_keys_after_the_window(self):
+        cache = IdempotencyCache(max_size=2, window=60)
+        with mock.patch('api.idempotency.time.monotonic', return_value=1000):
+            cache.set(1, 'a', {'id': 1})
+        with mock.patch('api.idempotency.time.monotonic', return_value=1030):
+            cache.set(1, 'b', {'id': 2})
+            self.assertEqual(cache.get(1, 'a'), {'id': 1})
+            self.assertIsNone(cache.get(2, 'a'))
+        with mock.patch('api.idempotency.time.monotonic', return_value=1060):
+            self.assertIsNone(cache.get(1, 'a'))
+            self.assertEqual(cache.get(1, 'b'), {'id': 2})
+            cache.set(1, 'c', {'id': 3})
+            cache.set(1, 'd', {'id': 4})
+        self.assertEqual(len(cache), 2)
+
+
+class MessageBatchTests(ApiTestCase):
+
+    def test_creates_messages_in_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/messages/batch/', {
+                'messages': [{'text': 'one'}, {'text': 'two'}, {'text': 'three'}]
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        results = response.json()['results']
+        self.assertEqual([m['text'] for m in results], ['one', 'two', 'three'])
+        self.assertEqual(
+            [m['id'] for m in results],
+            list(Message.objects.order_by('id').values_list('id', flat=True))
+        )
+        self.assertEqual({m['username'] for m in results}, {'alice'})
+        self.assertGreaterEqual(notifier.latest_id, results[-1]['id'])
+
+    def test_rejects_invalid_batches(self):
+        for messages in ([], [{'text': 'ok'}, {'text': ''}], [{'text': 'x'}] * 101):
+            response = self.client.post(
+                '/api/messages/batch/', {'messages': messages}, format='json'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIsInstance(response.json()['detail'], str)
+        self.assertFalse(Message.objects.exists())
+
+
+class MessageWriterTests(TransactionTestCase):
+
+    def setUp(self):
+        self.member = Member.objects.create(username='alice', password='x')
+
+    def create_concurrently(self, writer, count, client_ids=()):
+        results = [None] * count
+        client_ids = dict(enumerate(client_ids))
+
+        def create(i):
+            try:
+                results[i] = writer.create(
+                    self.member, f'message {i}', client_id=client_ids.get(i)
+                )
+            except Exception as exc:
+                results[i] = exc
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_groups_concurrent_messages_into_one_insert(self):
+        writer = MessageWriter(batching=True, max_wait=5, max_batch=5)
+        with mock.patch.object(
+            Message.objects, 'bulk_create', wraps=Message.objects.bulk_create
+        ) as bulk_create:
+            messages = self.create_concurrently(writer, 5)
+        self.assertEqual(bulk_create.call_count, 1)
+        stored = dict(Message.objects.values_list('id', 'text'))
+        self.assertEqual({m.id: m.text for m in messages}, stored)
+        self.assertTrue(all(m.created_at for m in messages))
+
+    def test_group_failure_reaches_every_caller(self):
+        writer = MessageWriter(batching=True, max_wait=5, max_batch=3)
+        with mock.patch.object(
+            Message.objects, 'bulk_create', side_effect=DatabaseError('locked')
+        ):
+            results = self.create_concurrently(writer, 3)
+        self.assertTrue(all(isinstance(r, DatabaseError) for r in results))
+        self.assertFalse(Message.objects.exists())
+
+    def test_duplicate_client_id_fails_only_its_caller(self):
+        Message.objects.create(member=self.member, text='sent', client_id='key')
+        writer = MessageWriter(batching=True, max_wait=5, max_batch=3)
+        results = self.create_concurrently(writer, 3, client_ids=[None, 'key', 'other'])
+        self.assertIsInstance(results[1], IntegrityError)
+        self.assertEqual(
+            sorted(Message.objects.values_list('text', flat=True)),
+            ['message 0', 'message 2', 'sent'],
+        )
+
+    def test_single_message_waits_at_most_max_wait(self):
+        writer = MessageWriter(batching=True, max_wait=0.01, max_batch=100)
+        started = time.monotonic()
+        message = writer.create(self.member, 'hi')
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(Message.objects.filter(pk=message.pk).exists())
+
+    def test_async_grouped_create_expires_executor_connections(self):
+        writer = MessageWriter(batching=True, max_wait=0.01, max_batch=100)
+        with mock.patch('api.writer.close_old_connections') as close_old_connections:
+            message = async_to_sync(writer.acreate)(self.member, 'hi')
+        self.assertEqual(close_old_connections.call_count, 2)
+        self.assertTrue(Message.objects.filter(pk=message.pk).exists())
+
+
+class MessageDeltaSyncTests(ApiTestCase):
+
+    def test_returns_only_newer_messages(self):
+        messages = self.create_messages(5)
+        response = self.client.get('/api/messages/', {'since_id': messages[2].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [m['id'] for m in response.data['results']], [m.id for m in messages[3:]]
+        )
+        self.assertEqual(response.data['high_water_mark'], messages[-1].id)
+        self.assertFalse(response.data['has_more'])
+
+    def test_empty_delta_keeps_high_water_mark(self):
+        messages = self.create_messages(2)
+        response = self.client.get('/api/messages/', {'since_id': messages[-1].id})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['high_water_mark'], messages[-1].id)
+
+    def test_no_message_lost_on_shared_created_at(self):
+        created_at = timezone.now()
+        first = self.create_messages(1, created_at=created_at)[0]
+        response = self.client.get('/api/messages/', {'since_id': 0})
+        high_water_mark = response.data['high_water_mark']
+        self.assertEqual(high_water_mark, first.id)
+
+        second = self.create_messages(2, created_at=created_at)
+        self.assertEqual(second[0].created_at, first.created_at)
+        response = self.client.get('/api/messages/', {'since_id': high_water_mark})
+        self.assertEqual(
+            [m['id'] for m in response.data['results']], [m.id for m in second]
+        )
+
+    def test_has_more_is_paged_by_limit(self):
+        messages = self.create_messages(5)
+        seen = []
+        since_id = 0
+        while True:
+            response = self.client.get(
+                '/api/messages/', {'since_id': since_id, 'limit': 2}
+            )
+            seen += [m['id'] for m in response.data['results']]
+            since_id = response.data['high_water_mark']
+            if not response.data['has_more']:
+                break
+        self.assertEqual(seen, [m.id for m in messages])
+
+    def test_invalid_since_id(self):
+        response = self.client.get('/api/messages/', {'since_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_delta_uses_primary_key(self):
+        queryset = Message.objects.filter(id__gt=10).order_by('id')[:51]
+        with connection.cursor() as cursor:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('INTEGER PRIMARY KEY', plan)
+
+
+class MessageNotifierTests(TestCase):
+
+    def test_wait_returns_immediately_when_already_newer(self):
+        local_notifier = MessageNotifier()
+        local_notifier.publish(5)
+        started = time.monotonic()
+        self.assertEqual(local_notifier.wait_for(4, timeout=5), 5)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_wait_times_out(self):
+        local_notifier = MessageNotifier()
+        started = time.monotonic()
+        self.assertEqual(local_notifier.wait_for(0, timeout=0.1), 0)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    def test_publish_wakes_waiter_in_same_process(self):
+        local_notifier = MessageNotifier()
+        threading.Timer(0.1, local_notifier.publish, args=(7,)).start()
+        started = time.monotonic()
+        self.assertEqual(local_notifier.wait_for(0, timeout=5), 7)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_publish_wakes_waiter_in_other_process(self):
+        local_notifier = MessageNotifier()
+        local_notifier.wait_for(0, timeout=0)
+        publisher = multiprocessing.get_context('fork').Process(
+            target=lambda: (time.sleep(0.1), local_notifier.publish(9))
+        )
+        publisher.start()
+        started = time.monotonic()
+        self.assertEqual(local_notifier.wait_for(0, timeout=5), 9)
+        self.assertLess(time.monotonic() - started, 1)
+        publisher.join()
+
+    async def test_await_for_wakes_coroutines(self):
+        local_notifier = MessageNotifier()
+        self.assertEqual(await local_notifier.await_for(0, timeout=0.05), 0)
+        publisher = multiprocessing.get_context('fork').Process(
+            target=lambda: (time.sleep(0.1), local_notifier.publish(4))
+        )
+        publisher.start()
+        started = time.monotonic()
+        waiters = [local_notifier.await_for(0, timeout=5) for _ in range(3)]
+        self.assertEqual(await asyncio.gather(*waiters), [4, 4, 4])
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(local_notifier._futures, set())
+        await asyncio.to_thread(publisher.join)
+
+    def test_exited_worker_does_not_block_publish(self):
+        local_notifier = MessageNotifier()
+
+        def wait_and_exit():
+            threading.Thread(
+                target=local_notifier.wait_for, args=(0, 5), daemon=True
+            ).start()
+            time.sleep(0.2)
+            os._exit(0)
+
+        worker = multiprocessing.get_context('fork').Process(target=wait_and_exit)
+        worker.start()
+        worker.join()
+        publisher = threading.Thread(target=local_notifier.publish, args=(3,), daemon=True)
+        publisher.start()
+        publisher.join(2)
+        self.assertFalse(publisher.is_alive())
+        self.assertEqual(local_notifier.wait_for(0, timeout=1), 3)
+
+    def test_message_commit_publishes_id(self):
+        member = Member.objects.create(username='bob', password='x')
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(member=member, text='hi')
+        self.assertGreaterEqual(notifier.latest_id, message.id)
+
+
+class MessagesWaitTests(ApiTestCase):
+
+    def test_returns_pending_messages_without_waiting(self):
+        messages = self.create_messages(2)
+        with mock.patch.object(notifier, 'wait_for') as wait_for:
+            response = self.client.get(
+                '/api/messages/wait/', {'since_id': messages[0].id}
+            )
+        wait_for.assert_not_called()
+        self.assertEqual([m['id'] for m in response.data['results']], [messages[1].id])
+        self.assertEqual(response.data['high_water_mark'], messages[1].id)
+
+    def test_returns_messages_posted_while_waiting(self):
+        def post_message(since_id, timeout):
+            return self.create_messages(1)[0].id
+
+        with mock.patch.object(notifier, 'wait_for', side_effect=post_message):
+            response = self.client.get('/api/messages/wait/', {'since_id': 0})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['text'], 'message 0')
+
+    def test_timeout_returns_empty_delta(self):
+        response = self.client.get(
+            '/api/messages/wait/', {'since_id': 10**9, 'timeout': 0.05}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['high_water_mark'], 10**9)
+
+    def test_requires_since_id(self):
+        response = self.client.get('/api/messages/wait/')
+        self.assertEqual(response.status_code, 400)
+
+
+class MessageStreamTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # A notifier of its own: the global one remembers ids from other
+        # tests, which reuse ids once rolled back.
+        self.notifier = MessageNotifier()
+        patcher = mock.patch.object(streaming, 'notifier', self.notifier)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def read_event(self, stream):
+        while True:
+            chunk = await asyncio.wait_for(anext(stream), 1)
+            if chunk.startswith(b'id:'):
+                lines = chunk.decode().splitlines()
+                return json.loads(lines[2].removeprefix('data: '))
+
+    async def test_requires_token(self):
+        response = await self.async_client.get('/api/messages/stream/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_replays_and_pushes_messages(self):
+        messages = [
+            await Message.objects.acreate(member=self.member, text=f'message {i}')
+            for i in range(2)
+        ]
+        response = await self.async_client.get(
+            '/api/messages/stream/',
+            {'token': self.token.key},
+            headers={'Last-Event-ID': str(messages[0].id)},
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual((await self.read_event(stream))['id'], messages[1].id)
+
+        live = await Message.objects.acreate(member=self.member, text='live')
+        self.notifier.publish(live.id)
+        self.assertEqual((await self.read_event(stream))['text'], 'live')
+
+        # A client disconnect cancels the task that drives the stream.
+        reader = asyncio.ensure_future(self.read_event(stream))
+        await asyncio.sleep(0.01)
+        reader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+        self.assertEqual(self.notifier._futures, set())
+
+    def test_wsgi_streams_from_a_sync_generator(self):
+        messages = self.create_messages(2)
+        with mock.patch.object(streaming, 'WSGI_STREAM_SECONDS', 0.5):
+            response = Client().get(
+                '/api/messages/stream/',
+                {'token': self.token.key, 'since_id': messages[0].id},
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.is_async)
+            stream = iter(response.streaming_content)
+            self.assertTrue(next(stream).startswith(b'retry:'))
+            self.assertTrue(next(stream).startswith(f'id: {messages[1].id}\n'.encode()))
+
+            # Posted through another worker: only the shared id announces it.
+            live = Message.objects.create(member=self.member, text='live')
+            threading.Timer(0.1, self.notifier.publish, args=(live.id,)).start()
+            self.assertTrue(next(stream).startswith(f'id: {live.id}\n'.encode()))
+            # The stream ends, and the client reconnects.
+            self.assertEqual(list(stream), [b': keepalive\n\n'])
+
+
+class StreamApplicationTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.notifier = MessageNotifier()
+        patcher = mock.patch.object(streaming, 'notifier', self.notifier)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def call(self, query_string, events, disconnect):
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            await events.put(message)
+
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/messages/stream/',
+            'query_string': query_string.encode(),
+            'headers': [],
+        }
+        await stream_application(scope, receive, send)
+
+    async def test_rejects_invalid_token(self):
+        events = asyncio.Queue()
+        await self.call('token=nope', events, asyncio.Event())
+        self.assertEqual((await events.get())['status'], 401)
+
+    async def test_pushes_live_events_until_disconnect(self):
+        events, disconnect = asyncio.Queue(), asyncio.Event()
+        task = asyncio.ensure_future(self.call(f'token={self.token.key}', events, disconnect))
+        self.assertEqual((await asyncio.wait_for(events.get(), 1))['status'], 200)
+        self.assertIn(b'retry:', (await asyncio.wait_for(events.get(), 1))['body'])
+        await asyncio.sleep(0.05)
+
+        message = await Message.objects.acreate(member=self.member, text='live')
+        self.notifier.publish(message.id)
+        body = (await asyncio.wait_for(events.get(), 1))['body']
+        self.assertTrue(body.startswith(f'id: {message.id}\n'.encode()))
+
+        disconnect.set()
+        await asyncio.wait_for(task, 1)
+        self.assertEqual(self.notifier._futures, set())
+
+
+class TokenCacheTests(ApiTestCase):
+
+    def test_repeated_requests_skip_token_query(self):
+        token_cache.clear()
+        self.client.get('/api/auth/me/')
+        # Only the read state; no token lookup.
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/auth/me/')
+        self.assertEqual(response.data['username'], 'alice')
+
+    def test_deleted_token_stops_working(self):
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+
+    def test_member_change_is_visible(self):
+        self.client.get('/api/auth/me/')
+        self.member.username = 'alice2'
+        self.member.save()
+        self.assertEqual(self.client.get('/api/auth/me/').data['username'], 'alice2')
+
+    def test_counts_hits_and_misses(self):
+        cache = TokenCache(max_size=10, ttl=60)
+        self.assertIsNone(cache.get('k'))
+        cache.set('k', self.token, cache.generation)
+        self.assertIs(cache.get('k'), self.token)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_evicts_least_recently_used(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        for key in ('a', 'b'):
+            cache.set(key, self.token, cache.generation)
+        cache.get('a')
+        cache.set('c', self.token, cache.generation)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        cache = TokenCache(max_size=10, ttl=0)
+        cache.set('k', self.token, cache.generation)
+        self.assertIsNone(cache.get('k'))
+
+    def test_stale_load_is_not_cached(self):
+        cache = TokenCache(max_size=10, ttl=60)
+        generation = cache.generation
+        cache.invalidate()
+        cache.set('k', self.token, generation)
+        self.assertIsNone(cache.get('k'))
+
+    def test_invalidation_reaches_other_processes(self):
+        cache = TokenCache(max_size=10, ttl=60)
+        cache.set('k', self.token, cache.generation)
+        child = multiprocessing.get_context('fork').Process(target=cache.invalidate)
+        child.start()
+        child.join()
+        self.assertIsNone(cache.get('k'))
+
+
+@override_settings(METRICS_TOKEN='scraper-secret')
+class MetricsTests(ApiTestCase):
+
+    def series(self, route, method='GET', registry=metrics):
+        for series_route, series_method, values in registry.collect()[0]:
+            if (series_route, series_method) == (route, method):
+                return values
+        return [0.0] * SERIES_FIELDS
+
+    def requests(self, values):
+        return sum(values[:len(STATUSES)])
+
+    def scrape(self, token='scraper-secret'):
+        headers = {} if token is None else {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        return APIClient().get('/api/metrics/', **headers)
+
+    def observe(self, registry, path='/api/messages/', status=200):
+        request = RequestFactory().get(path)
+        request.resolver_match = resolve(path)
+        registry.observe(request, HttpResponse(b'x' * 10, status=status), 0.002, [3, 0.001])
+
+    def test_counts_requests_by_route(self):
+        before = self.series('api/messages/')
+        self.create_messages(3)
+        self.client.get('/api/messages/')
+        self.client.get('/api/messages/', HTTP_IF_NONE_MATCH='*')
+        after = self.series('api/messages/')
+        self.assertEqual(self.requests(after) - self.requests(before), 2)
+        self.assertGreater(after[_DB_QUERIES], before[_DB_QUERIES])
+        self.assertGreater(after[_SIZE_SUM], before[_SIZE_SUM])
+
+    def test_unknown_paths_share_one_series(self):
+        before = self.series('unmatched')
+        self.client.get('/api/nope/')
+        self.client.get('/api/nope/either/')
+        self.assertEqual(self.requests(self.series('unmatched')) - self.requests(before), 2)
+
+    def test_renders_prometheus_text(self):
+        self.client.get('/api/auth/me/')
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('http_requests_total{route="api/auth/me/",method="GET",status="2xx"}', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="api/auth/me/",method="GET",le="+Inf"}', body)
+        self.assertIn('token_cache_hit_ratio ', body)
+
+    def test_needs_metrics_token(self):
+        self.assertEqual(self.scrape(token=None).status_code, 404)
+        self.assertEqual(self.scrape(token='guess').status_code, 404)
+        with self.settings(METRICS_TOKEN=None):
+            self.assertEqual(self.scrape().status_code, 404)
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry(max_workers=2, max_series=4)
+        self.observe(registry)
+        self.observe(registry, status=503)
+        body = registry.render()
+        labels = 'route="api/messages/",method="GET"'
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.001"}} 0', body)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="0.0025"}} 2', body)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn(f'http_requests_total{{{labels},status="5xx"}} 1', body)
+        self.assertIn(f'http_request_db_queries_total{{{labels}}} 6', body)
+        self.assertIn(f'http_response_size_bytes_bucket{{{labels},le="100"}} 2', body)
+
+    def test_aggregates_worker_processes(self):
+        registry = MetricsRegistry(max_workers=4, max_series=4)
+        self.observe(registry)
+        child = multiprocessing.get_context('fork').Process(target=self.observe, args=(registry,))
+        child.start()
+        child.join()
+        self.assertEqual(self.requests(self.series('api/messages/', registry=registry)), 2)
+        # A new worker takes over the dead child's slot and its counts.
+        self.observe(registry, path='/api/auth/me/')
+        child = multiprocessing.get_context('fork').Process(target=self.observe, args=(registry,))
+        child.start()
+        child.join()
+        self.assertEqual(self.requests(self.series('api/messages/', registry=registry)), 3)
+        self.assertEqual(self.requests(self.series('api/auth/me/', registry=registry)), 1)
+        self.assertEqual(sum(1 for pid in registry._pids if pid), 2)
+
+    def test_lock_of_a_killed_worker_skips_measuring(self):
+        registry = MetricsRegistry(max_workers=2, max_series=4)
+        registry.lock_timeout = 0.01
+        killed = multiprocessing.get_context('fork').Process(
+            target=lambda: (registry._shared_lock.acquire(), os._exit(0))
+        )
+        killed.start()
+        killed.join()
+        self.observe(registry)
+        self.assertEqual(self.requests(self.series('api/messages/', registry=registry)), 0)
+
+    def test_overflowing_series_are_counted_as_other(self):
+        registry = MetricsRegistry(max_workers=1, max_series=2)
+        self.observe(registry, path='/api/messages/')
+        self.observe(registry, path='/api/auth/me/')
+        self.assertEqual(self.requests(self.series('api/messages/', registry=registry)), 1)
+        self.assertEqual(self.requests(self.series('other', 'other', registry=registry)), 1)
+
+
+@override_settings(RATE_LIMITING={
+    'ENABLED': True,
+    'ROUTES': {
+        'login': {'POST': {'ip': '3/min'}},
+        'messages': {'POST': {'token': '2/min', 'ip': '3/min'}},
+    },
+})
+class RateLimitTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rate_limiter.clear()
+        self.addCleanup(rate_limiter.clear)
+
+    def login(self, ip='10.0.0.1'):
+        return APIClient().post(
+            '/api/auth/login/', {'username': 'alice', 'password': 'x'},
+            format='json', HTTP_X_REAL_IP=ip,
+        )
+
+    def post(self, client, ip='10.0.0.1'):
+        return client.post('/api/messages/', {'text': 'hi'}, format='json', HTTP_X_REAL_IP=ip)
+
+    @mock.patch.object(rate_limiter, 'clock', return_value=1000.0)
+    def test_rejects_over_limit_before_hashing(self, clock):
+        for _ in range(3):
+            self.assertNotEqual(self.login().status_code, 429)
+        with mock.patch.object(password_hasher, 'check_password') as check, \
+                self.assertNumQueries(0):
+            response = self.login()
+        check.assert_not_called()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertIn('detail', response.json())
+        self.assertNotEqual(self.login(ip='10.0.0.2').status_code, 429)
+
+    def test_limits_each_token_and_ip(self):
+        other = Member.objects.create(username='bob', password='x')
+        bob = APIClient()
+        bob.credentials(HTTP_AUTHORIZATION=f'Bearer {Token.objects.create(member=other).key}')
+        self.assertEqual([self.post(self.client).status_code for _ in range(3)], [201, 201, 429])
+        # A rejected request takes nothing from its other buckets: bob has
+        # his own token budget, but only one request left on the shared IP.
+        self.assertEqual([self.post(bob).status_code for _ in range(2)], [201, 429])
+        self.assertEqual(self.post(bob, ip='10.0.0.2').status_code, 201)
+
+    def test_reads_are_not_limited(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get('/api/messages/').status_code, 200)
+
+    def test_buckets_refill(self):
+        limiter = RateLimiter(slots=8)
+        with mock.patch.object(limiter, 'clock', return_value=1000.0):
+            self.assertEqual(limiter.acquire(('k', 2, 60)), 0)
+            self.assertEqual(limiter.acquire(('k', 2, 60)), 0)
+            self.assertAlmostEqual(limiter.acquire(('k', 2, 60)), 30)
+        with mock.patch.object(limiter, 'clock', return_value=1030.0):
+            self.assertEqual(limiter.acquire(('k', 2, 60)), 0)
+
+    def test_buckets_are_shared_between_processes(self):
+        limiter = RateLimiter(slots=8)
+        child = multiprocessing.get_context('fork').Process(
+            target=limiter.acquire, args=(('k', 1, 60),)
+        )
+        child.start()
+        child.join()
+        self.assertGreater(limiter.acquire(('k', 1, 60)), 0)
+
+    def test_full_table_reuses_the_idlest_bucket(self):
+        limiter = RateLimiter(slots=2, probes=2)
+        for key in ('a', 'b'):
+            limiter.acquire((key, 1, 60))
+        self.assertEqual(limiter.acquire(('c', 1, 60)), 0)
+        self.assertGreater(limiter.acquire(('c', 1, 60)), 0)
+
+    def test_lock_of_a_killed_worker_fails_open(self):
+        limiter = RateLimiter(slots=8)
+        limiter.lock_timeout = 0.01
+        limiter.acquire(('k', 1, 60))
+        killed = multiprocessing.get_context('fork').Process(
+            target=lambda: (limiter._lock.acquire(), os._exit(0))
+        )
+        killed.start()
+        killed.join()
+        with self.assertLogs('api.ratelimit', 'WARNING'):
+            self.assertEqual(limiter.acquire(('k', 1, 60)), 0)
+
+
+class QueryProfilingTests(ApiTestCase):
+
+    def middleware(self, view, **config):
+        with override_settings(QUERY_PROFILING={**settings.QUERY_PROFILING, **config}):
+            return QueryProfilerMiddleware(lambda request: view())
+
+    def test_serializer_without_select_related_is_n_plus_one(self):
+        self.create_messages(6)
+
+        def view():
+            data = ChatMessageSerializer(Message.objects.order_by('id'), many=True).data
+            return HttpResponse(json.dumps(data, default=str))
+
+        middleware = self.middleware(view)
+        with self.assertRaisesMessage(NPlusOneQueries, 'ran 6 times, from api/tests.py'):
+            middleware(RequestFactory().get('/api/messages/'))
+
+    def test_select_related_is_not_n_plus_one(self):
+        self.create_messages(6)
+
+        def view():
+            messages = Message.objects.select_related('member').order_by('id')
+            return HttpResponse(json.dumps(ChatMessageSerializer(messages, many=True).data, default=str))
+
+        response = self.middleware(view)(RequestFactory().get('/api/messages/'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_n_plus_one_fails_requests_in_tests(self):
+        self.create_messages(6)
+
+        def get(view, request):
+            return Response(ChatMessageSerializer(Message.objects.all(), many=True).data)
+
+        with mock.patch.object(MeView, 'get', get):
+            with self.assertRaises(NPlusOneQueries):
+                self.client.get('/api/auth/me/')
+
+    @override_settings(DEBUG=True)
+    def test_header_returns_breakdown_and_logs_plans(self):
+        self.create_messages(3)
+        with self.settings(QUERY_PROFILING={**settings.QUERY_PROFILING, 'EXPLAIN': True}):
+            with self.assertLogs('api.profiling', 'INFO') as logs:
+                response = self.client.get('/api/messages/', HTTP_X_PROFILE='1')
+        timing = dict(
+            entry.split(';dur=') for entry in response['Server-Timing'].split(', ')
+        )
+        self.assertEqual(set(timing), {'auth', 'query', 'serialize', 'render', 'other', 'total'})
+        self.assertGreater(float(timing['query']), 0)
+        self.assertIn('GET /api/messages/ 200 took', logs.output[0])
+        self.assertIn('plan: ', logs.output[0])
+
+    def test_header_needs_key(self):
+        with self.settings(QUERY_PROFILING={**settings.QUERY_PROFILING, 'KEY': 'secret', 'SAMPLE_RATE': 0}):
+            response = self.client.get('/api/auth/me/', HTTP_X_PROFILE='guess')
+            self.assertNotIn('Server-Timing', response)
+            with self.assertLogs('api.profiling', 'INFO'):
+                response = self.client.get('/api/auth/me/', HTTP_X_PROFILE='secret')
+            self.assertIn('Server-Timing', response)
+
+    def test_logs_slow_requests(self):
+        with self.settings(QUERY_PROFILING={**settings.QUERY_PROFILING, 'SLOW_REQUEST_MS': 0}):
+            with self.assertLogs('api.profiling', 'WARNING') as logs:
+                self.client.get('/api/auth/me/')
+        self.assertIn('GET /api/auth/me/ 200 took', logs.output[0])
+        self.assertIn('queries', logs.output[0])
+
+
+class TokenLifecycleTests(ApiTestCase):
+
+    def login(self):
+        return APIClient().post(
+            '/api/auth/login/', {'username': 'bob', 'password': 'secret'}, format='json'
+        )
+
+    def setUp(self):
+        super().setUp()
+        Member.objects.create(username='bob', password=make_password('secret'))
+
+    def test_login_reuses_live_token(self):
+        first = self.login().data['token']
+        self.assertEqual(self.login().data['token'], first)
+        self.assertEqual(Token.objects.filter(member__username='bob').count(), 1)
+
+    def test_login_does_not_reuse_token_near_expiry(self):
+        first = self.login().data['token']
+        Token.objects.filter(key=first).update(
+            expires_at=timezone.now() + timedelta(seconds=5)
+        )
+        second = self.login().data['token']
+        self.assertNotEqual(second, first)
+        token = Token.objects.get(key=second)
+        self.assertGreater(
+            token.expires_at, timezone.now() + settings.TOKEN_LIFETIME / 2
+        )
+
+    @override_settings(TOKEN_LOGIN_POLICY='rotate')
+    def test_login_rotation_revokes_previous_token(self):
+        first = self.login().data['token']
+        second = self.login().data['token']
+        self.assertNotEqual(first, second)
+        self.assertFalse(Token.objects.filter(key=first).exists())
+
+    def test_expired_token_is_rejected(self):
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 200)
+        Token.objects.filter(pk=self.token.pk).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        token_cache.invalidate()
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+
+    def test_logout_revokes_token(self):
+        other = Token.objects.create(member=self.member)
+        self.assertEqual(self.client.post('/api/auth/logout/').status_code, 204)
+        self.assertEqual(self.client.get('/api/auth/me/').status_code, 401)
+        self.assertTrue(Token.objects.filter(pk=other.pk).exists())
+
+    def test_logout_all_revokes_every_token(self):
+        Token.objects.create(member=self.member)
+        response = self.client.post('/api/auth/logout/', {'all': True}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Token.objects.filter(member=self.member).exists())
+
+    def test_purge_deletes_only_expired_tokens_in_batches(self):
+        expired_at = timezone.now() - timedelta(days=1)
+        for _ in range(5):
+            Token.objects.create(member=self.member, expires_at=expired_at)
+        out = StringIO()
+        call_command('purge_tokens', batch_size=2, pause=0, stdout=out)
+        self.assertEqual(list(Token.objects.all()), [self.token])
+        self.assertIn('before: rows=6', out.getvalue())
+        self.assertIn('deleted=5 batches=3', out.getvalue())
+
+    def test_purge_dry_run_deletes_nothing(self):
+        Token.objects.create(
+            member=self.member, expires_at=timezone.now() - timedelta(days=1)
+        )
+        call_command('purge_tokens', dry_run=True, stdout=StringIO())
+        self.assertEqual(Token.objects.count(), 2)
+
+
+class PasswordHashingTests(TestCase):
+
+    def test_pool_round_trip(self):
+        pool = PasswordHasherPool(workers=1, max_queue=0)
+        encoded = pool.make_password('secret')
+        self.assertTrue(pool.check_password('secret', encoded))
+        self.assertFalse(pool.check_password('wrong', encoded))
+
+    def test_rejects_when_saturated(self):
+        pool = PasswordHasherPool(workers=0, max_queue=0, retry_after=3)
+        pool._slots.acquire()
+        with self.assertRaises(HashingUnavailable):
+            pool.make_password('secret')
+        self.assertEqual(pool.rejected, 1)
+
+    def test_timed_out_hash_keeps_its_slot_until_done(self):
+        pool = PasswordHasherPool(workers=1, max_queue=0, timeout=0.05)
+        release = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        self.addCleanup(release.set)
+        with mock.patch.object(pool, '_get_executor', return_value=executor):
+            with self.assertRaises(HashingUnavailable):
+                pool._run(release.wait)
+            # Still hashing: no second hash is admitted next to it.
+            with self.assertRaises(HashingUnavailable):
+                pool._run(lambda: 'second')
+            self.assertEqual(pool.rejected, 1)
+            release.set()
+            executor.submit(lambda: None).result()
+            self.assertEqual(pool._run(lambda: 'third'), 'third')
+
+    def test_login_returns_503_with_retry_after_when_saturated(self):
+        Member.objects.create(username='bob', password='x')
+        with mock.patch.object(password_hasher, '_slots', threading.BoundedSemaphore(1)):
+            password_hasher._slots.acquire()
+            response = APIClient().post(
+                '/api/auth/login/', {'username': 'bob', 'password': 'x'}, format='json'
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(password_hasher.retry_after))
+        self.assertIn('detail', response.data)
+
+
+class ApiMiddlewareTests(ApiTestCase):
+
+    def test_api_skips_site_middleware(self):
+        response = self.client.get('/api/auth/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Frame-Options', response)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertFalse(hasattr(response.wsgi_request, 'session'))
+
+    def test_api_skips_site_middleware_under_asgi(self):
+        response = async_to_sync(AsyncClient().get)(
+            '/api/auth/me/', headers={'Authorization': f'Bearer {self.token.key}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Frame-Options', response)
+
+    def test_admin_keeps_site_middleware(self):
+        response = self.client.get('/admin/login/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Frame-Options'], 'SAMEORIGIN')
+        self.assertIn('csrftoken', response.cookies)
+
+    def test_admin_post_still_needs_csrf_token(self):
+        client = APIClient(enforce_csrf_checks=True)
+        response = client.post('/admin/login/', {'username': 'x', 'password': 'y'})
+        self.assertEqual(response.status_code, 403)
+
+
+class ReadCursorTests(ApiTestCase):
+
+    def read(self, message_id):
+        return self.client.post(
+            '/api/messages/read/', {'last_read_id': message_id}, format='json'
+        )
+
+    def test_unread_count_follows_the_cursor(self):
+        messages = self.create_messages(5)
+        self.assertEqual(self.client.get('/api/messages/unread/').json(), {
+            'last_read_id': 0, 'high_water_mark': messages[-1].id, 'unread': 5,
+        })
+
+        response = self.read(messages[2].id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['unread'], 2)
+        # Cursors never move back, nor past the newest message.
+        self.assertEqual(self.read(messages[0].id).json()['last_read_id'], messages[2].id)
+        self.assertEqual(self.read(messages[-1].id + 100).json(), {
+            'last_read_id': messages[-1].id, 'high_water_mark': messages[-1].id, 'unread': 0,
+        })
+        self.create_messages(2)
+        self.assertEqual(self.client.get('/api/messages/unread/').json()['unread'], 2)
+
+    def test_own_messages_are_not_unread(self):
+        bob = Member.objects.create(username='bob', password='x')
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION=f'Bearer {Token.objects.create(member=bob).key}')
+        for text in ('one', 'two'):
+            self.client.post('/api/messages/', {'text': text}, format='json')
+        self.client.post('/api/messages/batch/', {
+            'messages': [{'text': 'three'}, {'text': 'four'}]
+        }, format='json')
+        self.assertEqual(self.client.get('/api/messages/unread/').json()['unread'], 0)
+        self.assertEqual(other.get('/api/messages/unread/').json()['unread'], 4)
+
+        other.post('/api/messages/', {'text': 'reply'}, format='json')
+        self.assertEqual(self.client.get('/api/messages/unread/').json()['unread'], 1)
+        self.assertEqual(other.get('/api/messages/unread/').json()['unread'], 0)
+
+    def test_cursors_are_per_member(self):
+        messages = self.create_messages(3)
+        self.read(messages[1].id)
+        bob = Member.objects.create(username='bob', password='x')
+        self.assertEqual(ReadCursor.state(bob)['unread'], 3)
+        self.assertEqual(ReadCursor.state(self.member)['unread'], 1)
+
+    def test_unread_count_does_not_scan_messages(self):
+        self.create_messages(50)
+        self.client.get('/api/messages/unread/')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/messages/unread/').json()['unread'], 50)
+        self.assertEqual(len(queries), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {queries[0]["sql"]}')
+            plan = [str(row[-1]) for row in cursor.fetchall()]
+        self.assertNotIn('COUNT', queries[0]['sql'].upper())
+        self.assertFalse([step for step in plan if 'TEMP B-TREE' in step], plan)
+
+    def test_me_includes_read_state(self):
+        messages = self.create_messages(2)
+        self.read(messages[0].id)
+        self.assertEqual(self.client.get('/api/auth/me/').json()['read_cursor'], {
+            'last_read_id': messages[0].id, 'high_water_mark': messages[1].id, 'unread': 1,
+        })
+
+    def test_rejects_bad_input(self):
+        self.assertEqual(self.read(-1).status_code, 400)
+        self.assertEqual(self.read('abc').status_code, 400)
+        self.assertEqual(APIClient().get('/api/messages/unread/').status_code, 401)
+        self.assertEqual(APIClient().post('/api/messages/read/').status_code, 401)
+
+
+class CompressionTests(ApiTestCase):
+
+    def test_large_list_is_gzipped_for_clients_that_accept_it(self):
+        self.create_messages(50)
+        plain = self.client.get('/api/messages/?limit=50')
+        response = self.client.get(
+            '/api/messages/?limit=50', HTTP_ACCEPT_ENCODING='br, gzip;q=0.8'
+        )
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertLess(len(response.content), len(plain.content) / 3)
+
+        # The compressed body gets a weak ETag, which still revalidates.
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        response = self.client.get(
+            '/api/messages/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_small_responses_are_sent_as_is(self):
+        response = self.client.get('/api/auth/me/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response.json()['username'], 'alice')
+
+    def test_export_is_gzipped_as_it_streams(self):
+        self.create_messages(10)
+        plain = b''.join(self.client.get('/api/messages/export/').streaming_content)
+        response = self.client.get('/api/messages/export/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(gzip.decompress(b''.join(chunks)), plain)
+
+    async def test_async_export_is_gzipped(self):
+        await sync_to_async(self.create_messages)(10)
+        client = AsyncClient()
+        auth = {'Authorization': f'Bearer {self.token.key}'}
+        plain = await client.get('/api/messages/export/?output=ndjson', headers=auth)
+        response = await client.get(
+            '/api/messages/export/?output=ndjson', headers={**auth, 'Accept-Encoding': 'gzip'}
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        plain = b''.join([chunk async for chunk in plain.streaming_content])
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(gzip.decompress(body), plain)
+        self.assertEqual(len(plain.splitlines()), 10)
+
+    def test_accept_encoding_negotiation(self):
+        for header, accepted in [
+            ('gzip', True),
+            ('deflate, GZIP', True),
+            ('x-gzip', True),
+            ('*', True),
+            ('gzip;q=0', False),
+            ('gzip; q=0.0, *', False),
+            ('*;q=0', False),
+            ('br, zstd', False),
+            ('identity', False),
+            ('', False),
+        ]:
+            self.assertEqual(accepts_gzip(header), accepted, header)
+
+
+class RoomTests(ApiTestCase):
+    databases = {'default', 'rooms_test'}
+
+    def setUp(self):
+        super().setUp()
+        self.bob = Member.objects.create(username='bob', password='x')
+        self.bob_client = APIClient()
+        self.bob_client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {Token.objects.create(member=self.bob).key}'
+        )
+
+    def create_room(self, name='general', shard='default'):
+        response = self.client.post('/api/rooms/', {'name': name}, format='json')
+        self.assertEqual(response.status_code, 201)
+        room = Room.objects.get(id=response.json()['id'])
+        if shard != room.shard:
+            Room.objects.filter(id=room.id).update(shard=shard)
+            room.refresh_from_db()
+        return room
+
+    def post(self, room, text, client=None):
+        return (client or self.client).post(
+            f'/api/rooms/{room.id}/messages/', {'text': text}, format='json'
+        )
+
+    def test_create_join_and_leave(self):
+        room = self.create_room()
+        self.assertEqual(
+            [r['name'] for r in self.client.get('/api/rooms/').json()['results']], ['general']
+        )
+        response = self.client.post('/api/rooms/', {'name': 'general'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.bob_client.get('/api/rooms/').json()['results'], [])
+        self.assertEqual(self.post(room, 'hi', self.bob_client).status_code, 403)
+        membership = f'/api/rooms/{room.id}/membership/'
+        self.assertEqual(self.bob_client.post(membership).status_code, 201)
+        self.assertEqual(self.bob_client.post(membership).status_code, 200)
+        self.assertEqual(self.post(room, 'hi', self.bob_client).status_code, 201)
+        self.assertEqual(self.bob_client.delete(membership).status_code, 204)
+        self.assertEqual(
+            self.bob_client.get(f'/api/rooms/{room.id}/messages/').status_code, 403
+        )
+        self.assertEqual(self.client.get('/api/rooms/999/messages/').status_code, 404)
+        self.assertEqual(APIClient().get('/api/rooms/').status_code, 401)
+
+    def test_history_is_paginated_per_room(self):
+        room, other = self.create_room('a'), self.create_room('b')
+        RoomMembership.objects.create(room=room, member=self.bob)
+        for i in range(5):
+            self.post(room, f'a{i}', self.bob_client if i % 2 else None)
+            self.post(other, f'b{i}')
+
+        page = self.client.get(f'/api/rooms/{room.id}/messages/?limit=3').json()
+        self.assertEqual([m['text'] for m in page['results']], ['a2', 'a3', 'a4'])
+        self.assertEqual(
+            [m['username'] for m in page['results']], ['alice', 'bob', 'alice']
+        )
+        self.assertIsNone(page['next'])
+        older = self.client.get(
+            f'/api/rooms/{room.id}/messages/?limit=3&before={page["previous"]}'
+        ).json()
+        self.assertEqual([m['text'] for m in older['results']], ['a0', 'a1'])
+        self.assertIsNone(older['previous'])
+
+    def test_sharded_room_reads_and_writes_its_own_database(self):
+        room = self.create_room(shard='rooms_test')
+        response = self.post(room, 'sharded')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['username'], 'alice')
+
+        self.assertFalse(RoomMessage.objects.using('default').exists())
+        self.assertEqual(
+            list(RoomMessage.objects.using('rooms_test').values_list('text', flat=True)),
+            ['sharded'],
+        )
+        with CaptureQueriesContext(connections['rooms_test']) as queries:
+            page = self.client.get(f'/api/rooms/{room.id}/messages/').json()
+        self.assertEqual([m['text'] for m in page['results']], ['sharded'])
+        self.assertEqual(len(queries), 1)
+        with connections['rooms_test'].cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {queries[0]["sql"]}')
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('room_messages_room_idx', plan)
+
+    def test_shard_database_only_has_room_messages(self):
+        tables = connections['rooms_test'].introspection.table_names()
+        self.assertIn('room_messages', tables)
+        self.assertNotIn('messages', tables)
+        self.assertNotIn('rooms', tables)
+
+    def test_move_room_between_databases(self):
+        room, other = self.create_room('a'), self.create_room('b')
+        for i in range(3):
+            self.post(room, f'a{i}')
+        self.post(other, 'stays')
+        before = self.client.get(f'/api/rooms/{room.id}/messages/').json()['results']
+
+        out = StringIO()
+        call_command('move_room', 'a', 'rooms_test', stdout=out)
+        self.assertIn('3 messages', out.getvalue())
+        room.refresh_from_db()
+        self.assertEqual(room.shard, 'rooms_test')
+        self.assertEqual(RoomMessage.objects.using('rooms_test').count(), 3)
+        self.assertEqual(
+            list(RoomMessage.objects.using('default').values_list('text', flat=True)),
+            ['stays'],
+        )
+        after = self.client.get(f'/api/rooms/{room.id}/messages/').json()['results']
+        self.assertEqual(
+            [(m['text'], m['created_at']) for m in after],
+            [(m['text'], m['created_at']) for m in before],
+        )
+
+        call_command('move_room', 'a', 'default', stdout=StringIO())
+        self.assertEqual(RoomMessage.objects.using('default').count(), 4)
+        with self.assertRaises(CommandError):
+            call_command('move_room', 'a', 'nowhere', stdout=StringIO())
+
+
+class SqliteTuningTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'db.sqlite3')
+
+    def test_new_connections_get_pragmas(self):
+        default = connections['default']
+        wrapper = default.__class__(
+            {**default.settings_dict, 'NAME': self.path}, alias='tuning'
+        )
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            pragmas = {
+                name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size')
+            }
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal',
+            'synchronous': 1,  # NORMAL
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+        })
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+
+    def test_checkpoint_truncates_large_wal(self):
+        conn = sqlite3.connect(self.path)
+        self.addCleanup(conn.close)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA wal_autocheckpoint=0')
+        conn.execute('CREATE TABLE t (x TEXT)')
+        with conn:
+            conn.executemany('INSERT INTO t VALUES (?)', [('x' * 100,)] * 1000)
+        checkpointer = WalCheckpointer(self.path, truncate_bytes=1024 * 1024)
+
+        busy, wal_pages, checkpointed = checkpointer.checkpoint()
+        self.assertEqual(busy, 0)
+        self.assertEqual(checkpointed, wal_pages)
+        self.assertGreater(checkpointer.wal_size, 0)
+
+        checkpointer.truncate_bytes = 0
+        checkpointer.checkpoint()
+        self.assertEqual(checkpointer.wal_size, 0)
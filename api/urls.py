@@ -1,18 +1,54 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
+    AsyncMeView,
+    AsyncMessagesView,
     HelloView,
     RegisterView,
     LoginView,
+    LogoutView,
     MeView,
-    MessagesListView,
-    MessageCreateView
+    MetricsView,
+    MessagesView,
+    MessageBatchCreateView,
+    MessagesReadView,
+    MessagesUnreadView,
+    MessagesExportView,
+    MessageSearchView,
+    MessagesWaitView,
+    MessageStreamView,
+    RoomMembershipView,
+    RoomMessagesView,
+    RoomsView
 )
 
+# Under an ASGI worker the hot endpoints run as async views; under WSGI
+# each async view call would need its own event loop, so the sync ones stay.
+if settings.ASYNC_VIEWS:
+    me_view, messages_view = AsyncMeView.as_view(), AsyncMessagesView.as_view()
+else:
+    me_view, messages_view = MeView.as_view(), MessagesView.as_view()
+
 urlpatterns = [
     path("hello/", HelloView.as_view(), name="hello"),
     path("auth/register/", RegisterView.as_view(), name="register"),
     path("auth/login/", LoginView.as_view(), name="login"),
-    path("auth/me/", MeView.as_view(), name="me"),
-    path("messages/", MessagesListView.as_view(), name="messages-list"),
-    path("messages/", MessageCreateView.as_view(), name="message-create"),
+    path("auth/logout/", LogoutView.as_view(), name="logout"),
+    path("auth/me/", me_view, name="me"),
+    path("messages/", messages_view, name="messages"),
+    path("messages/batch/", MessageBatchCreateView.as_view(), name="messages-batch"),
+    path("messages/read/", MessagesReadView.as_view(), name="messages-read"),
+    path("messages/unread/", MessagesUnreadView.as_view(), name="messages-unread"),
+    path("messages/export/", MessagesExportView.as_view(), name="messages-export"),
+    path("messages/search/", MessageSearchView.as_view(), name="messages-search"),
+    path("messages/wait/", MessagesWaitView.as_view(), name="messages-wait"),
+    path("messages/stream/", MessageStreamView.as_view(), name="messages-stream"),
+    path("rooms/", RoomsView.as_view(), name="rooms"),
+    path(
+        "rooms/<int:room_id>/membership/",
+        RoomMembershipView.as_view(),
+        name="room-membership",
+    ),
+    path("rooms/<int:room_id>/messages/", RoomMessagesView.as_view(), name="room-messages"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
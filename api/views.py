@@ -1,17 +1,83 @@
+import itertools
+import json
+import math
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ParseError, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.permissions import AllowAny
+from django.db import connection, transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Exists, Max, OuterRef
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
-from drf_spectacular.utils import extend_schema
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from drf_spectacular.utils import OpenApiParameter, PolymorphicProxySerializer
+from drf_spectacular.types import OpenApiTypes
+from . import idempotency, streaming
+from .archive import message_archive
+from .authentication import aget_token, parse_token_key
+from .fastpath import (
+    aiter_chunks,
+    message_rows,
+    room_message_rows,
+    serialize_message_rows,
+    serialize_room_message_rows,
+    stream_message_rows,
+)
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, is_scraper, metrics
+from .notify import notifier
+from .pagination import MessageCursorPagination, MessageDeltaPagination, RoomMessagePagination
+from .profiling import phase
+from .routers import replica_reads
+from .schema import extend_schema
+from .search import MessageSearch
 from .serializers import (
     MessageSerializer,
     MemberSerializer,
     RegisterSerializer,
     LoginSerializer,
+    LogoutSerializer,
     ChatMessageSerializer,
-    CreateMessageSerializer
+    MessagePageSerializer,
+    MessageDeltaSerializer,
+    CreateMessageSerializer,
+    CreateMessageBatchSerializer,
+    MessageBatchSerializer,
+    MessageSearchPageSerializer,
+    RoomSerializer,
+    RoomListSerializer,
+    MeSerializer,
+    MarkReadSerializer,
+    ReadStateSerializer
+)
+from .models import Member, Token, Message, MessageStats, ReadCursor, Room, RoomMembership
+from .writer import message_writer
+
+
+INVALID_IDEMPOTENCY_KEY = (
+    "Idempotency-Key must be 1 to 64 printable ASCII characters without spaces"
 )
-from .models import Member, Token, Message
+IDEMPOTENCY_KEY_REUSED = "Idempotency-Key was already used for a different message"
+
+
+def first_error(errors):
+    """
+    First message found in (possibly nested) serializer errors.
+    """
+    if isinstance(errors, dict):
+        errors = list(errors.values())
+    if not isinstance(errors, list):
+        return str(errors)
+    for error in errors:
+        if error:
+            return first_error(error)
+    return "Validation error"
 
 
 class HelloView(APIView):
@@ -28,29 +94,13 @@ class HelloView(APIView):
         return Response(serializer.data)
 
 
-class TokenAuthentication:
-    """
-    Custom token authentication helper.
-    """
-    @staticmethod
-    def authenticate(request):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header:
-            return None
-
-        try:
-            token_key = auth_header.split(' ')[1] if ' ' in auth_header else auth_header
-            token = Token.objects.select_related('member').get(key=token_key)
-            return token.member
-        except (Token.DoesNotExist, IndexError):
-            return None
-
-
 class RegisterView(APIView):
     """
     API endpoint for user registration.
     POST /api/auth/register/
     """
+    authentication_classes = []
+    permission_classes = [AllowAny]
 
     @extend_schema(
         request=RegisterSerializer,
@@ -68,7 +118,8 @@ class RegisterView(APIView):
                     }
                 }
             },
-            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            429: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
         },
         description="Register a new user with username and password"
     )
@@ -82,7 +133,7 @@ class RegisterView(APIView):
             )
 
         member = serializer.save()
-        token = Token.objects.create(member=member)
+        token = Token.issue(member)
         
         return Response(
             {
@@ -98,6 +149,8 @@ class LoginView(APIView):
     API endpoint for user login.
     POST /api/auth/login/
     """
+    authentication_classes = []
+    permission_classes = [AllowAny]
 
     @extend_schema(
         request=LoginSerializer,
@@ -115,7 +168,8 @@ class LoginView(APIView):
                     }
                 }
             },
-            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            429: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
         },
         description="Authenticate user with username and password"
     )
@@ -129,7 +183,7 @@ class LoginView(APIView):
             )
 
         member = serializer.validated_data['member']
-        token = Token.objects.create(member=member)
+        token = Token.issue(member)
         
         return Response(
             {
@@ -140,6 +194,44 @@ class LoginView(APIView):
         )
 
 
+class LogoutView(APIView):
+    """
+    API endpoint to revoke the current token (or all of the member's tokens).
+    POST /api/auth/logout/
+    """
+
+    @extend_schema(
+        request=LogoutSerializer,
+        responses={
+            204: None,
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Revoke the token used for this request. Pass all=true to "
+                    "revoke every token of the current user"
+    )
+    def post(self, request):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        serializer = LogoutSerializer(data=request.data)
+        if not serializer.is_valid():
+            error_message = next(iter(serializer.errors.values()))[0] if serializer.errors else "Validation error"
+            return Response(
+                {"detail": str(error_message)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if serializer.validated_data.get('all'):
+            Token.objects.filter(member=request.user).delete()
+        else:
+            request.auth.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class MeView(APIView):
     """
     API endpoint to get current authenticated user.
@@ -148,49 +240,121 @@ class MeView(APIView):
 
     @extend_schema(
         responses={
-            200: MemberSerializer,
+            200: MeSerializer,
             401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
         },
-        description="Get information about the currently authenticated user"
+        description="Get information about the currently authenticated user, "
+                    "including how far they have read the messages"
     )
+    @replica_reads
     def get(self, request):
-        member = TokenAuthentication.authenticate(request)
-        if not member:
+        if not request.user.is_authenticated:
             return Response(
                 {"detail": "Unauthorized - invalid or missing token"},
                 status=status.HTTP_401_UNAUTHORIZED
             )
+        member = request.user
         
         return Response(
-            MemberSerializer(member).data,
+            {**MemberSerializer(member).data, 'read_cursor': ReadCursor.state(member)},
             status=status.HTTP_200_OK
         )
 
 
 class MessagesListView(APIView):
     """
-    API endpoint to get all chat messages.
+    API endpoint to get chat messages, one keyset-paginated page at a time,
+    or only the messages newer than a known id (delta sync).
     GET /api/messages/
     """
+    pagination_class = MessageCursorPagination
+    delta_pagination_class = MessageDeltaPagination
 
     @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='limit',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Number of messages per page (default 50, max 200)',
+                required=False
+            ),
+            OpenApiParameter(
+                name='before',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='Cursor from "previous": return older messages',
+                required=False
+            ),
+            OpenApiParameter(
+                name='after',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='Cursor from "next": return newer messages',
+                required=False
+            ),
+            OpenApiParameter(
+                name='since_id',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Delta sync: return only messages with a greater id, '
+                            'oldest first, plus the new high-water mark',
+                required=False
+            ),
+            OpenApiParameter(
+                name='If-None-Match',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.HEADER,
+                description='ETag of a previous response; 304 if the list is unchanged',
+                required=False
+            ),
+        ],
         responses={
-            200: ChatMessageSerializer(many=True),
+            200: PolymorphicProxySerializer(
+                component_name='MessagesResponse',
+                serializers=[MessagePageSerializer, MessageDeltaSerializer],
+                resource_type_field_name=None
+            ),
+            304: None,
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
             401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
         },
-        description="Retrieve all chat messages with user information"
+        description="Retrieve a page of chat messages with user information. "
+                    "Without a cursor the newest page is returned. Send the "
+                    "ETag back in If-None-Match to get 304 when nothing changed."
     )
+    @replica_reads
     def get(self, request):
-        member = TokenAuthentication.authenticate(request)
-        if not member:
+        if not request.user.is_authenticated:
             return Response(
                 {"detail": "Unauthorized - invalid or missing token"},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        
-        messages = Message.objects.select_related('member').order_by('created_at')
-        serializer = ChatMessageSerializer(messages, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+        # Answer unchanged polls before any message row is read.
+        etag = self.get_etag()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            if 'since_id' in request.query_params:
+                paginator = self.delta_pagination_class()
+            else:
+                paginator = self.pagination_class()
+            messages = message_rows(Message.objects.all())
+            page = paginator.paginate_queryset(messages, request, view=self)
+            response = paginator.get_paginated_response(serialize_message_rows(page))
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_etag(self):
+        """
+        Validator for every view of the message list: changes whenever a
+        message is added (max id) or removed (deletion counter). Both are
+        index lookups; a COUNT(*) would scan the whole table.
+        """
+        last_id = Message.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        deleted = MessageStats.objects.filter(pk=1).values_list('deleted', flat=True)
+        return quote_etag(f"{last_id}-{deleted.first() or 0}")
 
 
 class MessageCreateView(APIView):
@@ -204,19 +368,27 @@ class MessageCreateView(APIView):
         responses={
             201: ChatMessageSerializer,
             400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
-            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            422: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            429: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
         },
+        parameters=[
+            OpenApiParameter(
+                idempotency.HEADER, str, OpenApiParameter.HEADER,
+                description="Client-generated key, e.g. a UUID, sent unchanged with "
+                            "every retry of the same message. A retry returns the "
+                            "message posted first instead of a duplicate."
+            ),
+        ],
         description="Create and send a new chat message"
     )
     def post(self, request):
-        member = TokenAuthentication.authenticate(request)
-        if not member:
+        if not request.user.is_authenticated:
             return Response(
                 {"detail": "Unauthorized - invalid or missing token"},
                 status=status.HTTP_401_UNAUTHORIZED
             )
-        
-        request.user = member
+
         serializer = CreateMessageSerializer(data=request.data, context={'request': request})
         
         if not serializer.is_valid():
@@ -226,6 +398,741 @@ class MessageCreateView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        message = serializer.save()
-        response_serializer = ChatMessageSerializer(message)
-        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+        key = request.headers.get(idempotency.HEADER)
+        if key is not None and not idempotency.is_valid_key(key):
+            return Response(
+                {"detail": INVALID_IDEMPOTENCY_KEY},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        text = serializer.validated_data['text']
+        payload, replayed = idempotency.create_message(request.user, text, key)
+        if replayed and payload['text'] != text:
+            return Response(
+                {"detail": IDEMPOTENCY_KEY_REUSED},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        response = Response(payload, status=status.HTTP_201_CREATED)
+        if replayed:
+            response[idempotency.REPLAYED_HEADER] = 'true'
+        return response
+
+
+class MessagesReadView(APIView):
+    """
+    API endpoint to mark the messages up to and including an id as read.
+    POST /api/messages/read/
+    """
+
+    @extend_schema(
+        request=MarkReadSerializer,
+        responses={
+            200: ReadStateSerializer,
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Mark messages as read up to last_read_id. The read "
+                    "cursor only moves forward, and not past the newest "
+                    "message; returns the new read state."
+    )
+    def post(self, request):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        serializer = MarkReadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"detail": first_error(serializer.errors)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        newest = Message.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        ReadCursor.mark_read(
+            request.user, min(serializer.validated_data['last_read_id'], newest)
+        )
+        return Response(ReadCursor.state(request.user))
+
+
+class MessagesUnreadView(APIView):
+    """
+    API endpoint to get the number of unread messages.
+    GET /api/messages/unread/
+    """
+
+    @extend_schema(
+        responses={
+            200: ReadStateSerializer,
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Get the read cursor and the number of messages after it. "
+                    "Costs the same whatever the size of the history: the "
+                    "count is the difference between the newest message id "
+                    "and the cursor, so ids missing from the sequence (deleted "
+                    "messages, and on PostgreSQL ids of rolled-back inserts) "
+                    "still count until the cursor passes them. The member's "
+                    "own messages move their cursor and never count."
+    )
+    @replica_reads
+    def get(self, request):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        return Response(ReadCursor.state(request.user))
+
+
+class MessageBatchCreateView(APIView):
+    """
+    API endpoint to create several messages in one request and transaction.
+    POST /api/messages/batch/
+    """
+
+    @extend_schema(
+        request=CreateMessageBatchSerializer,
+        responses={
+            201: MessageBatchSerializer,
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            429: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Create up to 100 chat messages at once. They are stored in "
+                    "one transaction and returned in the order given."
+    )
+    def post(self, request):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        serializer = CreateMessageBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"detail": first_error(serializer.errors)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        messages = message_writer.create_many([
+            Message(member=request.user, text=item['text'])
+            for item in serializer.validated_data['messages']
+        ])
+        return Response(
+            {"results": ChatMessageSerializer(messages, many=True).data},
+            status=status.HTTP_201_CREATED
+        )
+
+
+class MessagesExportView(APIView):
+    """
+    Streams the whole chat history (or everything after since_id) as one
+    JSON array or as NDJSON, oldest first.
+    GET /api/messages/export/
+
+    Archived messages come first, one segment at a time; then the table's
+    rows are read with a server-side iterator. Both are encoded chunk by
+    chunk, so worker memory stays flat whatever the size of the history.
+    """
+    chunk_size = 2000
+    outputs = {
+        'json': 'application/json',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='output',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                enum=['json', 'ndjson'],
+                description='"json" (default): one array; "ndjson": one message per line',
+                required=False
+            ),
+            OpenApiParameter(
+                name='since_id',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Only export messages with a greater id',
+                required=False
+            ),
+        ],
+        responses={
+            200: ChatMessageSerializer(many=True),
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Export the full chat history as a streamed JSON array or NDJSON"
+    )
+    def get(self, request):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        output = request.query_params.get('output', 'json')
+        if output not in self.outputs:
+            return Response(
+                {"detail": "'output' must be 'json' or 'ndjson'."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            since_id = int(request.query_params.get('since_id', 0))
+        except ValueError:
+            return Response(
+                {"detail": "'since_id' must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rows = message_rows(Message.objects.filter(id__gt=since_id).order_by('id'))
+        rows = itertools.chain(
+            message_archive.iter_rows(since_id),
+            rows.iterator(chunk_size=self.chunk_size),
+        )
+        chunks = stream_message_rows(
+            rows, ndjson=output == 'ndjson', chunk_size=self.chunk_size
+        )
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiter_chunks(chunks)
+        return StreamingHttpResponse(chunks, content_type=self.outputs[output])
+
+
+class MessageSearchView(APIView):
+    """
+    API endpoint for full-text search over chat messages.
+    GET /api/messages/search/
+    """
+    search_class = MessageSearch
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='q',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='Words to search for; messages must contain all of them',
+                required=True
+            ),
+            OpenApiParameter(
+                name='limit',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Number of results per page (default 20, max 100)',
+                required=False
+            ),
+            OpenApiParameter(
+                name='after',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='Cursor from "next": return the following results',
+                required=False
+            ),
+        ],
+        responses={
+            200: MessageSearchPageSerializer,
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Search chat messages. Results are ordered by relevance and "
+                    "carry an HTML-escaped snippet with matches wrapped in <mark>."
+    )
+    def get(self, request):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        return Response(self.search_class().search(request), status=status.HTTP_200_OK)
+
+
+class MessagesWaitView(APIView):
+    """
+    Long-poll endpoint: waits until messages newer than since_id exist.
+    GET /api/messages/wait/
+
+    Returns a MessageDeltaPagination page, so it can miss messages on
+    PostgreSQL, where ids do not commit in order.
+    """
+    pagination_class = MessageDeltaPagination
+    default_timeout = 25
+    max_timeout = 60
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='since_id',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Id of the newest message the client already has',
+                required=True
+            ),
+            OpenApiParameter(
+                name='timeout',
+                type=OpenApiTypes.FLOAT,
+                location=OpenApiParameter.QUERY,
+                description='Seconds to wait for new messages (default 25, max 60)',
+                required=False
+            ),
+            OpenApiParameter(
+                name='limit',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Maximum number of messages to return (default 50, max 200)',
+                required=False
+            ),
+        ],
+        responses={
+            200: MessageDeltaSerializer,
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Wait until messages newer than since_id are posted and return "
+                    "them. Returns an empty result when the timeout passes first."
+    )
+    def get(self, request):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        paginator = self.pagination_class()
+        messages = message_rows(Message.objects.all())
+        page = paginator.paginate_queryset(messages, request, view=self)
+        if not page:
+            # Release the database connection while the request is parked.
+            if not connection.in_atomic_block:
+                connection.close()
+            timeout = self.get_timeout(request)
+            if notifier.wait_for(paginator.since_id, timeout) > paginator.since_id:
+                page = paginator.paginate_queryset(messages, request, view=self)
+
+        return paginator.get_paginated_response(serialize_message_rows(page))
+
+    def get_timeout(self, request):
+        try:
+            timeout = float(request.query_params['timeout'])
+        except (KeyError, ValueError):
+            return self.default_timeout
+        if not math.isfinite(timeout):
+            return self.default_timeout
+        return min(max(timeout, 0), self.max_timeout)
+
+
+class MessageStreamView(View):
+    """
+    Server-Sent Events stream of newly created chat messages.
+    GET /api/messages/stream/
+
+    EventSource cannot set headers, so the token may also be passed as the
+    ``token`` query parameter. Missed messages are replayed from the
+    database after ``Last-Event-ID`` (or ``since_id``) before live events.
+    Under config.asgi this path is served by api.streaming.stream_application
+    instead. Under WSGI the stream holds a worker thread, so it ends after
+    streaming.WSGI_STREAM_SECONDS and the client reconnects.
+    """
+
+    def get(self, request):
+        member = streaming.authenticate_sync(
+            request.headers.get('Authorization'), request.GET.get('token')
+        )
+        if not member:
+            return JsonResponse(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        try:
+            since_id = streaming.parse_since_id(
+                request.headers.get('Last-Event-ID') or request.GET.get('since_id')
+            )
+        except ValueError:
+            return JsonResponse(
+                {"detail": "'since_id' must be an integer."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Django buffers an async iterator completely under WSGI, which an
+        # endless stream never finishes.
+        if isinstance(request, ASGIRequest):
+            events = streaming.event_stream(since_id, release_connection=True)
+        else:
+            events = streaming.event_stream_sync(since_id, release_connection=True)
+        response = StreamingHttpResponse(events, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class MessagesView(MessagesListView, MessageCreateView):
+    """
+    Routes GET and POST on /api/messages/ to the list and create endpoints.
+    """
+
+
+class AsyncAPIView(View):
+    """
+    Base for the async variants of the hot endpoints, served when the app
+    runs under an ASGI worker (settings.ASYNC_VIEWS, see
+    gunicorn.asgi.conf.py). DRF's APIView only runs synchronous handlers,
+    so these are plain Django views: a request waiting on the database or a
+    slow client costs a coroutine instead of a worker thread.
+
+    They accept the same tokens and return the same JSON bytes as their
+    APIView counterparts; DRF exceptions raised by the shared paginators
+    become the usual {"detail": ...} responses.
+    """
+    renderer = JSONRenderer()
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token-authenticated like APIView, so no CSRF check.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        key = parse_token_key(request.headers.get('Authorization'))
+        with phase('auth'):
+            token = await aget_token(key) if key else None
+        if token is None:
+            return self.render(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        request.member = token.member
+        # The paginators read DRF's name for the query string.
+        request.query_params = request.GET
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            return self.render({"detail": exc.detail}, status=exc.status_code)
+
+    def render(self, data, status=status.HTTP_200_OK):
+        with phase('render'):
+            content = self.renderer.render(data)
+        return HttpResponse(content, status=status, content_type='application/json')
+
+    @staticmethod
+    def parse_body(request):
+        if request.content_type != 'application/json':
+            return request.POST
+        try:
+            return json.loads(request.body)
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+
+class AsyncMeView(AsyncAPIView):
+    """
+    Async variant of MeView.
+    GET /api/auth/me/
+    """
+
+    @replica_reads
+    async def get(self, request):
+        return self.render({
+            **MemberSerializer(request.member).data,
+            'read_cursor': await ReadCursor.astate(request.member),
+        })
+
+
+class AsyncMessagesListView(AsyncAPIView):
+    """
+    Async variant of MessagesListView.
+    GET /api/messages/
+    """
+    pagination_class = MessageCursorPagination
+    delta_pagination_class = MessageDeltaPagination
+
+    @replica_reads
+    async def get(self, request):
+        etag = await self.aget_etag()
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            if 'since_id' in request.query_params:
+                paginator = self.delta_pagination_class()
+            else:
+                paginator = self.pagination_class()
+            messages = message_rows(Message.objects.all())
+            page = await paginator.apaginate_queryset(messages, request, view=self)
+            response = self.render(
+                paginator.get_paginated_data(serialize_message_rows(page))
+            )
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    async def aget_etag(self):
+        """
+        MessagesListView.get_etag() through the async ORM.
+        """
+        last_id = (await Message.objects.aaggregate(last_id=Max('id')))['last_id'] or 0
+        deleted = MessageStats.objects.filter(pk=1).values_list('deleted', flat=True)
+        return quote_etag(f"{last_id}-{await deleted.afirst() or 0}")
+
+
+class AsyncMessageCreateView(AsyncAPIView):
+    """
+    Async variant of MessageCreateView.
+    POST /api/messages/
+    """
+
+    async def post(self, request):
+        serializer = CreateMessageSerializer(data=self.parse_body(request))
+        if not serializer.is_valid():
+            return self.render(
+                {"detail": first_error(serializer.errors)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        key = request.headers.get(idempotency.HEADER)
+        if key is not None and not idempotency.is_valid_key(key):
+            return self.render(
+                {"detail": INVALID_IDEMPOTENCY_KEY},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        text = serializer.validated_data['text']
+        payload, replayed = await idempotency.acreate_message(request.member, text, key)
+        if replayed and payload['text'] != text:
+            return self.render(
+                {"detail": IDEMPOTENCY_KEY_REUSED},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        response = self.render(payload, status=status.HTTP_201_CREATED)
+        if replayed:
+            response[idempotency.REPLAYED_HEADER] = 'true'
+        return response
+
+
+class AsyncMessagesView(AsyncMessagesListView, AsyncMessageCreateView):
+    """
+    Async variant of MessagesView.
+    """
+
+
+class MetricsView(View):
+    """
+    Request and token-cache metrics of all workers, in the Prometheus text
+    format (see api.metrics).
+    GET /api/metrics/
+
+    Not part of the API schema. Only the scraper, authenticated by
+    settings.METRICS_TOKEN as a bearer token, gets an answer; anyone else
+    gets 404. nginx also limits it to private networks, which is no guard on
+    its own: behind the platform proxy every client comes from one.
+    """
+
+    def get(self, request):
+        if not is_scraper(request):
+            raise Http404
+        return HttpResponse(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+def get_room(request, room_id):
+    """
+    The room ``room_id``, for a member of it; 404 or 403 otherwise.
+    """
+    room = Room.objects.filter(id=room_id).annotate(
+        is_member=Exists(
+            RoomMembership.objects.filter(room=OuterRef('pk'), member=request.user)
+        )
+    ).first()
+    if room is None:
+        raise NotFound("Room not found.")
+    if not room.is_member:
+        raise PermissionDenied("Join the room first.")
+    return room
+
+
+class RoomsView(APIView):
+    """
+    API endpoint to list the current member's rooms and to create rooms.
+    GET, POST /api/rooms/
+    """
+
+    @extend_schema(
+        responses={
+            200: RoomListSerializer,
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="List the rooms the current user belongs to"
+    )
+    def get(self, request):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        rooms = request.user.rooms.all()
+        return Response({"results": RoomSerializer(rooms, many=True).data})
+
+    @extend_schema(
+        request=RoomSerializer,
+        responses={
+            201: RoomSerializer,
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Create a room; its creator joins it"
+    )
+    def post(self, request):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        serializer = RoomSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"detail": first_error(serializer.errors)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        with transaction.atomic():
+            room = serializer.save()
+            RoomMembership.objects.create(room=room, member=request.user)
+        return Response(RoomSerializer(room).data, status=status.HTTP_201_CREATED)
+
+
+class RoomMembershipView(APIView):
+    """
+    API endpoint to join or leave a room.
+    POST, DELETE /api/rooms/{room_id}/membership/
+    """
+
+    @extend_schema(
+        request=None,
+        responses={
+            200: RoomSerializer,
+            201: RoomSerializer,
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            404: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Join a room (201; 200 if already a member)"
+    )
+    def post(self, request, room_id):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        room = Room.objects.filter(id=room_id).first()
+        if room is None:
+            raise NotFound("Room not found.")
+        _, created = RoomMembership.objects.get_or_create(room=room, member=request.user)
+        return Response(
+            RoomSerializer(room).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+    @extend_schema(
+        request=None,
+        responses={
+            204: None,
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Leave a room"
+    )
+    def delete(self, request, room_id):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        RoomMembership.objects.filter(room_id=room_id, member=request.user).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class RoomMessagesView(APIView):
+    """
+    API endpoint to read a room's history, one keyset-paginated page at a
+    time, and to post to the room. Members only.
+    GET, POST /api/rooms/{room_id}/messages/
+
+    Both run against the room's shard database (api.routers.RoomShardRouter)
+    on the (room, created_at, id) index.
+    """
+    pagination_class = RoomMessagePagination
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='limit',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Number of messages per page (default 50, max 200)',
+                required=False
+            ),
+            OpenApiParameter(
+                name='before',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='Cursor from "previous": return older messages',
+                required=False
+            ),
+            OpenApiParameter(
+                name='after',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='Cursor from "next": return newer messages',
+                required=False
+            ),
+        ],
+        responses={
+            200: MessagePageSerializer,
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            403: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            404: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Retrieve a page of a room's messages. Without a cursor "
+                    "the newest page is returned."
+    )
+    def get(self, request, room_id):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        room = get_room(request, room_id)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(
+            room_message_rows(room.messages.all()), request, view=self
+        )
+        return paginator.get_paginated_response(serialize_room_message_rows(page))
+
+    @extend_schema(
+        request=CreateMessageSerializer,
+        responses={
+            201: ChatMessageSerializer,
+            400: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            401: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            403: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            404: {'type': 'object', 'properties': {'detail': {'type': 'string'}}},
+            429: {'type': 'object', 'properties': {'detail': {'type': 'string'}}}
+        },
+        description="Post a message to a room"
+    )
+    def post(self, request, room_id):
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Unauthorized - invalid or missing token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        room = get_room(request, room_id)
+        serializer = CreateMessageSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"detail": first_error(serializer.errors)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        message = room.messages.create(
+            member=request.user, text=serializer.validated_data['text']
+        )
+        return Response(ChatMessageSerializer(message).data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,149 @@
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+
+from .models import Message, ReadCursor
+from .signals import publish_messages
+
+
+class _Pending:
+    __slots__ = ('message', 'done', 'error')
+
+    def __init__(self, message):
+        self.message = message
+        self.done = threading.Event()
+        self.error = None
+
+
+class MessageWriter:
+    """
+    Inserts chat messages, optionally committing concurrent posts together.
+
+    With ``batching`` on, the first request thread to arrive becomes the
+    leader: it waits up to ``max_wait`` seconds (or until ``max_batch``
+    messages are queued) for other threads of the worker to add theirs, then
+    inserts the whole group with one bulk_create in one transaction, i.e.
+    one WAL commit instead of one per message. Every caller gets back its
+    own saved Message with the real id and created_at, or the error the
+    group hit. A group that fails on a duplicate client_id is retried one
+    message at a time, so only the duplicate's caller gets the
+    IntegrityError. Calls made inside an atomic block are never grouped,
+    since the other messages would join that caller's transaction.
+
+    A member's own messages never count as unread for them: each insert
+    moves the poster's read cursor up to their newest message, in the same
+    transaction.
+    """
+
+    def __init__(self, batching=False, max_wait=0.002, max_batch=100):
+        self.batching = batching
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._queue = []
+        self._leading = False
+
+    def create(self, member, text, client_id=None):
+        message = Message(member=member, text=text, client_id=client_id)
+        if not self.batching or connection.in_atomic_block:
+            # In a savepoint, so that a duplicate client_id leaves an
+            # enclosing transaction usable.
+            with transaction.atomic():
+                message.save(force_insert=True)
+                ReadCursor.mark_read(member, message.pk)
+            return message
+        return self._create_grouped(message)
+
+    async def acreate(self, member, text, client_id=None):
+        if not self.batching:
+            return await sync_to_async(self.create)(member, text, client_id)
+        # A grouped caller parks its thread until the leader has written the
+        # group, so it cannot share the single thread-sensitive executor.
+        return await sync_to_async(self._create_in_executor, thread_sensitive=False)(
+            member, text, client_id
+        )
+
+    def _create_in_executor(self, member, text, client_id):
+        # Default-executor threads never see request_started/finished, so
+        # expire their connections the way those signals would.
+        close_old_connections()
+        try:
+            return self.create(member, text, client_id)
+        finally:
+            close_old_connections()
+
+    def create_many(self, messages):
+        """
+        Insert messages in one transaction and publish them once committed.
+        bulk_create() sends no post_save signals, so publish explicitly.
+        """
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=self.max_batch)
+            newest = {}
+            for message in messages:
+                newest[message.member_id] = message
+            for message in newest.values():
+                ReadCursor.mark_read(message.member, message.pk)
+            transaction.on_commit(lambda: publish_messages(messages))
+        return messages
+
+    def _create_grouped(self, message):
+        pending = _Pending(message)
+        with self._cond:
+            self._queue.append(pending)
+            leader = not self._leading
+            if leader:
+                self._leading = True
+            elif len(self._queue) >= self.max_batch:
+                self._cond.notify_all()
+
+        if not leader:
+            pending.done.wait()
+        else:
+            self._lead()
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.message
+
+    def _lead(self):
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._queue = self._queue, []
+            # Whoever arrives next starts collecting the next group while
+            # this one is being written.
+            self._leading = False
+
+        try:
+            try:
+                self.create_many([pending.message for pending in batch])
+            except IntegrityError:
+                if len(batch) == 1:
+                    raise
+                self._create_each(batch)
+        except Exception as exc:
+            for pending in batch:
+                pending.error = exc
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+    def _create_each(self, batch):
+        for pending in batch:
+            try:
+                self.create_many([pending.message])
+            except Exception as exc:
+                pending.error = exc
+
+
+message_writer = MessageWriter(**{
+    key.lower(): value for key, value in getattr(settings, 'MESSAGE_WRITER', {}).items()
+})
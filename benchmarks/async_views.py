@@ -0,0 +1,165 @@
+"""
+Sync vs async deployment: throughput and latency of the hot endpoints.
+
+Runs the app under gunicorn.conf.py (gthread workers, WSGI, sync views,
+"sync") and under gunicorn.asgi.conf.py (uvicorn workers, ASGI, async
+views, "async"). For every concurrency level, that many clients loop over
+a request mix (80% GET /api/messages/, 10% GET /api/auth/me/, 10% POST
+/api/messages/) on keep-alive connections. --slow-clients connections
+meanwhile trickle a request body one byte at a time, as clients on poor
+networks do.
+
+    python -m benchmarks.async_views --duration 10 --concurrency 16 64 256
+
+The async deployment needs uvicorn, which is not in requirements.txt; it is
+skipped when uvicorn is not installed.
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import random
+import socket
+import threading
+import time
+
+from benchmarks import server
+
+DEPLOYMENTS = {
+    "sync": {"config": "gunicorn.conf.py", "app": "config.wsgi:application"},
+    "async": {"config": "gunicorn.asgi.conf.py", "app": "config.asgi:application"},
+}
+
+
+def seed(messages):
+    from api.models import Member, Message, Token
+
+    member = Member.objects.create(username="bench", password="x")
+    Message.objects.bulk_create(
+        [Message(member=member, text=f"message {i}") for i in range(messages)],
+        batch_size=1000,
+    )
+    return Token.objects.create(member=member).key
+
+
+def client_loop(host, port, token, stop, results, seed):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    while not stop.is_set():
+        pick = rng.random()
+        if pick < 0.8:
+            request = ("GET", "/api/messages/?limit=50", None, 200)
+        elif pick < 0.9:
+            request = ("GET", "/api/auth/me/", None, 200)
+        else:
+            request = ("POST", "/api/messages/", json.dumps({"text": "hello"}), 201)
+        method, path, body, expected = request
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == expected
+        except OSError:
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+            ok = False
+        results.append((ok, time.perf_counter() - started))
+
+
+def slow_clients(host, port, token, count, stop):
+    """
+    Hold ``count`` connections that each send a POST one body byte per
+    second, reconnecting when the server gives up on them.
+    """
+    body = json.dumps({"text": "x" * 200}).encode()
+    head = (
+        f"POST /api/messages/ HTTP/1.1\r\nHost: {host}\r\n"
+        f"Authorization: Bearer {token}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n"
+    ).encode()
+
+    def connect():
+        sock = socket.create_connection((host, port))
+        sock.sendall(head)
+        return [sock, 0]
+
+    clients = [connect() for _ in range(count)]
+    while not stop.wait(1):
+        for client in clients:
+            sock, sent = client
+            try:
+                sock.sendall(body[sent:sent + 1])
+                client[1] = (sent + 1) % len(body)
+            except OSError:
+                sock.close()
+                client[:] = connect()
+    for sock, _ in clients:
+        sock.close()
+
+
+def run(db_path, token, deployment, concurrency, duration, slow):
+    results = []
+    stop = threading.Event()
+    with server.gunicorn(db_path, **DEPLOYMENTS[deployment]) as (host, port):
+        slow_thread = threading.Thread(
+            target=slow_clients, args=(host, port, token, slow, stop)
+        )
+        slow_thread.start()
+        time.sleep(1 if slow else 0)
+        threads = [
+            threading.Thread(
+                target=client_loop, args=(host, port, token, stop, results, i)
+            )
+            for i in range(concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        slow_thread.join()
+
+    ok = [latency for succeeded, latency in results if succeeded]
+    return {
+        "deployment": deployment,
+        "concurrency": concurrency,
+        "slow_clients": slow,
+        "requests_per_second": round(len(ok) / elapsed, 2),
+        "failed_requests": len(results) - len(ok),
+        "latency": server.summarize(ok),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--slow-clients", type=int, default=0)
+    parser.add_argument("--deployments", nargs="+", default=list(DEPLOYMENTS))
+    args = parser.parse_args()
+
+    deployments = args.deployments
+    if "async" in deployments and importlib.util.find_spec("uvicorn") is None:
+        print("uvicorn is not installed; skipping the async deployment")
+        deployments = [name for name in deployments if name != "async"]
+
+    with server.temp_database() as db_path:
+        server.setup_django(db_path)
+        token = seed(args.messages)
+        results = [
+            run(db_path, token, deployment, concurrency, args.duration, args.slow_clients)
+            for concurrency in args.concurrency
+            for deployment in deployments
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
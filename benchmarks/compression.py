@@ -0,0 +1,110 @@
+"""
+Micro-benchmark: bandwidth saved vs CPU spent by response compression.
+
+Seeds a throwaway database with messages of varied text and compresses
+the bodies the API sends at each gzip level with api.compression: message
+pages of the given sizes, and the NDJSON export streamed chunk by chunk.
+For context, render_ms is the time to encode the same body to JSON.
+
+    python -m benchmarks.compression --pages 50 200 --levels 1 3 6 9
+"""
+
+import argparse
+import json
+import random
+
+from benchmarks import server
+from benchmarks.serialization import best_of
+
+WORDS = (
+    "the a to and of is in it you that for on was with this are be at have not "
+    "ok yes no lol thanks sure meeting today tomorrow lunch code review deploy "
+    "build test broken fixed merge branch release coffee later morning tonight "
+    "weekend idea question answer problem server client database message chat"
+).split()
+
+
+def seed(count):
+    from api.models import Member, Message
+
+    rng = random.Random(0)
+    members = [
+        Member.objects.create(username=f"member{i}", password="x") for i in range(50)
+    ]
+    Message.objects.bulk_create(
+        (
+            Message(
+                member=rng.choice(members),
+                text=" ".join(rng.choices(WORDS, k=rng.randint(2, 25))),
+            )
+            for _ in range(count)
+        ),
+        batch_size=5000,
+    )
+
+
+def payloads(pages, repeat):
+    """
+    (name, chunks, render seconds) for each page size and the export.
+    """
+    from rest_framework.renderers import JSONRenderer
+
+    from api.fastpath import message_rows, serialize_message_rows, stream_message_rows
+    from api.models import Message
+
+    renderer = JSONRenderer()
+    newest = Message.objects.order_by("-created_at", "-id")
+    for size in pages:
+        rows = list(message_rows(newest)[:size])
+        seconds, body = best_of(
+            repeat, lambda: renderer.render({"results": serialize_message_rows(rows)})
+        )
+        yield f"page_{size}", [body], seconds
+    rows = list(message_rows(Message.objects.order_by("id")))
+    seconds, chunks = best_of(repeat, lambda: list(stream_message_rows(rows, ndjson=True)))
+    yield "export_ndjson", chunks, seconds
+
+
+def measure(name, chunks, render_seconds, level, repeat):
+    from api.compression import gzip_compress, gzip_stream
+
+    if len(chunks) == 1:
+        seconds, compressed = best_of(repeat, lambda: gzip_compress(chunks[0], level))
+    else:
+        seconds, compressed = best_of(
+            repeat, lambda: b"".join(gzip_stream(chunks, level))
+        )
+    size = sum(map(len, chunks))
+    return {
+        "payload": name,
+        "level": level,
+        "bytes": size,
+        "gzip_bytes": len(compressed),
+        "saved_pct": round(100 * (1 - len(compressed) / size), 1),
+        "compress_ms": round(seconds * 1000, 3),
+        "render_ms": round(render_seconds * 1000, 3),
+        "compress_mb_per_s": round(size / seconds / 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 3, 6, 9])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with server.temp_database() as db_path:
+        server.setup_django(db_path)
+        seed(args.messages)
+        results = [
+            measure(name, chunks, render_seconds, level, args.repeat)
+            for name, chunks, render_seconds in payloads(args.pages, args.repeat)
+            for level in args.levels
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""
+Load test of the main API endpoints, with a JSON report to compare runs.
+
+Seeds --members members and --messages messages, then --concurrency
+simulated clients (coroutines in one event loop, each on its own
+keep-alive connection) send requests picked from --mix for --duration
+seconds: register, login, me, list (GET /api/messages/) and create
+(POST /api/messages/). The report has per-endpoint throughput, status
+counts and latency percentiles, and the commit that was measured.
+
+Targets:
+  --server wsgi   gunicorn.conf.py on a throwaway database (default)
+  --server asgi   gunicorn.asgi.conf.py on a throwaway database (needs uvicorn)
+  --in-process    config.asgi.application called directly, without sockets
+  --url URL       a running deployment, e.g. the nginx -> gunicorn stack of
+                  the Docker image; it is seeded through the API
+
+    python -m benchmarks.load --output before.json
+    python -m benchmarks.load --compare before.json
+
+With --compare the run is checked against an earlier report; the exit
+status is 1 if an endpoint lost more than --tolerance of its throughput or
+its p99 latency grew by more than that.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from benchmarks import server
+
+PASSWORD = "load-test-password"
+DEFAULT_MIX = "list=70,me=15,create=13,login=1,register=1"
+
+# Usernames registered during a run are unique across its clients.
+_register_ids = itertools.count()
+
+
+class HttpConnection:
+    """
+    Minimal HTTP/1.1 keep-alive client on asyncio streams.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = b"" if body is None else json.dumps(body).encode()
+        lines = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {self.host}",
+            f"Content-Length: {len(payload)}",
+        ]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+
+        status = int((await self.reader.readline()).split()[1])
+        response_headers = {}
+        while (line := await self.reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        if response_headers.get("transfer-encoding") == "chunked":
+            data = b""
+            while size := int((await self.reader.readline()).split(b";")[0], 16):
+                data += (await self.reader.readexactly(size + 2))[:-2]
+            await self.reader.readline()
+        else:
+            length = int(response_headers.get("content-length", 0))
+            data = await self.reader.readexactly(length)
+        if response_headers.get("connection") == "close":
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class AsgiConnection:
+    """
+    Same interface as HttpConnection, calling an ASGI application directly.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method, path, body=None, headers=None):
+        path, _, query = path.partition("?")
+        payload = b"" if body is None else json.dumps(body).encode()
+        scope_headers = [
+            (b"host", b"localhost"),
+            (b"content-length", str(len(payload)).encode()),
+        ]
+        if body is not None:
+            scope_headers.append((b"content-type", b"application/json"))
+        scope_headers += [
+            (name.lower().encode(), value.encode())
+            for name, value in (headers or {}).items()
+        ]
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "headers": scope_headers,
+            "client": ("127.0.0.1", 50000),
+            "server": ("127.0.0.1", 80),
+        }
+        incoming = [{"type": "http.request", "body": payload, "more_body": False}]
+        status = None
+        chunks = []
+
+        async def receive():
+            if incoming:
+                return incoming.pop()
+            # No disconnect until the response is complete.
+            await asyncio.Future()
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+    def close(self):
+        pass
+
+
+class Client:
+    """
+    One simulated user: a connection, a member's token and the operations.
+    """
+    expected = {"list": 200, "me": 200, "create": 201, "login": 200, "register": 201}
+
+    def __init__(self, conn, token, usernames, run_id, rng):
+        self.conn = conn
+        self.auth = {"Authorization": f"Bearer {token}"}
+        self.usernames = usernames
+        self.run_id = run_id
+        self.rng = rng
+
+    async def list(self):
+        return await self.conn.request("GET", "/api/messages/?limit=50", headers=self.auth)
+
+    async def me(self):
+        return await self.conn.request("GET", "/api/auth/me/", headers=self.auth)
+
+    async def create(self):
+        return await self.conn.request(
+            "POST", "/api/messages/", {"text": "load test message"}, self.auth
+        )
+
+    async def login(self):
+        username = self.rng.choice(self.usernames)
+        return await self.conn.request(
+            "POST", "/api/auth/login/", {"username": username, "password": PASSWORD}
+        )
+
+    async def register(self):
+        username = f"load-{self.run_id}-{next(_register_ids)}"
+        return await self.conn.request(
+            "POST", "/api/auth/register/", {"username": username, "password": PASSWORD}
+        )
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in Client.expected:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+
+def seed_database(members, messages):
+    """
+    Seed the throwaway database directly; returns (usernames, tokens).
+    """
+    from django.contrib.auth.hashers import make_password
+
+    from api.models import Member, Message, Token
+
+    password = make_password(PASSWORD)
+    Member.objects.bulk_create(
+        Member(username=f"load-member-{i}", password=password) for i in range(members)
+    )
+    created = list(Member.objects.filter(username__startswith="load-member-").order_by("id"))
+    tokens = [Token.objects.create(member=member).key for member in created]
+    for start in range(0, messages, 5000):
+        Message.objects.bulk_create(
+            Message(member=created[i % len(created)], text=f"message {i}")
+            for i in range(start, min(start + 5000, messages))
+        )
+    return [member.username for member in created], tokens
+
+
+async def seed_api(connect, members, messages, run_id):
+    """
+    Seed a running deployment through the API; returns (usernames, tokens).
+    """
+    conn = connect()
+    usernames, tokens = [], []
+    for i in range(members):
+        username = f"load-{run_id}-member-{i}"
+        body = {"username": username, "password": PASSWORD}
+        status, data = await conn.request("POST", "/api/auth/register/", body)
+        while status == 503:
+            # Password hashing is shedding load; wait as Retry-After asks.
+            await asyncio.sleep(1)
+            status, data = await conn.request("POST", "/api/auth/register/", body)
+        if status != 201:
+            raise RuntimeError(f"seeding failed: register returned {status}: {data[:200]}")
+        usernames.append(username)
+        tokens.append(json.loads(data)["token"])
+    for start in range(0, messages, 100):
+        batch = [{"text": f"message {i}"} for i in range(start, min(start + 100, messages))]
+        status, data = await conn.request(
+            "POST", "/api/messages/batch/", {"messages": batch},
+            {"Authorization": f"Bearer {tokens[start // 100 % len(tokens)]}"},
+        )
+        if status != 201:
+            raise RuntimeError(f"seeding failed: batch returned {status}: {data[:200]}")
+    conn.close()
+    return usernames, tokens
+
+
+async def drive(connect, usernames, tokens, run_id, args):
+    """
+    Run the clients; returns (operation, status, seconds) for every request
+    started after the warmup.
+    """
+    names = list(args.mix)
+    cum_weights = list(itertools.accumulate(args.mix.values()))
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+    results = []
+
+    async def run_client(i):
+        rng = random.Random(i)
+        client = Client(connect(), tokens[i % len(tokens)], usernames, run_id, rng)
+        while (now := time.perf_counter()) < stop_at:
+            operation = rng.choices(names, cum_weights=cum_weights)[0]
+            try:
+                status, _ = await getattr(client, operation)()
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                client.conn.close()
+                status = "error"
+            if now >= measure_from:
+                results.append((operation, status, time.perf_counter() - now))
+        client.conn.close()
+
+    await asyncio.gather(*(run_client(i) for i in range(args.concurrency)))
+    return results
+
+
+def report(results, args, target):
+    endpoints = {}
+    for operation in args.mix:
+        own = [r for r in results if r[0] == operation]
+        ok = [seconds for _, status, seconds in own if status == Client.expected[operation]]
+        statuses = {}
+        for _, status, _ in own:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        endpoints[operation] = {
+            "requests": len(own),
+            "requests_per_second": round(len(ok) / args.duration, 2),
+            "errors": len(own) - len(ok),
+            "statuses": statuses,
+            "latency": server.summarize(ok),
+        }
+    ok = [seconds for operation, status, seconds in results if status == Client.expected[operation]]
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "target": target,
+            "members": args.members,
+            "messages": args.messages,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": args.mix,
+        },
+        "total": {
+            "requests": len(results),
+            "requests_per_second": round(len(ok) / args.duration, 2),
+            "errors": len(results) - len(ok),
+            "latency": server.summarize(ok),
+        },
+        "endpoints": endpoints,
+    }
+
+
+def compare(baseline, current, tolerance):
+    """
+    Relative change of throughput and p99 per endpoint against a baseline
+    report, and the endpoints that regressed beyond tolerance.
+    """
+    changes, regressions = {}, []
+    for name, result in {"total": current["total"], **current["endpoints"]}.items():
+        base = baseline["total"] if name == "total" else baseline["endpoints"].get(name)
+        if not base or not base["requests_per_second"] or not base["latency"]["p99_ms"]:
+            continue
+        throughput = result["requests_per_second"] / base["requests_per_second"] - 1
+        p99 = (result["latency"]["p99_ms"] or 0) / base["latency"]["p99_ms"] - 1
+        changes[name] = {
+            "requests_per_second": f"{throughput:+.1%}",
+            "p99_ms": f"{p99:+.1%}",
+        }
+        if throughput < -tolerance or p99 > tolerance:
+            regressions.append(name)
+    return {"baseline": baseline["meta"], "changes": changes, "regressions": regressions}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=server.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, run_id):
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+
+        def connect():
+            return HttpConnection(host, port)
+
+        usernames, tokens = asyncio.run(
+            seed_api(connect, args.members, args.messages, run_id)
+        )
+        return asyncio.run(drive(connect, usernames, tokens, run_id, args)), args.url
+
+    with server.temp_database() as db_path:
+        server.setup_django(db_path)
+        usernames, tokens = seed_database(args.members, args.messages)
+        if args.in_process:
+            from config.asgi import application
+
+            results = asyncio.run(
+                drive(lambda: AsgiConnection(application), usernames, tokens, run_id, args)
+            )
+            return results, "in-process"
+
+        deployment = {
+            "wsgi": {},
+            "asgi": {"config": "gunicorn.asgi.conf.py", "app": "config.asgi:application"},
+        }[args.server]
+        with server.gunicorn(db_path, **deployment) as (host, port):
+            results = asyncio.run(
+                drive(lambda: HttpConnection(host, port), usernames, tokens, run_id, args)
+            )
+        return results, f"gunicorn-{args.server}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--server", choices=["wsgi", "asgi"], default="wsgi")
+    target.add_argument("--in-process", action="store_true")
+    target.add_argument("--url", help="Base URL of a running deployment")
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--output", help="Also write the report to this file")
+    parser.add_argument("--compare", help="Report of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    run_id = f"{int(time.time()):x}"
+    results, target_name = run(args, run_id)
+    result = report(results, args, target_name)
+    if args.compare:
+        with open(args.compare) as f:
+            result["comparison"] = compare(json.load(f), result, args.tolerance)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    if args.compare and result["comparison"]["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
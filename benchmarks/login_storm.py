@@ -0,0 +1,127 @@
+"""
+Login storm benchmark: chat latency while many clients log in at once.
+
+Runs the app under gunicorn.conf.py twice, once hashing passwords inline in
+the request threads (the old behaviour) and once through the offload pool
+with admission control (api.hashing). It reports login throughput, how many
+logins were shed with 503, and the latency of concurrent chat reads.
+
+    python -m benchmarks.login_storm --duration 15 --storm 32
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+
+from benchmarks import server
+
+
+def seed():
+    from django.contrib.auth.hashers import make_password
+
+    from api.models import Member, Message, Token
+
+    stormer = Member.objects.create(username="storm", password=make_password("secret"))
+    reader = Member.objects.create(username="reader", password="x")
+    Message.objects.bulk_create(
+        Message(member=stormer, text=f"message {i}") for i in range(1000)
+    )
+    return Token.objects.create(member=reader).key
+
+
+def login_loop(host, port, stop, results, once=False):
+    body = json.dumps({"username": "storm", "password": "secret"})
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            conn.request(
+                "POST", "/api/auth/login/", body, {"Content-Type": "application/json"}
+            )
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except OSError:
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+            status = "error"
+        results.append((status, time.perf_counter() - started))
+        if once:
+            return
+        if status == 503:
+            time.sleep(float(response.getheader("Retry-After", "1")))
+
+
+def chat_loop(host, port, token, stop, latencies):
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    headers = {"Authorization": f"Bearer {token}"}
+    while not stop.is_set():
+        started = time.perf_counter()
+        conn.request("GET", "/api/messages/?limit=50", headers=headers)
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.05)
+
+
+def run(db_path, token, mode, duration, storm):
+    logins, chat = [], []
+    stop = threading.Event()
+    env = {"BENCH_PASSWORD_HASHING": "" if mode == "pool" else mode}
+    with server.gunicorn(db_path, env=env) as (host, port):
+        # Warm up: start the hashing pools before measuring.
+        warmup = []
+        for _ in range(4):
+            login_loop(host, port, threading.Event(), warmup, once=True)
+        threads = [
+            threading.Thread(target=login_loop, args=(host, port, stop, logins))
+            for _ in range(storm)
+        ]
+        threads.append(
+            threading.Thread(target=chat_loop, args=(host, port, token, stop, chat))
+        )
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    ok = [latency for status, latency in logins if status == 200]
+    return {
+        "mode": mode,
+        "elapsed_seconds": round(elapsed, 2),
+        "logins_ok_per_second": round(len(ok) / elapsed, 2),
+        "logins_rejected_503": sum(1 for status, _ in logins if status == 503),
+        "login_latency": server.summarize(ok),
+        "chat_latency": server.summarize(chat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--storm", type=int, default=32, help="concurrent login clients")
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=["inline", "pool"],
+        help='"inline", "pool" (settings defaults) or a JSON PASSWORD_HASHING override',
+    )
+    args = parser.parse_args()
+
+    with server.temp_database() as db_path:
+        server.setup_django(db_path)
+        token = seed()
+        results = [
+            run(db_path, token, mode, args.duration, args.storm)
+            for mode in args.modes
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
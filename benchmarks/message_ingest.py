@@ -0,0 +1,103 @@
+"""
+Message ingest benchmark: messages stored per second under concurrent posts.
+
+Runs the app under gunicorn.conf.py with one message per transaction
+("single"), with group commit of concurrent posts ("grouped",
+MESSAGE_WRITER BATCHING) and with clients using /api/messages/batch/
+("batch_endpoint", --batch-size messages per request).
+
+    python -m benchmarks.message_ingest --duration 10 --writers 32
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+
+from benchmarks import server
+
+
+def seed():
+    from api.models import Member, Token
+
+    member = Member.objects.create(username="bench", password="x")
+    return Token.objects.create(member=member).key
+
+
+def writer_loop(host, port, token, stop, results, batch_size):
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    if batch_size:
+        path = "/api/messages/batch/"
+        body = json.dumps({"messages": [{"text": "hello"}] * batch_size})
+    else:
+        path, body = "/api/messages/", json.dumps({"text": "hello"})
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            conn.request("POST", path, body, headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except OSError:
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+            status = "error"
+        results.append((status, time.perf_counter() - started))
+
+
+def run(db_path, token, mode, duration, writers, batch_size):
+    results = []
+    stop = threading.Event()
+    env = {"DJANGO_MESSAGE_BATCHING": "1" if mode == "grouped" else "0"}
+    per_request = batch_size if mode == "batch_endpoint" else 0
+    with server.gunicorn(db_path, env=env) as (host, port):
+        threads = [
+            threading.Thread(
+                target=writer_loop,
+                args=(host, port, token, stop, results, per_request),
+            )
+            for _ in range(writers)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    ok = [latency for status, latency in results if status == 201]
+    return {
+        "mode": mode,
+        "elapsed_seconds": round(elapsed, 2),
+        "messages_per_second": round(len(ok) * max(per_request, 1) / elapsed, 2),
+        "failed_requests": len(results) - len(ok),
+        "request_latency": server.summarize(ok),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument(
+        "--modes", nargs="+", default=["single", "grouped", "batch_endpoint"]
+    )
+    args = parser.parse_args()
+
+    with server.temp_database() as db_path:
+        server.setup_django(db_path)
+        token = seed()
+        results = [
+            run(db_path, token, mode, args.duration, args.writers, args.batch_size)
+            for mode in args.modes
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
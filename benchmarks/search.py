@@ -0,0 +1,127 @@
+"""
+Full-text search benchmark at 1M messages: FTS5 vs LIKE '%term%'.
+
+Seeds a throwaway database with messages drawn from a Zipf-distributed
+vocabulary (the FTS triggers index them as they are inserted), times a
+batched rebuild_search_index, then runs first-page searches for common,
+mid-frequency and rare words and a two-word query, through api.search and
+through a LIKE scan of messages.text.
+
+    python -m benchmarks.search --messages 1000000
+"""
+
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import time
+
+from benchmarks import server
+
+
+def make_vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 9))))
+    return sorted(words, key=lambda word: rng.random())
+
+
+def seed(count, vocabulary, rng, k=8, batch=20000):
+    from django.db import connection, transaction
+
+    from api.models import Member
+
+    member = Member.objects.create(username="bench", password="x")
+    cum_weights = list(
+        itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1))
+    )
+    started = time.perf_counter()
+    for offset in range(0, count, batch):
+        rows = [
+            (member.id, " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=k)))
+            for _ in range(min(batch, count - offset))
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO messages (member_id, text, created_at) "
+                "VALUES (%s, %s, datetime('now'))",
+                rows,
+            )
+    return time.perf_counter() - started
+
+
+def timed(func, repeat):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        latencies.append(time.perf_counter() - started)
+    return server.summarize(latencies), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--like-repeat", type=int, default=3)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    with server.temp_database() as db_path:
+        server.setup_django(db_path)
+        from django.core.management import call_command
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+
+        from api.models import Message
+        from api.search import MessageSearch
+
+        vocabulary = make_vocabulary(args.vocabulary, rng)
+        seed_seconds = seed(args.messages, vocabulary, rng)
+
+        started = time.perf_counter()
+        call_command("rebuild_search_index", pause=0, stdout=io.StringIO())
+        rebuild_seconds = time.perf_counter() - started
+
+        factory = APIRequestFactory()
+        queries = {
+            "common": vocabulary[0],
+            "mid": vocabulary[99],
+            "rare": vocabulary[9999 % len(vocabulary)],
+            "two_words": f"{vocabulary[0]} {vocabulary[99]}",
+        }
+        results = {}
+        for label, query in queries.items():
+            request = Request(factory.get("/", {"q": query, "limit": 20}))
+            fts, page = timed(lambda: MessageSearch().search(request), args.repeat)
+            terms = query.split()
+            like_qs = Message.objects.filter(text__contains=terms[0])
+            for term in terms[1:]:
+                like_qs = like_qs.filter(text__contains=term)
+            like, _ = timed(
+                lambda: list(like_qs.order_by("-id").values_list("id")[:20]),
+                args.like_repeat,
+            )
+            results[label] = {
+                "query": query,
+                "hits_on_first_page": len(page["results"]),
+                "fts": fts,
+                "like_scan": like,
+            }
+        db_bytes = os.path.getsize(db_path)
+
+    print(json.dumps({
+        "messages": args.messages,
+        "seed_seconds_with_triggers": round(seed_seconds, 2),
+        "rebuild_seconds": round(rebuild_seconds, 2),
+        "db_bytes": db_bytes,
+        "queries": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Micro-benchmark: ChatMessageSerializer vs the values_list fast path.
+
+Seeds a throwaway database and times turning the newest N messages into
+JSON bytes both ways: ORM instances with select_related through
+ChatMessageSerializer, and api.fastpath rows. Both are rendered with DRF's
+JSONRenderer, and the bytes are checked to be identical.
+
+    python -m benchmarks.serialization --sizes 1000 10000 100000
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks import server
+
+
+def seed(count):
+    from api.models import Member, Message
+
+    members = [
+        Member.objects.create(username=f"member{i}", password="x") for i in range(50)
+    ]
+    Message.objects.bulk_create(
+        (
+            Message(member=members[i % len(members)], text=f"message number {i}")
+            for i in range(count)
+        ),
+        batch_size=5000,
+    )
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def measure(size, repeat):
+    from rest_framework.renderers import JSONRenderer
+
+    from api.fastpath import message_rows, serialize_message_rows
+    from api.models import Message
+    from api.serializers import ChatMessageSerializer
+
+    renderer = JSONRenderer()
+    newest = Message.objects.order_by("-created_at", "-id")
+
+    def serializer_path():
+        page = list(newest.select_related("member")[:size])
+        return renderer.render(ChatMessageSerializer(page, many=True).data)
+
+    def fast_path():
+        page = list(message_rows(newest)[:size])
+        return renderer.render(serialize_message_rows(page))
+
+    # Serialization alone, on rows already fetched.
+    instances = list(newest.select_related("member")[:size])
+    rows = list(message_rows(newest)[:size])
+    serializer_only, _ = best_of(
+        repeat, lambda: renderer.render(ChatMessageSerializer(instances, many=True).data)
+    )
+    fast_only, _ = best_of(repeat, lambda: renderer.render(serialize_message_rows(rows)))
+
+    serializer_total, expected = best_of(repeat, serializer_path)
+    fast_total, actual = best_of(repeat, fast_path)
+    assert actual == expected, "fast path output differs"
+    return {
+        "rows": size,
+        "bytes": len(actual),
+        "serializer_ms": {
+            "total": round(serializer_total * 1000, 2),
+            "serialize_render": round(serializer_only * 1000, 2),
+        },
+        "fast_path_ms": {
+            "total": round(fast_total * 1000, 2),
+            "serialize_render": round(fast_only * 1000, 2),
+        },
+        "speedup_total": round(serializer_total / fast_total, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with server.temp_database() as db_path:
+        server.setup_django(db_path)
+        seed(max(args.sizes))
+        results = [measure(size, args.repeat) for size in args.sizes]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
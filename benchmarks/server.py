@@ -0,0 +1,117 @@
+"""
+Helpers to run the application under the real gunicorn configuration
+against a throwaway database, and to measure latencies.
+"""
+
+import contextlib
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(db_path):
+    """
+    Configure Django in this process for seeding, using benchmarks.settings.
+    """
+    os.environ["BENCH_DB"] = str(db_path)
+    os.environ["DJANGO_SETTINGS_MODULE"] = "benchmarks.settings"
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+@contextlib.contextmanager
+def temp_database():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield Path(tmp) / "bench.sqlite3"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def gunicorn(db_path, env=None, args=(), config="gunicorn.conf.py",
+             app="config.wsgi:application"):
+    """
+    Start gunicorn with ``config`` (gunicorn.conf.py, or gunicorn.asgi.conf.py
+    with app="config.asgi:application") on a free port; yields (host, port).
+    """
+    from django.db import connections
+
+    connections.close_all()
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--config", str(BASE_DIR / config),
+            "--bind", f"127.0.0.1:{port}",
+            "--access-logfile", "/dev/null",
+            *args,
+            app,
+        ],
+        cwd=BASE_DIR,
+        env={
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "benchmarks.settings",
+            "BENCH_DB": str(db_path),
+            **(env or {}),
+        },
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready("127.0.0.1", port)
+        yield "127.0.0.1", port
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def wait_until_ready(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=5)
+            conn.request("GET", "/api/hello/")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("gunicorn did not start")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies):
+    """
+    Latency summary in milliseconds.
+    """
+    return {
+        "count": len(latencies),
+        "p50_ms": _ms(percentile(latencies, 50)),
+        "p90_ms": _ms(percentile(latencies, 90)),
+        "p99_ms": _ms(percentile(latencies, 99)),
+        "max_ms": _ms(max(latencies) if latencies else None),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
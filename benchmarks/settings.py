@@ -0,0 +1,35 @@
+"""
+Settings for benchmark runs: the application settings pointed at a
+throwaway database (BENCH_DB), plus knobs for before/after comparisons.
+"""
+
+import os
+
+from config.settings import *  # noqa: F401,F403
+from config.settings import DATABASES
+
+DATABASES["default"]["NAME"] = os.environ["BENCH_DB"]
+
+# Every benchmark client shares one IP and a handful of tokens.
+RATE_LIMITING = {"ENABLED": False}
+
+if os.environ.get("BENCH_SQLITE") == "legacy":
+    # Pre-tuning behaviour: Django's SQLite defaults, a connection per request.
+    DATABASES["default"] = {
+        "ENGINE": DATABASES["default"]["ENGINE"],
+        "NAME": DATABASES["default"]["NAME"],
+    }
+
+if os.environ.get("BENCH_PASSWORD_HASHING") == "inline":
+    # Pre-offload behaviour: hash in the request thread, no admission limit.
+    PASSWORD_HASHING = {"WORKERS": 0, "MAX_QUEUE": 1_000_000}
+elif os.environ.get("BENCH_PASSWORD_HASHING"):
+    # JSON overrides, e.g. '{"WORKERS": 1, "MAX_QUEUE": 4}'
+    import json
+
+    from config.settings import PASSWORD_HASHING
+
+    PASSWORD_HASHING = {
+        **PASSWORD_HASHING,
+        **json.loads(os.environ["BENCH_PASSWORD_HASHING"]),
+    }
@@ -0,0 +1,136 @@
+"""
+Concurrent read/write benchmark for the SQLite configuration.
+
+Runs the app under gunicorn.conf.py against a rollback-journal database with
+Django's default connection handling ("legacy") and against the tuned WAL
+setup from config.settings ("tuned"). Reader clients page through
+/api/messages/ while writer clients post messages; it reports throughput,
+latency and failed requests (e.g. "database is locked") for each side.
+
+    python -m benchmarks.sqlite_concurrency --duration 15 --readers 16 --writers 4
+"""
+
+import argparse
+import http.client
+import json
+import shutil
+import sqlite3
+import threading
+import time
+
+from benchmarks import server
+
+
+def seed(messages):
+    from api.models import Member, Message, Token
+
+    member = Member.objects.create(username="bench", password="x")
+    Message.objects.bulk_create(
+        (Message(member=member, text=f"message {i}") for i in range(messages)),
+        batch_size=1000,
+    )
+    return Token.objects.create(member=member).key
+
+
+def make_legacy_copy(db_path):
+    """
+    Copy the seeded database and switch the copy to rollback journaling.
+    """
+    from django.db import connections
+
+    connections.close_all()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    legacy_path = db_path.with_name("legacy.sqlite3")
+    shutil.copyfile(db_path, legacy_path)
+    conn = sqlite3.connect(legacy_path)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.close()
+    return legacy_path
+
+
+def client_loop(host, port, token, stop, results, write):
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    body = json.dumps({"text": "hello"})
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            if write:
+                conn.request("POST", "/api/messages/", body, headers)
+            else:
+                conn.request("GET", "/api/messages/?limit=50", headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+        except OSError:
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+            status = "error"
+        results.append((status, time.perf_counter() - started))
+
+
+def run(db_path, token, mode, duration, readers, writers):
+    reads, writes = [], []
+    stop = threading.Event()
+    env = {"BENCH_SQLITE": mode}
+    with server.gunicorn(db_path, env=env) as (host, port):
+        threads = [
+            threading.Thread(
+                target=client_loop, args=(host, port, token, stop, reads, False)
+            )
+            for _ in range(readers)
+        ] + [
+            threading.Thread(
+                target=client_loop, args=(host, port, token, stop, writes, True)
+            )
+            for _ in range(writers)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "elapsed_seconds": round(elapsed, 2),
+        "reads": report(reads, 200, elapsed),
+        "writes": report(writes, 201, elapsed),
+    }
+
+
+def report(results, ok_status, elapsed):
+    ok = [latency for status, latency in results if status == ok_status]
+    return {
+        "ok_per_second": round(len(ok) / elapsed, 2),
+        "failed": len(results) - len(ok),
+        "latency": server.summarize(ok),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=10000, help="seeded rows")
+    args = parser.parse_args()
+
+    with server.temp_database() as db_path:
+        server.setup_django(db_path)
+        token = seed(args.messages)
+        paths = {"legacy": make_legacy_copy(db_path), "tuned": db_path}
+        results = [
+            run(paths[mode], token, mode, args.duration, args.readers, args.writers)
+            for mode in ("legacy", "tuned")
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Worker startup: application import time and time to first request.
+
+gunicorn imports the application once, in the master (preload_app), and
+forks the workers from it; max_requests then replaces every worker after
+about 10000 requests. Whatever a fresh worker still has to import or set up
+on its first request is paid again on each of those restarts. Measures:
+
+- import: importing config.wsgi in a fresh interpreter, as the master does;
+- first_request: the first GET /api/messages/ of a worker forked from a
+  process that imported config.wsgi;
+- warm_request: the same request once the worker is warm;
+- unpreloaded_first_request: the first request of a process that imported
+  config.wsgi itself (preload_app off).
+
+Requests go straight to the WSGI application, without a server in between.
+
+    python -m benchmarks.startup --runs 20
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+from benchmarks import server
+
+PATH = "/api/messages/"
+
+
+def seed(messages):
+    from api.models import Member, Message, Token
+
+    member = Member.objects.create(username="bench", password="x")
+    Message.objects.bulk_create(
+        [Message(member=member, text=f"message {i}") for i in range(messages)],
+        batch_size=1000,
+    )
+    return Token.objects.create(member=member).key
+
+
+def request(application, token):
+    """
+    One GET /api/messages/ through the WSGI application; returns seconds.
+    """
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": PATH,
+        "QUERY_STRING": "limit=50",
+        "HTTP_AUTHORIZATION": f"Bearer {token}",
+        "wsgi.input": io.BytesIO(),
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+    started = time.perf_counter()
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b"".join(body)
+    elapsed = time.perf_counter() - started
+    if not statuses[0].startswith("200"):
+        raise RuntimeError(f"{PATH} answered {statuses[0]}")
+    return elapsed
+
+
+def import_application():
+    started = time.perf_counter()
+    from config.wsgi import application
+
+    return application, time.perf_counter() - started
+
+
+def forked_child(token, runs, requests):
+    """
+    Import the application, then fork ``runs`` workers that each serve
+    ``requests`` requests. Prints the timings as JSON.
+    """
+    from django.db import connections
+
+    application, _ = import_application()
+    connections.close_all()
+    first, warm = [], []
+    for _ in range(runs):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            timings = [request(application, token) for _ in range(requests)]
+            os.write(write, json.dumps(timings).encode())
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read, "rb") as pipe:
+            timings = json.loads(pipe.read())
+        os.waitpid(pid, 0)
+        first.append(timings[0])
+        warm.extend(timings[1:])
+    print(json.dumps({"first_request": first, "warm_request": warm}))
+
+
+def unpreloaded_child(token):
+    application, imported = import_application()
+    print(json.dumps({"import": imported, "first_request": request(application, token)}))
+
+
+def run_child(db_path, *args):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", *map(str, args)],
+        cwd=server.BASE_DIR,
+        env={
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": "benchmarks.settings",
+            "BENCH_DB": str(db_path),
+        },
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, token, *rest = args.child
+        if mode == "forked":
+            forked_child(token, *map(int, rest))
+        else:
+            unpreloaded_child(token)
+        return
+
+    with server.temp_database() as db_path:
+        server.setup_django(db_path)
+        token = seed(args.messages)
+        forked = run_child(db_path, "forked", token, args.runs, args.requests)
+        unpreloaded = [run_child(db_path, "unpreloaded", token) for _ in range(args.runs)]
+    print(json.dumps({
+        "import": server.summarize([run["import"] for run in unpreloaded]),
+        "first_request": server.summarize(forked["first_request"]),
+        "warm_request": server.summarize(forked["warm_request"]),
+        "unpreloaded_first_request": server.summarize(
+            [run["first_request"] for run in unpreloaded]
+        ),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
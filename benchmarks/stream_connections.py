@@ -0,0 +1,134 @@
+"""
+Idle-connection load test for /api/messages/stream/.
+
+Opens N Server-Sent Events connections against config.asgi.application in
+one event loop, i.e. one ASGI worker, against a throwaway test database.
+Reports the resident memory each idle connection costs, the number of
+connections that fit in a memory budget, and how long one new message takes
+to reach every client.
+
+    python -m benchmarks.stream_connections --connections 5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from asgiref.sync import sync_to_async  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from api.models import Member, Message, Token  # noqa: E402
+from config.asgi import application  # noqa: E402
+
+
+def rss_bytes():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class Client:
+    def __init__(self, token_key, port, disconnect):
+        self.scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/api/messages/stream/",
+            "raw_path": b"/api/messages/stream/",
+            "query_string": f"token={token_key}".encode(),
+            "headers": [(b"host", b"localhost")],
+            "client": ("127.0.0.1", port),
+            "server": ("127.0.0.1", 8000),
+        }
+        self.disconnect = disconnect
+        self.requested = False
+        self.connected = asyncio.Event()
+        self.received = asyncio.Event()
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] != "http.response.body":
+            return
+        self.connected.set()
+        if message.get("body", b"").startswith(b"id:"):
+            self.received.set()
+
+    async def run(self):
+        await application(self.scope, self.receive, self.send)
+
+
+async def run(connections, budget_mb):
+    member = await Member.objects.acreate(username="bench", password="x")
+    token = await sync_to_async(Token.objects.create)(member=member)
+    disconnect = asyncio.Event()
+
+    baseline = rss_bytes()
+    started = time.perf_counter()
+    clients = [Client(token.key, 10000 + i, disconnect) for i in range(connections)]
+    tasks = [asyncio.create_task(client.run()) for client in clients]
+    await asyncio.gather(*(client.connected.wait() for client in clients))
+    connect_seconds = time.perf_counter() - started
+    await asyncio.sleep(0.5)
+    loaded = rss_bytes()
+
+    started = time.perf_counter()
+    await Message.objects.acreate(member=member, text="fan-out")
+    await asyncio.gather(*(client.received.wait() for client in clients))
+    fanout_seconds = time.perf_counter() - started
+
+    disconnect.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    per_connection = max(loaded - baseline, 1) / connections
+    return {
+        "connections": connections,
+        "connect_seconds": round(connect_seconds, 3),
+        "rss_baseline_mb": round(baseline / 2**20, 1),
+        "rss_loaded_mb": round(loaded / 2**20, 1),
+        "bytes_per_idle_connection": int(per_connection),
+        "connections_per_budget": int(budget_mb * 2**20 / per_connection),
+        "budget_mb": budget_mb,
+        "fanout_seconds": round(fanout_seconds, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument(
+        "--budget-mb",
+        type=int,
+        default=512,
+        help="worker memory budget used to project the connection capacity",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # A file database, as in production; Django never closes in-memory ones.
+        connection.settings_dict["TEST"]["NAME"] = os.path.join(tmp, "bench.sqlite3")
+        connection.creation.create_test_db(verbosity=0)
+        result = asyncio.run(run(args.connections, args.budget_mb))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+"""
+ASGI config for config project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Server-Sent Events on /api/messages/stream/ bypass Django's request handler
+so that an idle stream costs a coroutine, not a thread.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+from django.urls import get_resolver
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+django_application = get_asgi_application()
+
+# Imported once in the gunicorn master with preload_app; see config.wsgi.
+get_resolver().reverse_dict
+
+from api.streaming import stream_application  # noqa: E402
+
+STREAM_PATH = "/api/messages/stream/"
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and scope["path"] == STREAM_PATH:
+        return await stream_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -82,22 +83,87 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Serve /api/messages/ and /api/auth/me/ with async views (api.views.Async*).
+# Set by gunicorn.asgi.conf.py; only useful under an ASGI server.
+ASYNC_VIEWS = os.environ.get("DJANGO_ASYNC_VIEWS") == "1"
+
+# In-process cache for token -> member lookups (api.authentication)
+TOKEN_CACHE = {
+    "MAX_SIZE": 10000,
+    "TTL": 60,
+}
+
+# Request metrics served on /api/metrics/ (api.metrics), kept in shared
+# memory sized for MAX_WORKERS concurrent processes and MAX_SERIES distinct
+# (route, method) pairs.
+METRICS = {
+    "MAX_WORKERS": 16,
+    "MAX_SERIES": 256,
+}
+# Bearer token the Prometheus scraper sends to /api/metrics/; unset, the
+# endpoint answers 404 to everyone.
+METRICS_TOKEN = os.environ.get("DJANGO_METRICS_TOKEN")
+
+# gzip for API responses (api.compression): bodies of CONTENT_TYPES from
+# MIN_SIZE bytes, and streamed ones always. Level 1 already saves ~75% on
+# message history at a quarter of the CPU of level 6, which saves only a
+# few points more (python -m benchmarks.compression).
+COMPRESSION = {
+    "ENABLED": True,
+    "MIN_SIZE": 1024,
+    "LEVEL": 1,
+    "STREAMING_LEVEL": 1,
+    "CONTENT_TYPES": ["application/json", "application/x-ndjson"],
+}
+
+# Token lifecycle (api.models.Token)
+TOKEN_LIFETIME = timedelta(days=30)
+# "reuse" (hand back a token with at least half its lifetime left),
+# "rotate" (one token per member) or "new"
+TOKEN_LOGIN_POLICY = "reuse"
+
+# Password hashing offload (api.hashing): concurrent hashes, extra queued
+# requests before answering 503 + Retry-After, and pool process niceness
+# (DJANGO_HASHING_NICE; a positive value lets chat traffic starve logins).
+# Keep the queue short: (WORKERS + MAX_QUEUE) hashes must finish well within
+# TIMEOUT, or queued logins time out after burning CPU anyway.
+# WORKERS = 0 hashes inline in the request thread.
+PASSWORD_HASHING = {
+    "WORKERS": 2,
+    "MAX_QUEUE": 4,
+    "TIMEOUT": 10,
+    "RETRY_AFTER": 1,
+    "NICE": int(os.environ.get("DJANGO_HASHING_NICE", "0")),
+}
+
 # drf-spectacular configuration
 SPECTACULAR_SETTINGS = {
     "TITLE": "Easyapp API",
     "DESCRIPTION": "API documentation for easyapp",
     "VERSION": "1.0.0",
     "SERVE_INCLUDE_SCHEMA": False,
+    # The views annotate with api.schema.extend_schema, applied only here.
+    "PREPROCESSING_HOOKS": ["api.schema.apply_schema_annotations"],
 }
 
+# /api/ requests skip everything between ApiBypassMiddleware and
+# ApiBypassEndMiddleware (api.middleware): sessions, CSRF, auth, messages
+# and X-Frame-Options serve the admin, not the token-authenticated API.
 MIDDLEWARE = [
+    "api.profiling.QueryProfilerMiddleware",
+    "api.metrics.MetricsMiddleware",
+    "api.compression.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
+    "api.routers.PrimaryPinMiddleware",
+    "api.ratelimit.RateLimitMiddleware",
+    "api.middleware.ApiBypassMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.middleware.ApiBypassEndMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -118,16 +184,221 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "config.wsgi.application"
+ASGI_APPLICATION = "config.asgi.application"
+
+# Message inserts (api.writer). With BATCHING on, concurrent POSTs within a
+# worker are committed together: the first waits up to MAX_WAIT seconds for
+# up to MAX_BATCH messages and writes them in one transaction.
+MESSAGE_WRITER = {
+    "BATCHING": os.environ.get("DJANGO_MESSAGE_BATCHING") == "1",
+    "MAX_WAIT": 0.002,
+    "MAX_BATCH": 100,
+}
+
+# Idempotent message posts (api.idempotency). Each worker remembers the
+# responses to the last MAX_SIZE Idempotency-Keys for WINDOW seconds, so
+# retries within that window are answered without a database query.
+IDEMPOTENCY = {
+    "MAX_SIZE": 10000,
+    "WINDOW": 300,
+}
+
+# Old messages moved out of the messages table by `manage.py archive_messages`
+# (run it from cron). RETENTION_DAYS is the default for --days; with None
+# the command requires --days. Archived history stays readable through the
+# messages API.
+MESSAGE_ARCHIVE = {
+    "DIRECTORY": BASE_DIR / "persistent" / "archive",
+    "RETENTION_DAYS": (
+        int(os.environ["DJANGO_MESSAGE_RETENTION_DAYS"])
+        if os.environ.get("DJANGO_MESSAGE_RETENTION_DAYS")
+        else None
+    ),
+    "SEGMENT_SIZE": 5000,
+    "CACHE_SEGMENTS": 8,
+}
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "persistent" / "db" / "db.sqlite3",
+# DJANGO_DB_ENGINE selects the database: "sqlite3" (default) or
+# "postgresql". PostgreSQL needs `psycopg[pool]`, which is not part of
+# requirements.txt; install it in deployments that use it.
+DB_ENGINE = os.environ.get("DJANGO_DB_ENGINE", "sqlite3")
+
+# SQLite runs in WAL mode so readers never wait for the writer. The pragmas
+# below are applied to every new connection; with synchronous=NORMAL a commit
+# is durable once the WAL is checkpointed, and a power loss can drop at most
+# the last few transactions, never corrupt the file. IMMEDIATE transactions
+# take the write lock up front, so concurrent writers queue on busy_timeout
+# instead of failing with "database is locked" when upgrading a read lock.
+# Connections are kept for CONN_MAX_AGE seconds instead of per request.
+# DJANGO_SQLITE_TUNING=0 falls back to Django's defaults.
+#
+# Memory: Django keeps a connection per thread and alias, so a gthread
+# worker can hold GUNICORN_THREADS x aliases of them, each with up to
+# cache_size of private page cache: 64 threads x 2 aliases x 2 MiB = 256 MiB
+# per worker at the defaults. Long-polling requests close theirs while
+# parked. mmap_size costs address space, not memory per connection: the
+# mapping goes through the OS page cache, which every connection and
+# process shares.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,  # ms
+    "cache_size": -2000,  # KiB per connection
+    "mmap_size": 256 * 1024 * 1024,  # bytes, shared through the page cache
+    "temp_store": "MEMORY",
+}
+
+
+def sqlite_database(name):
+    database = {"ENGINE": "django.db.backends.sqlite3", "NAME": name}
+    if os.environ.get("DJANGO_SQLITE_TUNING", "1") == "1":
+        database.update({
+            "CONN_MAX_AGE": int(os.environ.get("DJANGO_CONN_MAX_AGE", "600")),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "init_command": "; ".join(
+                    f"PRAGMA {pragma}={value}"
+                    for pragma, value in SQLITE_PRAGMAS.items()
+                ),
+                "transaction_mode": "IMMEDIATE",
+                "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000,
+            },
+        })
+    return database
+
+
+# On PostgreSQL, id-based deltas (since_id, the long poll, the event
+# stream) can skip a message whose transaction commits after a higher id;
+# they are gap-free on SQLite only (see api.pagination).
+# PostgreSQL uses Django's native psycopg pool, one per worker process:
+# keep workers * DJANGO_DB_POOL_MAX below the server's max_connections.
+# Pooled connections are returned after every request, so CONN_MAX_AGE
+# stays 0.
+def postgresql_database(host):
+    return {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ.get("DJANGO_DB_NAME", "chat"),
+        "USER": os.environ.get("DJANGO_DB_USER", "chat"),
+        "PASSWORD": os.environ.get("DJANGO_DB_PASSWORD", ""),
+        "HOST": host,
+        "PORT": os.environ.get("DJANGO_DB_PORT", "5432"),
+        "OPTIONS": {
+            "pool": {
+                "min_size": int(os.environ.get("DJANGO_DB_POOL_MIN", "2")),
+                "max_size": int(os.environ.get("DJANGO_DB_POOL_MAX", "10")),
+                "timeout": 10,
+            },
+        },
+    }
+
+
+# An optional read replica (DJANGO_DB_REPLICA_HOST for PostgreSQL,
+# DJANGO_DB_REPLICA_NAME for an SQLite copy kept up to date externally).
+# config.settings_test always adds one.
+if DB_ENGINE == "postgresql":
+    DATABASES = {
+        "default": postgresql_database(os.environ.get("DJANGO_DB_HOST", "localhost")),
     }
+    if os.environ.get("DJANGO_DB_REPLICA_HOST"):
+        DATABASES["replica"] = postgresql_database(
+            os.environ.get("DJANGO_DB_REPLICA_HOST", DATABASES["default"]["HOST"])
+        )
+        DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+else:
+    DATABASES = {
+        "default": sqlite_database(
+            os.environ.get("DJANGO_DB_NAME")
+            or BASE_DIR / "persistent" / "db" / "db.sqlite3"
+        ),
+    }
+    if os.environ.get("DJANGO_DB_REPLICA_NAME"):
+        DATABASES["replica"] = sqlite_database(
+            os.environ.get("DJANGO_DB_REPLICA_NAME")
+            or BASE_DIR / "persistent" / "db" / "replica.sqlite3"
+        )
+
+# Busy rooms can keep their messages in SQLite files of their own
+# (api.routers.RoomShardRouter), so that their writers do not queue on the
+# main database's write lock, nor on each other's. DJANGO_ROOM_SHARDS="a,b"
+# adds the databases "rooms_a" and "rooms_b"; create their table with
+# `manage.py migrate --database rooms_a` and move a room there with
+# `manage.py move_room <room> rooms_a`. config.settings_test adds one.
+# PostgreSQL locks rows, not the database, and needs no shards.
+ROOM_SHARDS = []
+if DB_ENGINE != "postgresql":
+    shard_names = os.environ.get("DJANGO_ROOM_SHARDS", "")
+    ROOM_SHARDS = [f"rooms_{name.strip()}" for name in shard_names.split(",") if name.strip()]
+    for alias in ROOM_SHARDS:
+        DATABASES[alias] = sqlite_database(
+            BASE_DIR / "persistent" / "db" / f"{alias}.sqlite3"
+        )
+
+# Reads of views marked with api.routers.replica_reads go to the ALIAS
+# database. After a successful write request the member's reads stay on the
+# primary for PIN_SECONDS, so members always see their own posts even while
+# the replica is behind, from any client. Pins live in a shared-memory table
+# of PIN_SLOTS stamps indexed by member id. Tests enable routing explicitly
+# with override_settings.
+DATABASE_ROUTERS = ["api.routers.RoomShardRouter", "api.routers.ReplicaRouter"]
+READ_REPLICA = {
+    "ALIAS": "replica" if "replica" in DATABASES else None,
+    "PIN_SECONDS": 5,
+    "PIN_SLOTS": 16384,
+}
+
+# Token-bucket rate limits (api.ratelimit), shared by all workers through a
+# table of SLOTS buckets in shared memory. ROUTES maps a URL name and method
+# to DRF-style rates ("<requests>/<s|min|hour|day>") per client IP (nginx's
+# X-Real-IP) and/or per token; a rate also sets the burst size. Over-limit
+# requests get 429 before any authentication, query or password hash.
+RATE_LIMITING = {
+    "ENABLED": True,
+    "SLOTS": 16384,
+    "ROUTES": {
+        "register": {"POST": {"ip": "20/hour"}},
+        "login": {"POST": {"ip": "20/min"}},
+        "messages": {"POST": {"token": "60/min", "ip": "600/min"}},
+        "messages-batch": {"POST": {"token": "10/min", "ip": "100/min"}},
+        "room-messages": {"POST": {"token": "60/min", "ip": "600/min"}},
+    },
+}
+
+# Per-request SQL profiling (api.profiling). A request is profiled when it
+# sends "X-Profile: <KEY>" (any value with DEBUG on) or is sampled at
+# SAMPLE_RATE; profiled requests taking SLOW_REQUEST_MS or more are logged
+# with their statements, query plans and time breakdown. A SELECT repeated
+# N_PLUS_ONE_THRESHOLD times in one request is logged as N+1 queries.
+QUERY_PROFILING = {
+    "KEY": os.environ.get("DJANGO_PROFILE_KEY"),
+    "SAMPLE_RATE": float(os.environ.get("DJANGO_PROFILE_SAMPLE_RATE", "0")),
+    "SLOW_REQUEST_MS": 500,
+    "EXPLAIN": True,
+    "N_PLUS_ONE_THRESHOLD": 5,
+    "N_PLUS_ONE": "log",
+}
+
+# Periodic WAL checkpoint run by the gunicorn master (api.sqlite): a passive
+# checkpoint every INTERVAL seconds, truncating the WAL file once it grows
+# past TRUNCATE_BYTES.
+SQLITE_WAL_CHECKPOINT = {
+    "INTERVAL": 30,
+    "TRUNCATE_BYTES": 64 * 1024 * 1024,
+}
+
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api": {"handlers": ["console"], "level": "INFO"},
+    },
 }
 
 
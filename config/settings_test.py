@@ -0,0 +1,51 @@
+"""
+Settings for the test suite: the production settings plus the extra
+databases the tests use, with replica routing and rate limiting off (the
+tests that cover them turn them on) and every request profiled.
+
+manage.py uses this module for `manage.py test`; other runners should set
+DJANGO_SETTINGS_MODULE=config.settings_test.
+"""
+
+from config.settings import *  # noqa: F401,F403
+from config.settings import (
+    BASE_DIR,
+    DATABASES,
+    DB_ENGINE,
+    QUERY_PROFILING,
+    RATE_LIMITING,
+    READ_REPLICA,
+    ROOM_SHARDS,
+    postgresql_database,
+    sqlite_database,
+)
+
+# A replica to route to: a mirror of the PostgreSQL test database, or for
+# SQLite a separate database that never receives the primary's writes, i.e.
+# a replica that is lagging indefinitely.
+if "replica" not in DATABASES:
+    if DB_ENGINE == "postgresql":
+        DATABASES["replica"] = postgresql_database(DATABASES["default"]["HOST"])
+        DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+    else:
+        DATABASES["replica"] = sqlite_database(BASE_DIR / "persistent" / "db" / "replica.sqlite3")
+
+# One room shard.
+if DB_ENGINE != "postgresql" and not ROOM_SHARDS:
+    ROOM_SHARDS = ["rooms_test"]
+    DATABASES["rooms_test"] = sqlite_database(BASE_DIR / "persistent" / "db" / "rooms_test.sqlite3")
+
+READ_REPLICA = {**READ_REPLICA, "ALIAS": None}
+
+# Test clients log in and post far faster than real ones.
+RATE_LIMITING = {**RATE_LIMITING, "ENABLED": False}
+
+# Profile every request and fail on N+1 queries instead of logging them.
+QUERY_PROFILING = {
+    **QUERY_PROFILING,
+    "SAMPLE_RATE": 1.0,
+    # Logins take longer than this by design (password hashing).
+    "SLOW_REQUEST_MS": 5000,
+    "EXPLAIN": False,
+    "N_PLUS_ONE": "raise",
+}
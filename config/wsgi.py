@@ -10,7 +10,14 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_wsgi_application()
+
+# With preload_app this module is imported once, in the gunicorn master.
+# Import the URLconf, and with it every view, and compile its patterns here
+# too, so that recycled workers do not each pay for it on their first
+# request.
+get_resolver().reverse_dict
@@ -24,6 +24,13 @@ echo "==> Running database migrations..."
 DJANGO_SETTINGS_MODULE="config.settings" /opt/venv/bin/python \
     manage.py migrate --noinput
 
+# Room shard databases (DJANGO_ROOM_SHARDS, see config/settings.py)
+DJANGO_ROOM_SHARDS="${DJANGO_ROOM_SHARDS:-}"
+for shard in ${DJANGO_ROOM_SHARDS//,/ }; do
+    DJANGO_SETTINGS_MODULE="config.settings" /opt/venv/bin/python \
+        manage.py migrate --noinput --database "rooms_${shard}"
+done
+
 if [ "$DB_INIT" = true ]; then
     DJANGO_SETTINGS_MODULE="config.settings" DJANGO_SUPERUSER_PASSWORD="$DJANGO_SUPERUSER_PASSWORD" /opt/venv/bin/python \
         manage.py createsuperuser --noinput \
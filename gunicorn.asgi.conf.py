@@ -0,0 +1,71 @@
+"""Gunicorn configuration for the ASGI deployment
+
+Runs config.asgi under uvicorn workers, with the async variants of the hot
+endpoints (/api/messages/ and /api/auth/me/, see api.views.AsyncAPIView):
+
+    gunicorn --config gunicorn.asgi.conf.py config.asgi:application
+
+Each worker is a single event loop. A connection waiting on a slow client
+costs a coroutine rather than one of a fixed number of threads, and
+/api/messages/stream/ is served without Django's request handler.
+Database queries and the sync middleware still run on Django's executor
+threads, and every hop there costs a thread switch. For short requests
+this deployment is slower than the gthread workers of gunicorn.conf.py
+(see benchmarks/async_views.py); what it gains is that slow or idle
+connections no longer use up a worker's threads.
+
+Needs the uvicorn package, which is not in requirements.txt; install it
+(`pip install uvicorn`) in images that use this configuration.
+"""
+
+import os
+
+# Read by config.settings; must be set before the preloaded app imports it.
+os.environ.setdefault("DJANGO_ASYNC_VIEWS", "1")
+
+# Server socket - bind to different port for nginx upstream
+bind = "127.0.0.1:8001"
+
+# Worker processes
+workers = 2
+worker_class = "uvicorn.workers.UvicornWorker"
+worker_connections = 1000
+max_requests = 10000
+max_requests_jitter = 1000
+
+# Timeouts
+timeout = 300
+keepalive = 5
+graceful_timeout = 30
+
+# Logging to stdout/stderr
+accesslog = "-"
+errorlog = "-"
+loglevel = "info"
+
+# Process naming
+proc_name = "django_api_asgi"
+
+# Server mechanics
+daemon = False
+umask = 0o007
+
+# Security
+limit_request_line = 8190
+limit_request_fields = 100
+limit_request_field_size = 8190
+
+# Preload app for better performance
+preload_app = True
+
+
+def when_ready(server):
+    # One WAL checkpointer per database for the whole deployment, in the
+    # master process.
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    from django.conf import settings
+
+    from api.sqlite import start_wal_checkpointer
+
+    for alias in ["default", *settings.ROOM_SHARDS]:
+        start_wal_checkpointer(alias)
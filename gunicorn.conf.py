@@ -1,11 +1,19 @@
 """Gunicorn configuration for Docker deployment"""
 
+import os
+
 # Server socket - bind to different port for nginx upstream
 bind = "127.0.0.1:8001"
 
 # Worker processes
+# gthread parks each long-polling request (/api/messages/wait/) on a cheap
+# thread instead of occupying a whole sync worker process. Every thread that
+# has served a request keeps its own SQLite connections (see SQLITE_PRAGMAS
+# in config/settings.py for the memory they take), and all writes queue on
+# one lock anyway, so more threads mostly buy more parked long-polls.
 workers = 2
-worker_class = "sync"
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "64"))
 worker_connections = 1000
 max_requests = 10000
 max_requests_jitter = 1000
@@ -36,3 +44,15 @@ limit_request_field_size = 8190
 
 # Preload app for better performance
 preload_app = True
+
+
+def when_ready(server):
+    # One WAL checkpointer per database for the whole deployment, in the
+    # master process.
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    from django.conf import settings
+
+    from api.sqlite import start_wal_checkpointer
+
+    for alias in ["default", *settings.ROOM_SHARDS]:
+        start_wal_checkpointer(alias)
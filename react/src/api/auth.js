@@ -42,3 +42,16 @@ export const getCurrentUser = async () => {
   });
   return response.data;
 };
+
+/**
+ * Revoke the current token on the server
+ * @returns {Promise}
+ */
+export const logout = async () => {
+  const token = getToken();
+  await instance.post('/api/auth/logout/', {}, {
+    headers: {
+      Authorization: `Bearer ${token}`,
+    },
+  });
+};
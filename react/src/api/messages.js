@@ -1,39 +1,107 @@
 import instance from './axios.js';
 import { getToken } from '../utils/auth.js';
 
+// Last response per query, revalidated with If-None-Match
+const MAX_CACHED_PAGES = 20;
+const pageCache = new Map();
+
 /**
- * Get all chat messages
- * @returns {Promise} - Promise with messages array
+ * Get a page of chat messages. Sends back the ETag of the previous response
+ * for the same params and reuses its data when the server answers 304.
+ * @param {Object} [params] - Optional pagination params: limit, before, after
+ * @returns {Promise} - Promise with { results, next, previous }
  */
-export const getMessages = async () => {
+export const getMessages = async (params = {}) => {
   const token = getToken();
-  
+  const key = JSON.stringify(params);
+  const cached = pageCache.get(key);
+
+  const headers = {
+    'Authorization': `Bearer ${token}`,
+  };
+  if (cached) {
+    headers['If-None-Match'] = cached.etag;
+  }
+
   const response = await instance.get('/api/messages/', {
+    params,
+    headers,
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+  });
+
+  if (response.status === 304 && cached) {
+    return cached.data;
+  }
+
+  const etag = response.headers.etag;
+  if (etag) {
+    pageCache.delete(key);
+    pageCache.set(key, { etag, data: response.data });
+    if (pageCache.size > MAX_CACHED_PAGES) {
+      pageCache.delete(pageCache.keys().next().value);
+    }
+  }
+
+  return response.data;
+};
+
+/**
+ * Wait (long-poll) for messages newer than the given high-water mark
+ * @param {number} sinceId - Id of the newest message the client already has
+ * @param {number} [timeout] - Seconds the server may hold the request
+ * @returns {Promise} - Promise with { results, high_water_mark, has_more }
+ */
+export const waitForMessages = async (sinceId, timeout = 25) => {
+  const token = getToken();
+
+  const response = await instance.get('/api/messages/wait/', {
+    params: { since_id: sinceId, timeout },
     headers: {
       'Authorization': `Bearer ${token}`,
     },
   });
-  
+
   return response.data;
 };
 
+const SEND_ATTEMPTS = 3;
+const SEND_RETRY_DELAY_MS = 1000;
+
+const newIdempotencyKey = () => (
+  window.crypto?.randomUUID?.()
+    ?? `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+);
+
 /**
- * Send a new message to chat
+ * Send a new message to chat. A request that fails without a response (or
+ * with a 5xx) is retried with the same Idempotency-Key, so the server stores
+ * the message once however many attempts reach it.
  * @param {string} text - Message text content
  * @returns {Promise} - Promise with created message object
  */
 export const sendMessage = async (text) => {
   const token = getToken();
-  
-  const response = await instance.post(
-    '/api/messages/',
-    { text },
-    {
-      headers: {
-        'Authorization': `Bearer ${token}`,
-      },
+  const idempotencyKey = newIdempotencyKey();
+
+  for (let attempt = 1; ; attempt += 1) {
+    try {
+      const response = await instance.post(
+        '/api/messages/',
+        { text },
+        {
+          headers: {
+            'Authorization': `Bearer ${token}`,
+            'Idempotency-Key': idempotencyKey,
+          },
+        }
+      );
+      return response.data;
+    } catch (error) {
+      const retryable = !error.response || error.response.status >= 500;
+      if (!retryable || attempt >= SEND_ATTEMPTS) {
+        throw error;
+      }
+      await new Promise((resolve) => setTimeout(resolve, SEND_RETRY_DELAY_MS * attempt));
     }
-  );
-  
-  return response.data;
+  }
 };
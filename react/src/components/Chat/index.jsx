@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { getMessages, sendMessage } from '../../api/messages';
+import { getMessages, waitForMessages, sendMessage } from '../../api/messages';
 import './styles.css';
 
 const Chat = () => {
@@ -9,16 +9,32 @@ const Chat = () => {
   const [loading, setLoading] = useState(true);
   const [sending, setSending] = useState(false);
   const messagesEndRef = useRef(null);
+  const highWaterMarkRef = useRef(null);
   const navigate = useNavigate();
 
+  const RETRY_DELAY_MS = 3000;
+
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
   useEffect(() => {
-    loadMessages();
+    const active = { current: true };
+    loadMessages().then(() => syncMessages(active));
+    return () => {
+      active.current = false;
+    };
   }, []);
 
+  const appendMessages = (newMessages) => {
+    if (newMessages.length === 0) return;
+    setMessages((current) => {
+      const known = new Set(current.map((message) => message.id));
+      return [...current, ...newMessages.filter((message) => !known.has(message.id))]
+        .sort((a, b) => a.id - b.id);
+    });
+  };
+
   useEffect(() => {
     scrollToBottom();
   }, [messages]);
@@ -27,7 +43,10 @@ const Chat = () => {
     try {
       setLoading(true);
       const data = await getMessages();
-      setMessages(data);
+      setMessages(data.results);
+      highWaterMarkRef.current = data.results.length > 0
+        ? data.results[data.results.length - 1].id
+        : 0;
     } catch (error) {
       console.error('Ошибка загрузки сообщений:', error);
       if (error.response && error.response.status === 401) {
@@ -38,6 +57,24 @@ const Chat = () => {
     }
   };
 
+  const syncMessages = async (active) => {
+    while (active.current && highWaterMarkRef.current !== null) {
+      try {
+        const data = await waitForMessages(highWaterMarkRef.current);
+        if (!active.current) return;
+        appendMessages(data.results);
+        highWaterMarkRef.current = data.high_water_mark;
+      } catch (error) {
+        console.error('Ошибка синхронизации сообщений:', error);
+        if (error.response && error.response.status === 401) {
+          navigate('/login');
+          return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, RETRY_DELAY_MS));
+      }
+    }
+  };
+
   const handleSendMessage = async (e) => {
     e.preventDefault();
     if (!messageText.trim() || sending) return;
@@ -45,7 +82,7 @@ const Chat = () => {
     try {
       setSending(true);
       const newMessage = await sendMessage(messageText);
-      setMessages([...messages, newMessage]);
+      appendMessages([newMessage]);
       setMessageText('');
     } catch (error) {
       console.error('Ошибка отправки сообщения:', error);
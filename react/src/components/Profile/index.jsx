@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { getCurrentUser } from '../../api/auth';
+import { getCurrentUser, logout } from '../../api/auth';
 import { removeToken } from '../../utils/auth';
 import './styles.css';
 
@@ -28,9 +28,15 @@ const Profile = () => {
     }
   };
 
-  const handleLogout = () => {
-    removeToken();
-    navigate('/login');
+  const handleLogout = async () => {
+    try {
+      await logout();
+    } catch (error) {
+      console.error('Ошибка выхода:', error);
+    } finally {
+      removeToken();
+      navigate('/login');
+    }
   };
 
   const handleBackToChat = () => {